@@ -25,4 +25,8 @@ echo "📦 Instalando dependências Python..."
 cd ../simple_split_backend
 pip install -r requirements.txt
 
+# Atualizar o schema do banco uma única vez (não em cada worker do gunicorn)
+echo "🗄️ Atualizando schema do banco..."
+flask --app app:create_app upgrade-schema
+
 echo "✅ Build completo - Frontend + Backend!"
\ No newline at end of file
@@ -17,6 +17,20 @@ def create_app():
     app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'jwt-simple-split-secret-2025')
     app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
     
+    # Otimização de dívidas em background ('0' roda na própria requisição, útil em testes)
+    app.config['OPTIMIZATION_ASYNC'] = os.environ.get('OPTIMIZATION_ASYNC', '1') != '0'
+    
+    # Livro de ofertas do marketplace em memória: idade máxima em segundos antes de
+    # recarregar do banco ('0' desliga e a listagem volta a consultar o SQL)
+    app.config['ORDER_BOOK_MAX_AGE'] = float(os.environ.get('ORDER_BOOK_MAX_AGE', '30'))
+    
+    # Intervalo da reconciliação das estatísticas do marketplace com a tabela receivables
+    app.config['MARKETPLACE_STATS_RECONCILE_SECONDS'] = float(os.environ.get('MARKETPLACE_STATS_RECONCILE_SECONDS', '3600'))
+    
+    # Snapshot do dashboard (profile, summary, insights) reaproveitado entre requisições até
+    # um commit com escrita ou esta idade em segundos ('0' calcula uma vez por requisição)
+    app.config['DASHBOARD_SNAPSHOT_MAX_AGE'] = float(os.environ.get('DASHBOARD_SNAPSHOT_MAX_AGE', '10'))
+    
     # Evitar redirecionamentos automáticos que quebram CORS
     app.url_map.strict_slashes = False
     
@@ -44,6 +58,14 @@ def create_app():
     app.register_blueprint(marketplace_bp, url_prefix='/api/marketplace')
     app.register_blueprint(user_bp, url_prefix='/api/user')
     
+    # Migrações: rodar uma vez por deploy, antes de subir os workers
+    @app.cli.command('upgrade-schema')
+    def upgrade_schema_command():
+        """Cria tabelas, colunas e índices novos e semeia leases e estatísticas"""
+        from app.services.migrations import upgrade_schema
+        upgrade_schema()
+        print("Schema atualizado com sucesso!")
+    
     # Rota de compatibilidade para /api/users/profile
     from app.routes.user import get_user_profile
     app.add_url_rule('/api/users/profile', 'users_profile', get_user_profile, methods=['GET'])
@@ -77,6 +99,8 @@ def create_app():
         response.headers["Access-Control-Allow-Headers"] = "Content-Type,Authorization"
         response.headers["Access-Control-Allow-Methods"] = "GET,PUT,POST,DELETE,OPTIONS"
         response.headers["Access-Control-Allow-Credentials"] = "true"
+        # Headers lidos pelo cliente: cursor da próxima página e versão do livro de ofertas
+        response.headers["Access-Control-Expose-Headers"] = "X-Next-Cursor, X-Order-Book-Version"
         return response
     
     # Servir Flutter Web (Frontend)
@@ -5,5 +5,11 @@ from .debt import Debt
 from .receivable import Receivable
 from .wallet import Wallet
 from .log import Log
+from .group_balance import GroupBalance
+from .optimization_dirty import OptimizationDirty
+from .optimization_lease import OptimizationLease
+from .optimization_job import OptimizationJob
+from .data_version import DataVersion
+from .marketplace_stats import MarketplaceStats, MarketplaceDailyStats
 
-__all__ = ['User', 'Group', 'Expense', 'Debt', 'Receivable', 'Wallet', 'Log']
\ No newline at end of file
+__all__ = ['User', 'Group', 'Expense', 'Debt', 'Receivable', 'Wallet', 'Log', 'GroupBalance', 'OptimizationDirty', 'OptimizationLease', 'OptimizationJob', 'DataVersion', 'MarketplaceStats', 'MarketplaceDailyStats']
\ No newline at end of file
@@ -0,0 +1,8 @@
+from app import db
+
+class DataVersion(db.Model):
+    """Versão de um conjunto de dados, incrementada a cada escrita comitada (invalida caches entre processos)"""
+    __tablename__ = 'data_versions'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
@@ -6,21 +6,30 @@ class Debt(db.Model):
     __tablename__ = 'debts'
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    expense_id = db.Column(db.String(36), db.ForeignKey('expenses.id'), nullable=False)
+    expense_id = db.Column(db.String(36), db.ForeignKey('expenses.id'), nullable=True)  # Nulo nas transferências da liquidação
+    group_id = db.Column(db.String(36), db.ForeignKey('groups.id'), nullable=True)  # Grupo da despesa ou da liquidação
     debtor_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
     creditor_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
     amount = db.Column(db.Float, nullable=False)
     status = db.Column(db.String(20), default='pending')  # pending, paid, cancelled, sold_as_title
-    source = db.Column(db.String(20), default='group_debt')  # group_debt, purchased_title, virtual_payment
+    source = db.Column(db.String(20), default='group_debt')  # group_debt, settlement, purchased_title, virtual_payment
     due_date = db.Column(db.Date, nullable=True)
     paid_at = db.Column(db.DateTime, nullable=True)
     sold_at = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_debts_debtor_status', 'debtor_id', 'status'),
+        db.Index('ix_debts_creditor_status', 'creditor_id', 'status'),
+        db.Index('ix_debts_expense_status', 'expense_id', 'status'),
+        db.Index('ix_debts_group_status', 'group_id', 'status'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
             'expense_id': self.expense_id,
+            'group_id': self.group_id,
             'debtor_id': self.debtor_id,
             'debtor_name': self.debtor.name if self.debtor else None,
             'creditor_id': self.creditor_id,
@@ -32,12 +41,34 @@ class Debt(db.Model):
             'paid_at': self.paid_at.isoformat() if self.paid_at else None,
             'sold_at': self.sold_at.isoformat() if self.sold_at else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
-            'expense_description': self.expense.description if self.expense else None
+            'expense_description': self.description
         }
     
+    @property
+    def description(self):
+        """Descrição da origem da dívida (despesa ou liquidação do grupo)"""
+        if self.expense:
+            return self.expense.description
+        if self.source == 'settlement':
+            return 'Liquidação do grupo'
+        return None
+    
+    def set_status(self, status, track_dirty=True):
+        """Altera o status da dívida mantendo os saldos materializados dos grupos"""
+        from app.services.balance_service import BalanceService
+        from app.services.dirty_tracker import DirtyTracker
+        
+        old_status = self.status
+        self.status = status
+        BalanceService.debt_status_changed(self, old_status)
+        
+        # Marcar grupo e par para a próxima otimização incremental
+        if track_dirty:
+            DirtyTracker.mark_debt(self)
+    
     def mark_as_paid(self):
         """Marca a dívida como paga e atualiza scores"""
-        self.status = 'paid'
+        self.set_status('paid')
         self.paid_at = datetime.utcnow()
         
         # Atualizar scores
@@ -48,7 +79,7 @@ class Debt(db.Model):
     
     def cancel(self):
         """Cancela a dívida"""
-        self.status = 'cancelled'
+        self.set_status('cancelled')
         db.session.commit()
     
     @classmethod
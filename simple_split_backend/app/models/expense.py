@@ -13,6 +13,11 @@ class Expense(db.Model):
     date = db.Column(db.Date, default=datetime.utcnow().date())
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_expenses_group_date', 'group_id', 'date'),
+        db.Index('ix_expenses_payer_date', 'payer_id', 'date'),
+    )
+    
     # Relacionamentos
     debts = db.relationship('Debt', backref='expense', cascade='all, delete-orphan')
     
@@ -30,33 +35,50 @@ class Expense(db.Model):
         }
     
     def split_expense(self, member_ids=None):
-        """Divide a despesa entre os membros do grupo"""
+        """Divide a despesa entre os membros do grupo (um único INSERT e um único commit)"""
+        from app.services.balance_service import BalanceService
+        from app.services.dirty_tracker import DirtyTracker
+        from app.models.debt import Debt
+        
+        # Despesa ainda não gravada (mesma transação da criação)
+        db.session.flush()
+        
+        # Atualizar saldos materializados do grupo na mesma transação
+        BalanceService.apply_expense(self)
+        
         # Se não especificou membros, divide entre todos do grupo
         if not member_ids:
             from app.models.user import GroupMember
-            group_members = GroupMember.query.filter_by(group_id=self.group_id).all()
-            member_ids = [member.user_id for member in group_members]
+            member_ids = [
+                user_id for (user_id,) in
+                db.session.query(GroupMember.user_id).filter(GroupMember.group_id == self.group_id)
+            ]
         
         # Remove o pagador da lista se ele estiver incluído
-        if self.payer_id in member_ids:
-            member_ids.remove(self.payer_id)
+        member_ids = [member_id for member_id in member_ids if member_id != self.payer_id]
         
         if not member_ids:
+            db.session.commit()
             return  # Ninguém deve nada
         
         # Calcula o valor que cada um deve
         amount_per_person = self.amount / (len(member_ids) + 1)  # +1 para incluir o pagador
         
-        # Criar dívidas
-        from app.models.debt import Debt
-        for debtor_id in member_ids:
-            debt = Debt(
-                expense_id=self.id,
-                debtor_id=debtor_id,
-                creditor_id=self.payer_id,
-                amount=amount_per_person,
-                status='pending'
-            )
-            db.session.add(debt)
-        
-        db.session.commit()
\ No newline at end of file
+        # Criar dívidas em lote (executemany), sem instanciar um objeto por membro
+        db.session.execute(Debt.__table__.insert(), [
+            {
+                'expense_id': self.id,
+                'group_id': self.group_id,
+                'debtor_id': debtor_id,
+                'creditor_id': self.payer_id,
+                'amount': amount_per_person,
+                'status': 'pending',
+                'source': 'group_debt'
+            }
+            for debtor_id in member_ids
+        ])
+        
+        # Novas dívidas: grupo e pares entram na próxima otimização
+        DirtyTracker.mark_pairs([(debtor_id, self.payer_id) for debtor_id in member_ids], group_id=self.group_id)
+        
+        db.session.commit()
@@ -1,4 +1,5 @@
 from app import db
+from sqlalchemy import event
 from datetime import datetime
 import uuid
 
@@ -12,6 +13,11 @@ class Group(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Contadores mantidos pelos eventos de GroupMember/Expense (evita carregar as coleções)
+    members_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    expenses_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    total_expenses = db.Column(db.Float, nullable=False, default=0.0, server_default='0')
+    
     # Relacionamentos
     creator = db.relationship('User', backref='created_groups')
     members = db.relationship('GroupMember', backref='group', cascade='all, delete-orphan')
@@ -25,11 +31,16 @@ class Group(db.Model):
             'created_by': self.created_by,
             'creator_name': self.creator.name if self.creator else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
-            'members_count': len(self.members),
-            'expenses_count': len(self.expenses),
-            'total_expenses': sum([expense.amount for expense in self.expenses])
+            'members_count': self.members_count or 0,
+            'expenses_count': self.expenses_count or 0,
+            'total_expenses': self.total_expenses or 0
         }
     
+    @staticmethod
+    def adjust_counters(group_id, **deltas):
+        """Ajusta os contadores quando membros/despesas são gravados sem o ORM (inserts em lote)"""
+        _adjust_counters(db.session.connection(), group_id, **deltas)
+    
     def get_members(self):
         """Retorna lista de membros do grupo"""
         from app.models.user import User
@@ -46,8 +57,53 @@ class Group(db.Model):
         ).first()
         
         if not existing_member:
+            from app.services.balance_service import BalanceService
+            
             new_member = GroupMember(user_id=user_id, group_id=self.id)
             db.session.add(new_member)
+            
+            # A divisão igual muda com o novo membro: recalcular saldos do grupo
+            BalanceService.rebuild_group(self.id)
             db.session.commit()
             return True
-        return False
\ No newline at end of file
+        return False
+
+def _adjust_counters(connection, group_id, **deltas):
+    # UPDATE atômico na mesma conexão do flush (sem mexer em updated_at)
+    groups = Group.__table__
+    connection.execute(
+        groups.update()
+        .where(groups.c.id == group_id)
+        .values(updated_at=groups.c.updated_at, **{name: groups.c[name] + delta for name, delta in deltas.items()})
+    )
+
+
+from app.models.user import GroupMember  # noqa: E402
+from app.models.expense import Expense  # noqa: E402
+
+
+@event.listens_for(GroupMember, 'after_insert')
+def _member_added(mapper, connection, member):
+    _adjust_counters(connection, member.group_id, members_count=1)
+
+
+@event.listens_for(GroupMember, 'after_delete')
+def _member_removed(mapper, connection, member):
+    _adjust_counters(connection, member.group_id, members_count=-1)
+
+
+@event.listens_for(Expense, 'after_insert')
+def _expense_added(mapper, connection, expense):
+    _adjust_counters(connection, expense.group_id, expenses_count=1, total_expenses=expense.amount)
+
+
+@event.listens_for(Expense, 'after_delete')
+def _expense_removed(mapper, connection, expense):
+    _adjust_counters(connection, expense.group_id, expenses_count=-1, total_expenses=-expense.amount)
+
+
+@event.listens_for(Expense, 'after_update')
+def _expense_changed(mapper, connection, expense):
+    history = db.inspect(expense).attrs.amount.history
+    if history.added and history.deleted:
+        _adjust_counters(connection, expense.group_id, total_expenses=history.added[0] - history.deleted[0])
@@ -0,0 +1,22 @@
+from app import db
+from datetime import datetime
+import uuid
+
+class GroupBalance(db.Model):
+    __tablename__ = 'group_balances'
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    group_id = db.Column(db.String(36), db.ForeignKey('groups.id'), nullable=False)
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+    balance = db.Column(db.Float, default=0.0)  # Positivo = recebe, Negativo = paga
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (db.UniqueConstraint('group_id', 'user_id', name='unique_group_balance'),)
+    
+    def to_dict(self):
+        return {
+            'group_id': self.group_id,
+            'user_id': self.user_id,
+            'balance': self.balance,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
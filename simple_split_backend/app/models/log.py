@@ -13,6 +13,8 @@ class Log(db.Model):
     amount = db.Column(db.Float, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (db.Index('ix_logs_type_created', 'type', 'created_at'),)
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -0,0 +1,43 @@
+from app import db
+from datetime import datetime
+
+class MarketplaceStats(db.Model):
+    """Agregados do marketplace mantidos a cada anúncio, compra e cancelamento (linha única)"""
+    __tablename__ = 'marketplace_stats'
+
+    name = db.Column(db.String(20), primary_key=True, default='global')
+    titles_for_sale = db.Column(db.Integer, nullable=False, default=0)
+    volume_for_sale = db.Column(db.Float, nullable=False, default=0.0)   # Soma dos preços de venda
+    nominal_for_sale = db.Column(db.Float, nullable=False, default=0.0)  # Soma dos valores nominais
+    max_discount = db.Column(db.Float, nullable=False, default=0.0, server_default='0')  # Maior desconto à venda
+    titles_sold = db.Column(db.Integer, nullable=False, default=0)
+    volume_sold = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    reconciled_at = db.Column(db.DateTime, nullable=True)  # Último recálculo completo a partir de receivables
+
+
+class MarketplaceDailyStats(db.Model):
+    """Rollup diário: títulos anunciados (por created_at) e vendidos (por sold_at) no dia"""
+    __tablename__ = 'marketplace_daily_stats'
+
+    day = db.Column(db.Date, primary_key=True)
+    listed_count = db.Column(db.Integer, nullable=False, default=0)
+    listed_volume = db.Column(db.Float, nullable=False, default=0.0)
+    listed_nominal = db.Column(db.Float, nullable=False, default=0.0)
+    sold_count = db.Column(db.Integer, nullable=False, default=0)
+    sold_volume = db.Column(db.Float, nullable=False, default=0.0)
+    sold_nominal = db.Column(db.Float, nullable=False, default=0.0)
+
+    def to_dict(self):
+        return {
+            'day': self.day.isoformat(),
+            'listed': self.listed_count,
+            'listed_volume': self.listed_volume,
+            'sold': self.sold_count,
+            'sold_volume': self.sold_volume,
+            # Desconto médio dos títulos anunciados no dia (R$ e fração do nominal)
+            'average_discount': (self.listed_nominal - self.listed_volume) / self.listed_count if self.listed_count else 0,
+            'average_discount_rate': (self.listed_nominal - self.listed_volume) / self.listed_nominal if self.listed_nominal else 0,
+            # Vendidos no dia / anunciados no dia
+            'sell_through_rate': self.sold_count / self.listed_count if self.listed_count else None
+        }
@@ -0,0 +1,13 @@
+from app import db
+from datetime import datetime
+
+class OptimizationDirty(db.Model):
+    """Fila de grupos/pares de usuários alterados desde a última otimização"""
+    __tablename__ = 'optimization_dirty'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)  # Sequencial: consumo por id <= máximo lido
+    group_id = db.Column(db.String(36), nullable=True)
+    expense_id = db.Column(db.String(36), nullable=True)  # Grupo resolvido na leitura quando group_id é nulo
+    user_a = db.Column(db.String(36), nullable=True)  # Par normalizado (user_a < user_b)
+    user_b = db.Column(db.String(36), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,32 @@
+from app import db
+from datetime import datetime
+
+class OptimizationJob(db.Model):
+    """Passada de otimização agendada; o status fica no banco para qualquer worker consultar"""
+    __tablename__ = 'optimization_jobs'
+    
+    id = db.Column(db.String(36), primary_key=True)
+    group_id = db.Column(db.String(36), nullable=True)  # Grupo que disparou o job (se houver)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    optimized_count = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        db.Index('ix_optimization_jobs_group_created', 'group_id', 'created_at'),
+        db.Index('ix_optimization_jobs_finished', 'finished_at'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'group_id': self.group_id,
+            'status': self.status,
+            'optimized_count': self.optimized_count,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
@@ -0,0 +1,9 @@
+from app import db
+
+class OptimizationLease(db.Model):
+    """Lease de execução única: quem detém a linha roda a otimização (entre processos/hosts)"""
+    __tablename__ = 'optimization_leases'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    holder = db.Column(db.String(100), nullable=True)  # host:pid:token de quem detém o lease
+    expires_at = db.Column(db.DateTime, nullable=True)  # Lease vencido pode ser tomado por outro
@@ -1,7 +1,14 @@
 from app import db
+from sqlalchemy.orm.attributes import set_committed_value
 from datetime import datetime
 import uuid
 
+def _profit_estimated(context):
+    """Default da coluna profit_estimated (vale para inserts do ORM e do Core)"""
+    params = context.get_current_parameters()
+    return params['nominal_amount'] - params['selling_price']
+
+
 class Receivable(db.Model):
     __tablename__ = 'receivables'
     
@@ -12,12 +19,27 @@ class Receivable(db.Model):
     nominal_amount = db.Column(db.Float, nullable=False)  # Valor original da dívida
     selling_price = db.Column(db.Float, nullable=False)   # Valor que quer receber agora
     consolidated_group_id = db.Column(db.String(36), nullable=True)  # ID do devedor se faz parte de um grupo consolidado
+    # Lucro estimado (nominal - venda) gravado para ordenar o marketplace pelo índice
+    profit_estimated = db.Column(db.Float, nullable=False, default=_profit_estimated, server_default='0')
     status = db.Column(db.String(20), default='for_sale')  # for_sale, sold, cancelled
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     sold_at = db.Column(db.DateTime, nullable=True)
     
+    __table_args__ = (
+        db.Index('ix_receivables_status_owner', 'status', 'owner_id'),
+        db.Index('ix_receivables_buyer_status', 'buyer_id', 'status'),
+        db.Index('ix_receivables_consolidated_status', 'consolidated_group_id', 'status'),
+        db.Index('ix_receivables_status_profit', 'status', 'profit_estimated', 'id'),
+    )
+    
     # Relacionamentos
     debt = db.relationship('Debt', backref='receivable')
+    # Devedor de um título consolidado (consolidated_group_id guarda o id do usuário)
+    consolidated_debtor = db.relationship(
+        'User',
+        primaryjoin='foreign(Receivable.consolidated_group_id) == User.id',
+        viewonly=True
+    )
     # Relacionamentos são definidos no modelo User com backref
     
     def to_dict(self, anonymous=False):
@@ -50,9 +72,8 @@ class Receivable(db.Model):
             
             # Adicionar informações do devedor
             if self.consolidated_group_id:
-                # Título consolidado: buscar devedor pelo consolidated_group_id
-                from app.models.user import User
-                debtor = User.query.get(self.consolidated_group_id)
+                # Título consolidado: devedor pelo consolidated_group_id
+                debtor = self.consolidated_debtor
                 if debtor:
                     data['debtor_id'] = debtor.id
                     data['debtor_name'] = debtor.name
@@ -65,70 +86,171 @@ class Receivable(db.Model):
                 
             return data
     
+    def change_status(self, from_status, to_status, **values):
+        """UPDATE condicional (WHERE status = from_status), sem commit
+        
+        Entre requisições concorrentes só uma consegue mudar o status; as demais
+        recebem False. Em caso de sucesso a instância fica com os novos valores.
+        """
+        receivables = Receivable.__table__
+        result = db.session.execute(
+            receivables.update()
+            .where(receivables.c.id == self.id, receivables.c.status == from_status)
+            .values(status=to_status, **values)
+        )
+        if result.rowcount != 1:
+            return False
+        
+        for key, value in {'status': to_status, **values}.items():
+            set_committed_value(self, key, value)
+        return True
+    
+    def claim_for_buyer(self, buyer_id):
+        """Reserva o título à venda para o comprador (False se outro comprador venceu)"""
+        return self.change_status('for_sale', 'sold', buyer_id=buyer_id, sold_at=datetime.utcnow())
+    
     def sell_to_buyer(self, buyer_id):
         """Vende o título para um comprador"""
+        if not self.claim_for_buyer(buyer_id):
+            return False
+        return self.transfer_debts(buyer_id)
+    
+    def transfer_debts(self, buyer_id):
+        """Transfere as dívidas do título já reservado para o comprador
+        
+        Em SQL por conjunto: um INSERT ... SELECT cria as dívidas do comprador e um
+        UPDATE marca as originais como sold_as_title, sem carregar uma linha por dívida.
+        """
         from app.models.debt import Debt
         
         try:
-            # Atualizar status
-            self.buyer_id = buyer_id
-            self.status = 'sold'
-            self.sold_at = datetime.utcnow()
-            
             if self.consolidated_group_id:
-                # Título consolidado: transferir todas as dívidas deste devedor
-                print(f"[DEBUG] Looking for debts to transfer: creditor={self.owner_id}, debtor={self.consolidated_group_id}")
-                
-                debts_to_transfer = Debt.query.filter_by(
-                    creditor_id=self.owner_id,
-                    debtor_id=self.consolidated_group_id,
-                    status='pending'
-                ).all()
-                
-                print(f"[DEBUG] Found {len(debts_to_transfer)} debts to transfer")
-                for i, debt in enumerate(debts_to_transfer):
-                    print(f"[DEBUG] Transferring debt {i+1}: {debt.id} (R$ {debt.amount})")
-                    # Criar uma nova dívida para o comprador
-                    new_debt = Debt(
-                        expense_id=debt.expense_id,
-                        debtor_id=debt.debtor_id,
-                        creditor_id=buyer_id,
-                        amount=debt.amount,
-                        status='pending',
-                        source='purchased_title',
-                        due_date=debt.due_date
-                    )
-                    db.session.add(new_debt)
-                    
-                    # Marcar a dívida original como vendida
-                    debt.status = 'sold_as_title'
-                    debt.sold_at = datetime.utcnow()
-                    
-                print(f"[DEBUG] Transferred {len(debts_to_transfer)} debts from {self.consolidated_group_id} to {buyer_id}")
-            elif self.debt:
-                # Título individual: criar nova dívida para o comprador
-                print(f"[DEBUG] Transferring individual debt {self.debt.id} to buyer {buyer_id}")
-                
-                # Criar nova dívida para o comprador
-                new_debt = Debt(
-                    expense_id=self.debt.expense_id,
-                    debtor_id=self.debt.debtor_id,
-                    creditor_id=buyer_id,
-                    amount=self.debt.amount,
-                    status='pending',
-                    source='purchased_title',
-                    due_date=self.debt.due_date
-                )
-                db.session.add(new_debt)
-                
-                # Marcar a dívida original como vendida
-                self.debt.status = 'sold_as_title'
-                self.debt.sold_at = datetime.utcnow()
+                # Título consolidado: todas as dívidas pendentes deste devedor
+                criteria = [
+                    Debt.creditor_id == self.owner_id,
+                    Debt.debtor_id == self.consolidated_group_id,
+                    Debt.status == 'pending'
+                ]
+            elif self.debt_id:
+                # Título individual: a dívida do título
+                criteria = [Debt.id == self.debt_id]
             else:
                 print(f"[DEBUG] No consolidated_group_id or individual debt found, nothing to transfer")
+                return True
+            
+            transferred = _copy_debts_to_buyer(criteria, buyer_id)
+            _set_debts_status(criteria, 'sold_as_title', extra_pairs=[buyer_id], sold_at=datetime.utcnow())
+            print(f"[DEBUG] Transferred {transferred} debts of receivable {self.id[:8]}... to {buyer_id}")
             
             # Não commitamos aqui, deixamos o marketplace.py gerenciar a transação
             return True
         except Exception as e:
-            print(f"[ERROR] Error in sell_to_buyer: {str(e)}")
-            return False
\ No newline at end of file
+            print(f"[ERROR] Error in transfer_debts: {str(e)}")
+            return False
+    
+    def revert_debts(self):
+        """Volta para pending as dívidas sold_as_title de um título retirado de venda (um UPDATE)"""
+        from app.models.debt import Debt
+        
+        if self.consolidated_group_id:
+            criteria = [Debt.creditor_id == self.owner_id, Debt.debtor_id == self.consolidated_group_id]
+        elif self.debt_id:
+            criteria = [Debt.id == self.debt_id]
+        else:
+            return 0
+        
+        return _set_debts_status([*criteria, Debt.status == 'sold_as_title'], 'pending', sold_at=None)
+
+
+def _new_uuid_sql():
+    """Expressão SQL que gera um UUID v4 em texto no próprio banco (None se o dialeto não tiver)"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return db.cast(db.func.gen_random_uuid(), db.String(36))
+    if dialect in ('mysql', 'mariadb'):
+        return db.func.uuid()
+    if dialect == 'sqlite':
+        return db.literal_column(
+            "lower(hex(randomblob(4)) || '-' || hex(randomblob(2)) || '-4' || substr(hex(randomblob(2)), 2) || '-'"
+            " || substr('89ab', 1 + abs(random()) % 4, 1) || substr(hex(randomblob(2)), 2) || '-' || hex(randomblob(6)))"
+        )
+    return None
+
+
+def _copy_debts_to_buyer(criteria, buyer_id):
+    """INSERT ... SELECT: uma dívida pendente para o comprador por dívida filtrada; retorna quantas"""
+    from app.models.debt import Debt
+    
+    debts = Debt.__table__
+    columns = ['expense_id', 'group_id', 'debtor_id', 'creditor_id', 'amount', 'status', 'source', 'due_date', 'created_at']
+    copied = [
+        Debt.expense_id,
+        Debt.group_id,
+        Debt.debtor_id,
+        db.literal(buyer_id, db.String(36)),
+        Debt.amount,
+        db.literal('pending', db.String(20)),
+        db.literal('purchased_title', db.String(20)),
+        Debt.due_date,
+        db.literal(datetime.utcnow(), db.DateTime)
+    ]
+    
+    id_expression = _new_uuid_sql()
+    if id_expression is None:
+        # Dialeto sem gerador de UUID: ids gerados no Python, ainda em um único executemany
+        rows = db.session.execute(db.select(*copied).where(*criteria)).all()
+        if rows:
+            db.session.execute(debts.insert(), [
+                {'id': str(uuid.uuid4()), **dict(zip(columns, row))} for row in rows
+            ])
+        return len(rows)
+    
+    result = db.session.execute(
+        debts.insert().from_select(['id', *columns], db.select(id_expression, *copied).where(*criteria))
+    )
+    return result.rowcount
+
+
+def _set_debts_status(criteria, status, extra_pairs=(), **values):
+    """UPDATE em lote do status das dívidas filtradas, mantendo saldos e fila de otimização
+    
+    Os saldos materializados mudam só para as dívidas que entram ou saem de
+    SETTLED_STATUSES. extra_pairs: credores adicionais (ex.: comprador) a marcar com cada devedor.
+    """
+    from app.models.debt import Debt
+    from app.services.balance_service import BalanceService, SETTLED_STATUSES
+    from app.services.dirty_tracker import DirtyTracker
+    from collections import defaultdict
+    
+    entering = status in SETTLED_STATUSES
+    changing_weight = ~Debt.status.in_(SETTLED_STATUSES) if entering else Debt.status.in_(SETTLED_STATUSES)
+    
+    # Soma por grupo e par (uma consulta); pares sem mudança de peso entram com zero
+    totals = db.session.query(
+        Debt.group_id, Debt.debtor_id, Debt.creditor_id,
+        db.func.sum(db.case((changing_weight, Debt.amount), else_=0.0))
+    ).filter(Debt.group_id.isnot(None), *criteria).group_by(
+        Debt.group_id, Debt.debtor_id, Debt.creditor_id
+    ).all()
+    
+    debts = Debt.__table__
+    updated = db.session.execute(
+        debts.update().where(*criteria).values(status=status, **values)
+    ).rowcount
+    
+    sign = 1 if entering else -1
+    deltas_by_group = defaultdict(lambda: defaultdict(float))
+    pairs_by_group = defaultdict(set)
+    for group_id, debtor_id, creditor_id, amount in totals:
+        deltas_by_group[group_id][debtor_id] += sign * amount
+        deltas_by_group[group_id][creditor_id] -= sign * amount
+        pairs_by_group[group_id].add((debtor_id, creditor_id))
+        for other_id in extra_pairs:
+            pairs_by_group[group_id].add((debtor_id, other_id))
+    
+    for group_id, deltas in deltas_by_group.items():
+        BalanceService.apply_deltas(group_id, deltas)
+    for group_id, group_pairs in pairs_by_group.items():
+        DirtyTracker.mark_pairs(group_pairs, group_id=group_id)
+    
+    return updated
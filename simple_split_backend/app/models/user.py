@@ -41,13 +41,14 @@ class User(db.Model):
             'wallet_balance': self.wallet.balance if self.wallet else 0.0
         }
     
-    def update_score(self, payment_on_time=True):
+    def update_score(self, payment_on_time=True, auto_commit=True):
         """Atualiza o score do usuário baseado no histórico de pagamentos"""
         if payment_on_time:
             self.score = min(10.0, self.score + 0.1)
         else:
             self.score = max(0.0, self.score - 0.5)
-        db.session.commit()
+        if auto_commit:
+            db.session.commit()
 
 
 class GroupMember(db.Model):
@@ -58,4 +59,7 @@ class GroupMember(db.Model):
     group_id = db.Column(db.String(36), db.ForeignKey('groups.id'), nullable=False)
     joined_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    __table_args__ = (db.UniqueConstraint('user_id', 'group_id', name='unique_user_group'),)
\ No newline at end of file
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'group_id', name='unique_user_group'),
+        db.Index('ix_group_members_group', 'group_id'),
+    )
\ No newline at end of file
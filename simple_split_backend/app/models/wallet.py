@@ -1,4 +1,5 @@
 from app import db
+from sqlalchemy.orm.attributes import set_committed_value
 from datetime import datetime
 import uuid
 
@@ -25,7 +26,7 @@ class Wallet(db.Model):
     
     def add_funds(self, amount, description="Adicionar saldo", auto_commit=True):
         """Adiciona fundos à carteira"""
-        self.balance += amount
+        self._apply_delta(amount)
         
         transaction = Transaction(
             wallet_id=self.id,
@@ -40,22 +41,52 @@ class Wallet(db.Model):
         return True
     
     def withdraw_funds(self, amount, description="Saque", auto_commit=True):
-        """Remove fundos da carteira"""
-        if self.balance >= amount:
-            self.balance -= amount
-            
-            transaction = Transaction(
-                wallet_id=self.id,
-                type='debit',
-                amount=amount,
-                description=description
-            )
-            db.session.add(transaction)
-            
-            if auto_commit:
-                db.session.commit()
-            return True
-        return False
+        """Remove fundos da carteira (False se o saldo no banco não cobre o valor)"""
+        if not self._apply_delta(-amount, minimum_balance=amount):
+            return False
+        
+        transaction = Transaction(
+            wallet_id=self.id,
+            type='debit',
+            amount=amount,
+            description=description
+        )
+        db.session.add(transaction)
+        
+        if auto_commit:
+            db.session.commit()
+        return True
+    
+    def _apply_delta(self, delta, minimum_balance=None):
+        """UPDATE atômico balance = balance + delta, condicionado a balance >= minimum_balance
+
+        Não lê o saldo antes de escrever, então requisições concorrentes (vários workers)
+        não perdem atualizações. Atualiza self.balance com o valor gravado no banco.
+        """
+        if self.id is None:
+            db.session.flush()
+        criteria = [Wallet.id == self.id]
+        if minimum_balance is not None:
+            criteria.append(Wallet.balance >= minimum_balance)
+        statement = (
+            db.update(Wallet)
+            .where(*criteria)
+            .values(balance=db.func.coalesce(Wallet.balance, 0.0) + delta)
+            .execution_options(synchronize_session=False)
+        )
+        
+        if db.session.get_bind().dialect.update_returning:
+            balance = db.session.execute(statement.returning(Wallet.balance)).scalar()
+            if balance is None:
+                return False
+        else:
+            if db.session.execute(statement).rowcount != 1:
+                return False
+            balance = db.session.query(Wallet.balance).filter(Wallet.id == self.id).scalar()
+        
+        set_committed_value(self, 'balance', balance)
+        db.session.expire(self, ['updated_at'])
+        return True
 
 
 class Transaction(db.Model):
@@ -68,6 +99,8 @@ class Transaction(db.Model):
     description = db.Column(db.String(200), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (db.Index('ix_transactions_wallet_created', 'wallet_id', 'created_at'),)
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -4,6 +4,8 @@ from app import db
 from app.models.user import User
 from app.models.receivable import Receivable
 from app.models.debt import Debt
+from app.services.serializer_service import SerializerService
+from collections import defaultdict
 
 contacts_bp = Blueprint('contacts', __name__)
 
@@ -29,18 +31,19 @@ def get_contacts():
     # Buscar os usuários
     contacts = User.query.filter(User.id.in_(contact_ids)).all()
     
-    # Para cada contato, buscar anúncios de recebíveis
+    # Recebíveis à venda de todos os contatos em uma única consulta
+    receivables = Receivable.query.filter(
+        Receivable.owner_id.in_(contact_ids),
+        Receivable.status == 'for_sale'
+    ).all()
+    receivables_by_owner = defaultdict(list)
+    for receivable, receivable_data in zip(receivables, SerializerService.receivables_to_dict(receivables)):
+        receivables_by_owner[receivable.owner_id].append(receivable_data)
+    
+    # Para cada contato, anexar seus anúncios de recebíveis
     contacts_data = []
-    for contact in contacts:
-        contact_data = contact.to_dict()
-        
-        # Buscar recebíveis à venda deste contato
-        receivables = Receivable.query.filter_by(
-            owner_id=contact.id, 
-            status='for_sale'
-        ).all()
-        
-        contact_data['receivables_for_sale'] = [r.to_dict() for r in receivables]
+    for contact, contact_data in zip(contacts, SerializerService.users_to_dict(contacts)):
+        contact_data['receivables_for_sale'] = receivables_by_owner[contact.id]
         contacts_data.append(contact_data)
     
     return jsonify(contacts_data)
@@ -54,7 +57,7 @@ def get_all_users():
     # Buscar todos os usuários exceto o atual
     users = User.query.filter(User.id != user_id).all()
     
-    return jsonify([user.to_dict() for user in users])
+    return jsonify(SerializerService.users_to_dict(users))
 
 @contacts_bp.route('/<int:contact_id>/receivables', methods=['GET'])
 @jwt_required()
@@ -66,7 +69,7 @@ def get_contact_receivables(contact_id):
         status='for_sale'
     ).all()
     
-    return jsonify([r.to_dict() for r in receivables])
+    return jsonify(SerializerService.receivables_to_dict(receivables))
 
 @contacts_bp.route('/search', methods=['GET'])
 @jwt_required()
@@ -87,4 +90,4 @@ def search_contacts():
         )
     ).limit(10).all()
     
-    return jsonify([user.to_dict() for user in users])
\ No newline at end of file
+    return jsonify(SerializerService.users_to_dict(users))
\ No newline at end of file
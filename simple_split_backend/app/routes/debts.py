@@ -4,9 +4,15 @@ from app import db
 from app.models.debt import Debt
 from app.models.user import User
 from app.models.receivable import Receivable
+from app.services.settlement_service import SettlementService
+from app.services.serializer_service import SerializerService, ID_CHUNK_SIZE
+from app.services.balance_service import BalanceService
 
 debts_bp = Blueprint('debts', __name__)
 
+# Teto (segundos) do orçamento de tempo do cancelamento de ciclos por requisição
+MAX_CYCLE_TIME_BUDGET = 5.0
+
 @debts_bp.route('/', methods=['GET'])
 @jwt_required()
 def get_user_debts():
@@ -17,6 +23,10 @@ def get_user_debts():
     debts_as_debtor = Debt.get_pending_debts(debtor_id=user_id).all()
     debts_as_creditor = Debt.get_pending_debts(creditor_id=user_id).all()
     
+    # Usuários e despesas das duas listas em dois IN; títulos vendidos de cada devedor em mais um
+    SerializerService.prefetch_debts(debts_as_debtor + debts_as_creditor)
+    sold_title_buyers = _sold_title_buyers({debt.debtor_id for debt in debts_as_creditor})
+    
     # Converter para dicionário com informações extras
     debts_data = []
     
@@ -27,7 +37,7 @@ def get_user_debts():
         debt_dict['amount'] = -abs(debt_dict['amount'])  # valor negativo
         debt_dict['other_user'] = debt.creditor.name
         debt_dict['other_user_id'] = debt.creditor_id
-        debt_dict['expense_description'] = debt.expense.description if debt.expense else 'Despesa removida'
+        debt_dict['expense_description'] = debt.description or 'Despesa removida'
         debts_data.append(debt_dict)
     
     # Dívidas onde devem ao usuário - CONSOLIDAR POR DEVEDOR
@@ -47,18 +57,13 @@ def get_user_debts():
         amount = abs(debt.amount)
         
         # Identificar origem da dívida
-        related_receivable = Receivable.query.filter_by(
-            consolidated_group_id=debt.debtor_id,
-            status='sold'
-        ).first()
-        
-        is_purchased = (related_receivable and related_receivable.buyer_id == user_id)
+        is_purchased = sold_title_buyers.get(debtor_id) == user_id
         
         # Consolidar informações
         consolidated_debts[debtor_id]['total_amount'] += amount
         consolidated_debts[debtor_id]['debtor_name'] = debt.debtor.name
         consolidated_debts[debtor_id]['debtor_id'] = debtor_id
-        consolidated_debts[debtor_id]['descriptions'].append(debt.expense.description if debt.expense else 'Despesa removida')
+        consolidated_debts[debtor_id]['descriptions'].append(debt.description or 'Despesa removida')
         consolidated_debts[debtor_id]['debt_ids'].append(str(debt.id))
         
         if is_purchased:
@@ -114,71 +119,50 @@ def get_user_debts():
 @jwt_required()
 def get_consolidated_debts():
     """Obter dívidas consolidadas por usuário em todos os grupos (para marketplace)"""
-    from app.models.user import GroupMember
-    from app.models.expense import Expense
-    from collections import defaultdict
-    
     user_id = get_jwt_identity()
     
-    # Buscar todos os grupos do usuário
-    user_groups = GroupMember.query.filter_by(user_id=user_id).all()
-    
-    # Consolidar saldos por usuário em todos os grupos
-    global_balances = defaultdict(float)
-    
-    for group_member in user_groups:
-        group_id = group_member.group_id
-        
-        # Calcular saldos do grupo usando a mesma lógica da otimização
-        group_balances = _calculate_group_balances(group_id)
-        
-        # Somar os saldos de cada usuário globalmente
-        for other_user_id, balance in group_balances.items():
-            if other_user_id != user_id:
-                # Se balance é positivo para o outro usuário, significa que ele me deve
-                # Se balance é negativo para o outro usuário, significa que eu devo para ele
-                # Queremos apenas quem me deve (balance negativo do devedor = positivo para mim)
-                global_balances[other_user_id] -= balance  # Inverter a perspectiva
+    # Quanto cada usuário me deve somando os saldos de todos os meus grupos (uma consulta)
+    global_balances = BalanceService.balances_owed_to(user_id)
+    debtor_ids = [debtor_id for debtor_id, amount_owed in global_balances.items() if amount_owed > 0.01]
+    
+    # Devedores que já têm título meu à venda ou vendido (uma consulta para todos os meus títulos)
+    with_receivable = {
+        debtor_id for (debtor_id,) in db.session.query(Receivable.consolidated_group_id).filter(
+            Receivable.owner_id == user_id,
+            Receivable.status.in_(['for_sale', 'sold']),
+            Receivable.consolidated_group_id.isnot(None)
+        )
+    }
+    
+    # Nomes dos devedores restantes em IN por lote
+    pending_ids = [debtor_id for debtor_id in debtor_ids if debtor_id not in with_receivable]
+    debtor_names = {}
+    for start in range(0, len(pending_ids), ID_CHUNK_SIZE):
+        debtor_names.update(
+            db.session.query(User.id, User.name).filter(User.id.in_(pending_ids[start:start + ID_CHUNK_SIZE]))
+        )
     
     # Criar títulos apenas para quem me deve (saldo positivo)
     consolidated_debts = []
-    for debtor_id, amount_owed in global_balances.items():
-        if amount_owed > 0.01:  # Apenas dívidas significativas
-            # Verificar se já existe um recebível ativo para este devedor
-            existing_receivable = Receivable.query.filter_by(
-                owner_id=user_id,
-                consolidated_group_id=debtor_id,
-                status='for_sale'
-            ).first()
+    for debtor_id in debtor_ids:
+        # Se já existe recebível ativo (à venda ou vendido), pular esta dívida
+        if debtor_id in with_receivable:
+            print(f"[DEBUG] Skipping debt for {debtor_id} - already has receivable")
+            continue
+        if debtor_id not in debtor_names:
+            continue
             
-            # Também verificar se há recebíveis vendidos recentemente (pode ser ainda válido)
-            sold_receivable = Receivable.query.filter_by(
-                owner_id=user_id,
-                consolidated_group_id=debtor_id,
-                status='sold'
-            ).first()
-            
-            # Se já existe recebível ativo (à venda ou vendido), pular esta dívida
-            if existing_receivable or sold_receivable:
-                print(f"[DEBUG] Skipping debt for {debtor_id} - already has receivable")
-                continue
-                
-            # Buscar informações do devedor
-            debtor = User.query.get(debtor_id)
-            if not debtor:
-                continue
-                
-            consolidated_debts.append({
-                'id': f"consolidated_{debtor_id}",  # ID único por devedor
-                'debtor_id': debtor_id,
-                'creditor_id': user_id,
-                'amount': amount_owed,
-                'other_user': debtor.name,
-                'other_user_id': debtor_id,
-                'type': 'owed',
-                'status': 'pending',
-                'expense_description': f"Saldo consolidado de todos os grupos"
-            })
+        consolidated_debts.append({
+            'id': f"consolidated_{debtor_id}",  # ID único por devedor
+            'debtor_id': debtor_id,
+            'creditor_id': user_id,
+            'amount': global_balances[debtor_id],
+            'other_user': debtor_names[debtor_id],
+            'other_user_id': debtor_id,
+            'type': 'owed',
+            'status': 'pending',
+            'expense_description': f"Saldo consolidado de todos os grupos"
+        })
     
     # Ordenar por valor (maiores primeiro)
     consolidated_debts.sort(key=lambda x: x['amount'], reverse=True)
@@ -189,41 +173,22 @@ def get_consolidated_debts():
     })
 
 
-def _calculate_group_balances(group_id):
-    """Calcula o saldo líquido de cada membro do grupo baseado apenas em dívidas PENDENTES"""
-    from app.models.user import GroupMember
-    from collections import defaultdict
-    
-    # Buscar membros do grupo
-    members = GroupMember.query.filter_by(group_id=group_id).all()
-    if len(members) == 0:
-        return {}
-    
-    # NOVA LÓGICA: Calcular com base apenas em dívidas PENDENTES
-    balances = defaultdict(float)
-    
-    # Buscar todas as dívidas pendentes relacionadas a este grupo
-    # (dívidas entre membros deste grupo)
-    member_ids = [member.user_id for member in members]
-    
-    pending_debts = Debt.get_pending_debts().filter(
-        Debt.creditor_id.in_(member_ids),
-        Debt.debtor_id.in_(member_ids)
-    ).all()
-    
-    # Calcular saldos baseado nas dívidas pendentes
-    for debt in pending_debts:
-        # Creditor tem saldo positivo (deve receber)
-        balances[debt.creditor_id] += debt.amount
-        # Debtor tem saldo negativo (deve pagar)  
-        balances[debt.debtor_id] -= debt.amount
-    
-    # Converter para dict normal e garantir que todos os membros estejam presentes
-    final_balances = {}
-    for member in members:
-        final_balances[member.user_id] = balances.get(member.user_id, 0.0)
-    
-    return final_balances
+def _sold_title_buyers(debtor_ids):
+    """Comprador do título consolidado vendido de cada devedor ({debtor_id: buyer_id})
+
+    Mantém a regra de antes (primeiro título vendido do devedor), em um IN por lote de ids.
+    """
+    buyers = {}
+    debtor_ids = list(debtor_ids)
+    for start in range(0, len(debtor_ids), ID_CHUNK_SIZE):
+        rows = db.session.query(Receivable.consolidated_group_id, Receivable.buyer_id).filter(
+            Receivable.consolidated_group_id.in_(debtor_ids[start:start + ID_CHUNK_SIZE]),
+            Receivable.status == 'sold'
+        ).all()
+        for debtor_id, buyer_id in rows:
+            buyers.setdefault(debtor_id, buyer_id)
+    return buyers
+
 
 @debts_bp.route('/summary', methods=['GET'])
 @jwt_required()
@@ -248,6 +213,30 @@ def get_debts_summary():
         'credits_count': len(debts_as_creditor)
     })
 
+@debts_bp.route('/cycles/cancel', methods=['POST'])
+@jwt_required()
+def cancel_debt_cycles():
+    """Cancela ciclos de dívidas pendentes que passam pelo usuário (A deve B, B deve C, C deve A)"""
+    user_id = get_jwt_identity()
+    data = request.get_json(silent=True) or {}
+
+    try:
+        time_budget = float(data.get('time_budget', 2.0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'time_budget inválido'}), 400
+
+    # Limitar o orçamento para a requisição não travar o servidor
+    time_budget = min(max(time_budget, 0.1), MAX_CYCLE_TIME_BUDGET)
+
+    report = SettlementService.cancel_cycles(user_id, time_budget=time_budget)
+    if report is None:
+        return jsonify({'error': 'Otimização de dívidas em andamento, tente novamente em instantes'}), 409
+
+    return jsonify({
+        'message': f'{report["cycles_cancelled"]} ciclos cancelados',
+        'report': report
+    })
+
 @debts_bp.route('/<debt_id>/pay', methods=['POST'])
 @jwt_required()
 def pay_debt(debt_id):
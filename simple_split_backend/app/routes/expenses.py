@@ -4,6 +4,7 @@ from app import db
 from app.models.expense import Expense
 from app.models.group import Group
 from app.models.user import GroupMember
+from app.services.serializer_service import SerializerService
 from datetime import datetime, timedelta
 
 expenses_bp = Blueprint('expenses', __name__)
@@ -29,8 +30,7 @@ def get_user_expenses():
     
     # Converter para dicionário com informações extras
     expenses_data = []
-    for expense in expenses:
-        expense_dict = expense.to_dict()
+    for expense, expense_dict in zip(expenses, SerializerService.expenses_to_dict(expenses)):
         expense_dict['group_name'] = expense.group.name
         expense_dict['payer_name'] = expense.payer.name
         expenses_data.append(expense_dict)
@@ -58,8 +58,7 @@ def get_recent_expenses():
     
     # Converter para dicionário com informações extras
     expenses_data = []
-    for expense in expenses:
-        expense_dict = expense.to_dict()
+    for expense, expense_dict in zip(expenses, SerializerService.expenses_to_dict(expenses)):
         expense_dict['group_name'] = expense.group.name
         expense_dict['payer_name'] = expense.payer.name
         expenses_data.append(expense_dict)
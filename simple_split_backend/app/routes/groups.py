@@ -7,6 +7,13 @@ from app.models.group import Group
 from app.models.expense import Expense
 from app.models.debt import Debt
 from app.services.log_service import LogService
+from app.services.balance_service import BalanceService
+from app.services.dirty_tracker import DirtyTracker
+from app.services.optimization_worker import OptimizationWorker
+from app.services.settlement_service import SettlementService, STRATEGIES
+from app.services.serializer_service import SerializerService
+from app.services.pagination_service import PaginationService
+from app.services.import_service import ImportService
 from datetime import datetime
 
 groups_bp = Blueprint('groups', __name__)
@@ -18,11 +25,12 @@ def get_user_groups():
     user_id = get_jwt_identity()
     
     # Buscar grupos onde o usuário é membro
-    memberships = GroupMember.query.filter_by(user_id=user_id).all()
-    groups = [Group.query.get(membership.group_id) for membership in memberships]
+    groups = Group.query.join(GroupMember, GroupMember.group_id == Group.id).filter(
+        GroupMember.user_id == user_id
+    ).options(db.joinedload(Group.creator)).all()
     
     return jsonify({
-        "groups": [group.to_dict() for group in groups if group]
+        "groups": SerializerService.groups_to_dict(groups)
     })
 
 @groups_bp.route('/', methods=['POST'])
@@ -68,7 +76,11 @@ def get_group_detail(group_id):
         return jsonify({'error': 'Grupo não encontrado'}), 404
     
     # Buscar membros, despesas e dívidas
-    members = group.get_members()
+    users_by_id = {
+        user.id: user
+        for user in User.query.filter(User.id.in_([m.user_id for m in group.members])).all()
+    }
+    members = [users_by_id[m.user_id] for m in group.members if m.user_id in users_by_id]
     
     # Buscar todas as despesas do grupo
     all_expenses = Expense.query.filter_by(group_id=group_id).all()
@@ -76,36 +88,36 @@ def get_group_detail(group_id):
     # Buscar todas as despesas do grupo (agora que a despesa incorreta foi removida)
     expenses = all_expenses
     
+    # Serializar em lote (pré-carrega dívidas e usuários de todas as despesas)
+    expenses_data = SerializerService.expenses_to_dict(expenses)
+    
     # Buscar dívidas das despesas filtradas (não vendidas como títulos)
     debts = []
     for expense in expenses:
         for debt in expense.debts:
             if debt.status == 'pending':
                 debts.append(debt)
-    
+
+    # Transferências pendentes da liquidação do grupo (não pertencem a nenhuma despesa)
+    settlement_debts = Debt.query.filter(
+        Debt.group_id == group_id,
+        Debt.expense_id.is_(None),
+        Debt.status == 'pending'
+    ).all()
+    debts.extend(settlement_debts)
+
     # Buscar pagamentos via wallet relacionados ao grupo
     wallet_payments = []
     
     # 1. Pagamentos de despesas do grupo
-    paid_debts = Debt.query.join(Expense).filter(
-        Expense.group_id == group_id,
+    paid_debts = Debt.query.filter(
+        Debt.group_id == group_id,
         Debt.status == 'paid'
     ).all()
+    SerializerService.prefetch_debts(paid_debts)
     
     for debt in paid_debts:
-        wallet_payments.append({
-            'id': f'payment_{debt.id}',
-            'type': 'wallet_payment',
-            'description': f'{debt.debtor.name} pagou R$ {debt.amount:.2f} para {debt.creditor.name} via carteira',
-            'amount': debt.amount,
-            'payer_id': debt.debtor_id,
-            'payer_name': debt.debtor.name,
-            'creditor_id': debt.creditor_id,
-            'creditor_name': debt.creditor.name,
-            'paid_at': debt.paid_at.isoformat() if debt.paid_at else None,
-            'original_expense_description': debt.expense.description if debt.expense else None,
-            'debt_id': debt.id
-        })
+        wallet_payments.append(_payment_to_dict(debt))
     
     # 2. Pagamentos virtuais entre membros do grupo
     # Buscar membros do grupo para filtrar pagamentos virtuais
@@ -118,21 +130,10 @@ def get_group_detail(group_id):
         Debt.debtor_id.in_(member_ids),
         Debt.creditor_id.in_(member_ids)
     ).all()
+    SerializerService.prefetch_debts(virtual_payments)
     
     for debt in virtual_payments:
-        wallet_payments.append({
-            'id': f'virtual_payment_{debt.id}',
-            'type': 'virtual_wallet_payment',
-            'description': f'{debt.debtor.name} pagou R$ {debt.amount:.2f} para {debt.creditor.name} via carteira (pagamento virtual)',
-            'amount': debt.amount,
-            'payer_id': debt.debtor_id,
-            'payer_name': debt.debtor.name,
-            'creditor_id': debt.creditor_id,
-            'creditor_name': debt.creditor.name,
-            'paid_at': debt.paid_at.isoformat() if debt.paid_at else None,
-            'original_expense_description': 'Pagamento direto entre membros',
-            'debt_id': debt.id
-        })
+        wallet_payments.append(_payment_to_dict(debt, virtual=True))
     
     # Incluir dados do grupo no root para compatibilidade com Flutter
     group_dict = group.to_dict()
@@ -151,12 +152,173 @@ def get_group_detail(group_id):
         
         # Dados relacionados
         'group': group_dict,  # Manter para compatibilidade
-        'members': [member.to_dict() for member in members],
-        'expenses': [expense.to_dict() for expense in expenses],
-        'debts': [debt.to_dict() for debt in debts],
+        'members': SerializerService.users_to_dict(members),
+        'expenses': expenses_data,
+        'debts': SerializerService.debts_to_dict(debts),
         'wallet_payments': wallet_payments  # Pagamentos via carteira
     })
 
+def _payment_to_dict(debt, virtual=False):
+    """Pagamento via carteira no formato do detalhe do grupo"""
+    if virtual:
+        return {
+            'id': f'virtual_payment_{debt.id}',
+            'type': 'virtual_wallet_payment',
+            'description': f'{debt.debtor.name} pagou R$ {debt.amount:.2f} para {debt.creditor.name} via carteira (pagamento virtual)',
+            'amount': debt.amount,
+            'payer_id': debt.debtor_id,
+            'payer_name': debt.debtor.name,
+            'creditor_id': debt.creditor_id,
+            'creditor_name': debt.creditor.name,
+            'paid_at': debt.paid_at.isoformat() if debt.paid_at else None,
+            'original_expense_description': 'Pagamento direto entre membros',
+            'debt_id': debt.id
+        }
+    return {
+        'id': f'payment_{debt.id}',
+        'type': 'wallet_payment',
+        'description': f'{debt.debtor.name} pagou R$ {debt.amount:.2f} para {debt.creditor.name} via carteira',
+        'amount': debt.amount,
+        'payer_id': debt.debtor_id,
+        'payer_name': debt.debtor.name,
+        'creditor_id': debt.creditor_id,
+        'creditor_name': debt.creditor.name,
+        'paid_at': debt.paid_at.isoformat() if debt.paid_at else None,
+        'original_expense_description': debt.description,
+        'debt_id': debt.id
+    }
+
+
+def _require_membership(group_id):
+    """Retorna (grupo, None) ou (None, resposta de erro) para o usuário logado"""
+    user_id = get_jwt_identity()
+    membership = GroupMember.query.filter_by(user_id=user_id, group_id=group_id).first()
+    if not membership:
+        return None, (jsonify({'error': 'Acesso negado'}), 403)
+    group = Group.query.get(group_id)
+    if not group:
+        return None, (jsonify({'error': 'Grupo não encontrado'}), 404)
+    return group, None
+
+
+def _page_args():
+    """Lê ?limit= e ?cursor= (ValueError se limit inválido)"""
+    return PaginationService.parse_limit(request.args.get('limit')), request.args.get('cursor')
+
+
+@groups_bp.route('/<string:group_id>/header', methods=['GET'])
+@jwt_required()
+def get_group_header(group_id):
+    """Cabeçalho leve do grupo: dados, contadores e membros (sem despesas/dívidas)"""
+    group, error = _require_membership(group_id)
+    if error:
+        return error
+    
+    users_by_id = {
+        user.id: user
+        for user in User.query.filter(User.id.in_([m.user_id for m in group.members])).all()
+    }
+    members = [users_by_id[m.user_id] for m in group.members if m.user_id in users_by_id]
+    
+    return jsonify({
+        'group': group.to_dict(),
+        'members': SerializerService.users_to_dict(members)
+    })
+
+
+@groups_bp.route('/<string:group_id>/expenses', methods=['GET'])
+@jwt_required()
+def get_group_expenses(group_id):
+    """Despesas do grupo paginadas por cursor (data e id decrescentes)"""
+    group, error = _require_membership(group_id)
+    if error:
+        return error
+    
+    try:
+        limit, cursor = _page_args()
+        expenses, next_cursor = PaginationService.paginate(
+            Expense.query.filter(Expense.group_id == group_id),
+            [Expense.date, Expense.id],
+            cursor,
+            limit
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'items': SerializerService.expenses_to_dict(expenses),
+        'next_cursor': next_cursor
+    })
+
+
+@groups_bp.route('/<string:group_id>/debts', methods=['GET'])
+@jwt_required()
+def get_group_debts(group_id):
+    """Dívidas pendentes do grupo paginadas por cursor (criação e id decrescentes)"""
+    group, error = _require_membership(group_id)
+    if error:
+        return error
+    
+    try:
+        limit, cursor = _page_args()
+        debts, next_cursor = PaginationService.paginate(
+            Debt.query.filter(Debt.group_id == group_id, Debt.status == 'pending'),
+            [Debt.created_at, Debt.id],
+            cursor,
+            limit
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'items': SerializerService.debts_to_dict(debts),
+        'next_cursor': next_cursor
+    })
+
+
+@groups_bp.route('/<string:group_id>/payments', methods=['GET'])
+@jwt_required()
+def get_group_payments(group_id):
+    """Pagamentos via carteira do grupo (de despesas e virtuais entre membros) paginados por cursor"""
+    group, error = _require_membership(group_id)
+    if error:
+        return error
+    
+    member_ids = db.session.query(GroupMember.user_id).filter(GroupMember.group_id == group_id)
+    is_virtual = db.and_(
+        Debt.source == 'virtual_payment',
+        Debt.debtor_id.in_(member_ids),
+        Debt.creditor_id.in_(member_ids)
+    )
+    paid_at = db.func.coalesce(Debt.paid_at, Debt.created_at)
+    
+    try:
+        limit, cursor = _page_args()
+        debts, next_cursor = PaginationService.paginate(
+            Debt.query.filter(Debt.status == 'paid', db.or_(Debt.group_id == group_id, is_virtual)),
+            [paid_at, Debt.id],
+            cursor,
+            limit,
+            sort_key=lambda debt: [debt.paid_at or debt.created_at, debt.id]
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    member_set = {user_id for (user_id,) in member_ids.all()}
+    SerializerService.prefetch_debts(debts)
+    
+    return jsonify({
+        'items': [
+            _payment_to_dict(
+                debt,
+                virtual=debt.source == 'virtual_payment' and {debt.debtor_id, debt.creditor_id} <= member_set
+            )
+            for debt in debts
+        ],
+        'next_cursor': next_cursor
+    })
+
+
 @groups_bp.route('/<string:group_id>/members', methods=['POST'])
 @jwt_required()
 def add_member_to_group(group_id):
@@ -218,19 +380,49 @@ def add_expense(group_id):
     )
     
     db.session.add(expense)
-    db.session.commit()
     
-    # Dividir despesa automaticamente
+    # Dividir despesa automaticamente (grava despesa e dívidas em um único commit)
     expense.split_expense(data.get('member_ids'))
     
-    # Executar otimização automática
-    LogService.optimize_debts()
+    # Agendar otimização automática em background (não bloqueia a resposta)
+    optimization_job = OptimizationWorker.enqueue(group_id)
     
     return jsonify({
         'message': 'Despesa adicionada com sucesso',
-        'expense': expense.to_dict()
+        'expense': expense.to_dict(),
+        'optimization': optimization_job
     }), 201
 
+@groups_bp.route('/<string:group_id>/expenses/import', methods=['POST'])
+@jwt_required()
+def import_expenses(group_id):
+    """Importar despesas em lote (CSV ou NDJSON, corpo da requisição ou arquivo 'file')"""
+    user_id = get_jwt_identity()
+    
+    membership = GroupMember.query.filter_by(user_id=user_id, group_id=group_id).first()
+    if not membership:
+        return jsonify({'error': 'Acesso negado'}), 403
+    
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    content_type = (upload.mimetype if upload else request.mimetype) or ''
+    
+    # Formato: ?format=csv|ndjson ou pelo Content-Type
+    import_format = request.args.get('format')
+    if not import_format:
+        import_format = 'ndjson' if any(t in content_type for t in ('ndjson', 'jsonl', 'json')) else 'csv'
+    if import_format not in ('csv', 'ndjson'):
+        return jsonify({'error': 'Formato deve ser csv ou ndjson'}), 400
+    
+    rows = ImportService.parse_csv(stream) if import_format == 'csv' else ImportService.parse_ndjson(stream)
+    
+    report = ImportService.import_expenses(group_id, user_id, rows)
+    
+    # Uma única passada de otimização para toda a importação
+    report['optimization'] = OptimizationWorker.enqueue(group_id) if report['imported'] else None
+    
+    return jsonify(report), 201 if report['imported'] else 400
+
 @groups_bp.route('/<string:group_id>/expenses/<string:expense_id>', methods=['DELETE'])
 @jwt_required()
 def delete_expense(group_id, expense_id):
@@ -250,11 +442,75 @@ def delete_expense(group_id, expense_id):
         debt.cancel()
     
     db.session.delete(expense)
+    db.session.flush()
+    
+    # Despesa removida altera a divisão do grupo: recalcular saldos
+    BalanceService.rebuild_group(group_id)
+    DirtyTracker.mark_group(group_id)
     db.session.commit()
     
     return jsonify({'message': 'Despesa removida com sucesso'})
 
 
+@groups_bp.route('/<string:group_id>/optimization', methods=['GET'])
+@jwt_required()
+def get_optimization_status(group_id):
+    """Status da otimização em background (último job do grupo ou ?job_id=)"""
+    user_id = get_jwt_identity()
+    
+    membership = GroupMember.query.filter_by(user_id=user_id, group_id=group_id).first()
+    if not membership:
+        return jsonify({'error': 'Acesso negado'}), 403
+    
+    job_id = request.args.get('job_id')
+    job = OptimizationWorker.get_job(job_id) if job_id else OptimizationWorker.get_latest_job(group_id)
+    
+    if not job or job['group_id'] != group_id:
+        return jsonify({'error': 'Nenhuma otimização encontrada'}), 404
+    
+    return jsonify(job)
+
+
+@groups_bp.route('/<group_id>/optimize/preview', methods=['GET'])
+@jwt_required()
+def preview_group_optimization(group_id):
+    """Simula a otimização do grupo em memória (não altera dívidas)"""
+    user_id = get_jwt_identity()
+    
+    membership = GroupMember.query.filter_by(user_id=user_id, group_id=group_id).first()
+    if not membership:
+        return jsonify({'error': 'Usuário não é membro do grupo'}), 403
+    
+    # ?strategy=min_cash_flow&strategy=pairwise (padrão: todas, para comparação)
+    strategies = request.args.getlist('strategy') or list(STRATEGIES)
+    invalid = [strategy for strategy in strategies if strategy not in STRATEGIES]
+    if invalid:
+        return jsonify({'error': f'Estratégia inválida: {", ".join(invalid)}'}), 400
+    
+    simulations = [SettlementService.simulate_group(group_id, strategy) for strategy in strategies]
+    
+    # Nomes dos usuários do plano em uma única consulta
+    user_ids = {user for simulation in simulations for transfer in simulation['transfers'] for user in transfer[:2]}
+    names = dict(db.session.query(User.id, User.name).filter(User.id.in_(user_ids)).all()) if user_ids else {}
+    
+    for simulation in simulations:
+        simulation['transfers'] = [
+            {
+                'debtor_id': debtor_id,
+                'debtor_name': names.get(debtor_id),
+                'creditor_id': creditor_id,
+                'creditor_name': names.get(creditor_id),
+                'amount': round(amount, 2)
+            }
+            for debtor_id, creditor_id, amount in simulation['transfers']
+        ]
+    
+    return jsonify({
+        'group_id': group_id,
+        'simulations': simulations
+    })
+
+
 @groups_bp.route('/<group_id>/optimize', methods=['POST'])
 @jwt_required()
 def optimize_group_debts(group_id):
@@ -273,8 +529,11 @@ def optimize_group_debts(group_id):
     # Calcular saldos antes da otimização
     balances_before = _calculate_group_balances(group_id)
     
-    # Executar otimização
-    optimized_count = LogService.optimize_debts()
+    # Executar otimização (o grupo entra na fila mesmo sem alterações recentes)
+    DirtyTracker.mark_group(group_id)
+    db.session.commit()  # O lease usa outra conexão e não comita a sessão
+    result = {}
+    optimized_count = LogService.optimize_debts(result)
     
     # Calcular saldos após otimização
     balances_after = _calculate_group_balances(group_id)
@@ -297,143 +556,22 @@ def optimize_group_debts(group_id):
                     'amount': abs(balance)
                 })
     
-    message = f'Otimização concluída! {optimized_count} dívidas foram otimizadas.'
+    if result['deferred']:
+        # Outro processo detém o lease e vai processar o grupo marcado acima
+        message = 'Otimização em andamento em outro processo; o grupo foi colocado na fila.'
+    else:
+        message = f'Otimização concluída! {optimized_count} dívidas foram otimizadas.'
     if not balance_summary:
         message += ' Todos os saldos estão zerados! 🎉'
     
     return jsonify({
         'message': message,
         'optimized_count': optimized_count,
+        'queued': result['deferred'],
         'balance_summary': balance_summary
     })
 
 
-def calculate_user_net_balance(user_id):
-    """Calcula o saldo líquido real do usuário em todos os grupos"""
-    from app.models.expense import Expense
-    from app.models.user import GroupMember
-    
-    # Buscar todos os grupos do usuário
-    user_groups = GroupMember.query.filter_by(user_id=user_id).all()
-    
-    total_net_balance = 0.0
-    
-    for membership in user_groups:
-        group_id = membership.group_id
-        
-        # Calcular saldo neste grupo específico
-        group_balances = _calculate_group_balances(group_id)
-        user_balance = group_balances.get(user_id, 0.0)
-        total_net_balance += user_balance
-    
-    return total_net_balance
-
-
 def _calculate_group_balances(group_id):
-    """Calcula o saldo líquido de cada membro do grupo baseado no que pagaram vs o que deveriam pagar"""
-    from app.models.expense import Expense
-    from app.models.user import GroupMember
-    
-    # Buscar todas as despesas do grupo
-    expenses = Expense.query.filter_by(group_id=group_id).all()
-    
-    # Calcular quanto cada pessoa pagou
-    paid_by_user = defaultdict(float)
-    for expense in expenses:
-        paid_by_user[expense.payer_id] += expense.amount
-    
-    # Calcular total de despesas
-    total_expenses = sum(expense.amount for expense in expenses)
-    
-    # Buscar membros do grupo
-    members = GroupMember.query.filter_by(group_id=group_id).all()
-    member_count = len(members)
-    
-    if member_count == 0:
-        return {}
-    
-    # Calcular quanto cada pessoa deveria pagar (divisão igual)
-    should_pay_per_person = total_expenses / member_count
-    
-    # Calcular saldo líquido: quanto pagou - quanto deveria pagar
-    balances = {}
-    for member in members:
-        paid = paid_by_user.get(member.user_id, 0.0)
-        should_pay = should_pay_per_person
-        balance = paid - should_pay  # Positivo = recebe, Negativo = paga
-        balances[member.user_id] = balance
-    
-    # CORREÇÃO: Ajustar saldos considerando pagamentos via wallet
-    # 1. Buscar pagamentos via wallet dentro deste grupo (dívidas de despesas do grupo)
-    paid_debts = Debt.query.join(Expense).filter(
-        Expense.group_id == group_id,
-        Debt.status == 'paid'
-    ).all()
-    
-    print(f"[DEBUG] Grupo {group_id}: Encontrados {len(paid_debts)} pagamentos de despesas via wallet")
-    
-    for debt in paid_debts:
-        debtor_id = debt.debtor_id
-        creditor_id = debt.creditor_id
-        amount = debt.amount
-        
-        print(f"[DEBUG] Pagamento de despesa: {debtor_id} pagou {amount} para {creditor_id}")
-        
-        if debtor_id in balances:
-            balances[debtor_id] += amount
-        if creditor_id in balances:
-            balances[creditor_id] -= amount
-    
-    # 2. Buscar pagamentos virtuais (source='virtual_payment')
-    # Estes são pagamentos diretos entre membros do grupo
-    virtual_payments = Debt.query.filter(
-        Debt.source == 'virtual_payment',
-        Debt.status == 'paid',
-        # Verificar se ambos os usuários são membros do grupo
-        Debt.debtor_id.in_([m.user_id for m in members]),
-        Debt.creditor_id.in_([m.user_id for m in members])
-    ).all()
-    
-    print(f"[DEBUG] Grupo {group_id}: Encontrados {len(virtual_payments)} pagamentos virtuais")
-    
-    for payment in virtual_payments:
-        debtor_id = payment.debtor_id
-        creditor_id = payment.creditor_id
-        amount = payment.amount
-        
-        print(f"[DEBUG] Pagamento virtual: {debtor_id} pagou {amount} para {creditor_id}")
-        
-        if debtor_id in balances:
-            balances[debtor_id] += amount  # Quem pagou melhora
-            print(f"[DEBUG] Novo saldo de {debtor_id}: {balances[debtor_id]}")
-        if creditor_id in balances:
-            balances[creditor_id] -= amount  # Quem recebeu piora
-            print(f"[DEBUG] Novo saldo de {creditor_id}: {balances[creditor_id]}")
-    
-    # 3. CORREÇÃO: Descontar dívidas que foram vendidas como títulos
-    # Quando alguém vende uma dívida, ela não tem mais direito a receber do devedor
-    sold_debts = Debt.query.join(Expense).filter(
-        Expense.group_id == group_id,
-        Debt.status == 'sold_as_title'
-    ).all()
-    
-    print(f"[DEBUG] Grupo {group_id}: Encontradas {len(sold_debts)} dívidas vendidas como títulos")
-    
-    for debt in sold_debts:
-        debtor_id = debt.debtor_id
-        creditor_id = debt.creditor_id  # Quem VENDEU a dívida
-        amount = debt.amount
-        
-        print(f"[DEBUG] Dívida vendida: {creditor_id} vendeu dívida de {amount} do {debtor_id}")
-        
-        # Quem vendeu a dívida não tem mais direito a receber
-        if creditor_id in balances:
-            balances[creditor_id] -= amount  # Reduz o que tem a receber
-            print(f"[DEBUG] Saldo ajustado de {creditor_id}: {balances[creditor_id]} (descontou R$ {amount} vendido)")
-        
-        # Quem devia não deve mais para o vendedor original
-        if debtor_id in balances:
-            balances[debtor_id] += amount  # Reduz o que deve pagar
-            print(f"[DEBUG] Saldo ajustado de {debtor_id}: {balances[debtor_id]} (não deve mais R$ {amount} para vendedor)")
-    
-    return balances
\ No newline at end of file
+    """Saldo líquido de cada membro do grupo (pagou - deveria pagar), lido da tabela group_balances"""
+    return BalanceService.get_group_balances(group_id)
@@ -6,6 +6,7 @@ from app.models.debt import Debt
 from app.models.log import Log
 from app.models.expense import Expense
 from app.models.group import Group
+from app.services.dashboard_snapshot import DashboardSnapshot
 from datetime import datetime, timedelta
 
 insights_bp = Blueprint('insights', __name__)
@@ -18,7 +19,7 @@ def get_insights():
     insights = []
     
     # Insight 1: Próximos pagamentos (dívidas que o usuário deve, excluindo vendidas)
-    debts_to_pay = Debt.get_pending_debts(debtor_id=user_id).join(Expense).all()
+    debts_to_pay = Debt.get_pending_debts(debtor_id=user_id).all()
     
     for debt in debts_to_pay[:3]:  # Mostrar apenas as 3 primeiras
         due_date = debt.due_date or (datetime.now().date() + timedelta(days=7))
@@ -30,14 +31,14 @@ def get_insights():
                 'amount': debt.amount,
                 'creditor': debt.creditor.name,
                 'due_date': due_date.isoformat(),
-                'expense_description': debt.expense.description if debt.expense else None,
+                'expense_description': debt.description,
                 'debt_id': debt.id
             },
             'priority': 'high' if due_date <= datetime.now().date() else 'medium'
         })
     
     # Insight 2: Dívidas a receber (consolidadas por devedor)
-    debts_to_receive = Debt.get_pending_debts(creditor_id=user_id).join(Expense).all()
+    debts_to_receive = Debt.get_pending_debts(creditor_id=user_id).all()
     
     # Consolidar dívidas por devedor
     from collections import defaultdict
@@ -186,80 +187,13 @@ def get_summary():
     """Obter resumo financeiro do usuário"""
     user_id = get_jwt_identity()
     
-    # Usar lógica otimizada (mesma do /user/profile e grupos)
-    from app.routes.groups import calculate_user_net_balance
-    from app.models.user import GroupMember
+    # Totais otimizados do snapshot do dashboard (mesma lógica da API /insights/debts-categorized)
+    snapshot = DashboardSnapshot.for_user(user_id)
+    if not snapshot.found:
+        return jsonify({'error': 'Usuário não encontrado'}), 404
     
-    # Calcular valores otimizados baseados nos saldos dos grupos
-    user_groups = GroupMember.query.filter_by(user_id=user_id).all()
-    
-    optimized_total_to_pay = 0.0
-    optimized_total_to_receive = 0.0
-    
-    for membership in user_groups:
-        group_id = membership.group_id
-        
-        # Usar a função _calculate_group_balances
-        from app.routes.groups import _calculate_group_balances
-        group_balances = _calculate_group_balances(group_id)
-        
-        user_balance = group_balances.get(user_id, 0.0)
-        
-        if user_balance < 0:  # Usuário deve (saldo negativo)
-            optimized_total_to_pay += abs(user_balance)
-        elif user_balance > 0:  # Usuário deve receber (saldo positivo)
-            optimized_total_to_receive += user_balance
-    
-    # Adicionar dívidas de títulos comprados (não são otimizadas)
-    purchased_debts = Debt.query.filter_by(
-        creditor_id=user_id,
-        status='pending',
-        source='purchased_title'
-    ).all()
-    
-    for debt in purchased_debts:
-        optimized_total_to_receive += debt.amount
-    
-    # Calcular totais usando a mesma lógica detalhada da API /insights/debts-categorized
-    you_owe_total = 0.0
-    others_owe_total = 0.0
-    
-    for membership in user_groups:
-        group_id = membership.group_id
-        group_balances = _calculate_group_balances(group_id)
-        user_balance = group_balances.get(user_id, 0.0)
-        
-        if abs(user_balance) > 0.01:
-            if user_balance < 0:  # Usuário deve (saldo negativo)
-                for other_user_id, other_balance in group_balances.items():
-                    if other_user_id != user_id and other_balance > 0.01:
-                        total_positive = sum(balance for balance in group_balances.values() if balance > 0)
-                        if total_positive > 0:
-                            proportion = other_balance / total_positive
-                            amount_owed = abs(user_balance) * proportion
-                            
-                            if amount_owed > 0.01:
-                                # Verificar se há dívidas pagas individualmente que devem reduzir o saldo
-                                paid_debts = Debt.query.filter_by(
-                                    debtor_id=user_id,
-                                    creditor_id=other_user_id,
-                                    status='paid'
-                                ).all()
-                                
-                                paid_amount = sum(d.amount for d in paid_debts)
-                                amount_owed = max(0, amount_owed - paid_amount)
-                                
-                                you_owe_total += amount_owed
-                                
-            elif user_balance > 0:  # Usuário deve receber (saldo positivo)
-                others_owe_total += user_balance
-    
-    # Adicionar dívidas de títulos comprados
-    for debt in purchased_debts:
-        others_owe_total += debt.amount
-    
-    total_to_pay = you_owe_total
-    total_to_receive = others_owe_total
+    total_to_pay = snapshot.owed_after_payments
+    total_to_receive = snapshot.significant_to_receive
     
     print(f"[DEBUG] Summary totais corrigidos - A pagar: R$ {total_to_pay}, A receber: R$ {total_to_receive}")
     
@@ -267,13 +201,13 @@ def get_summary():
     from app.models.expense import Expense
     # Total gasto (parte real do usuário nas despesas)
     # 1. Parte das despesas que ele pagou (valor dividido pelo número de pessoas)
-    expenses_paid = Expense.query.filter_by(payer_id=user_id).all()
+    # Conta quantas pessoas participaram (pagador + devedores) na mesma consulta
+    debt_count = db.select(db.func.count(Debt.id)).where(Debt.expense_id == Expense.id).scalar_subquery()
+    expenses_paid = db.session.query(Expense.amount, debt_count).filter(Expense.payer_id == user_id).all()
     spent_as_payer = 0
-    for expense in expenses_paid:
-        # Conta quantas pessoas participaram (pagador + devedores)
-        debt_count = len(expense.debts)
-        total_people = debt_count + 1  # +1 para o pagador
-        spent_as_payer += expense.amount / total_people
+    for amount, debts_in_expense in expenses_paid:
+        total_people = debts_in_expense + 1  # +1 para o pagador
+        spent_as_payer += amount / total_people
     
     # 2. Parte das despesas que ele deve (já paga ou pendente)
     spent_as_debtor = db.session.query(db.func.sum(Debt.amount))\
@@ -281,22 +215,17 @@ def get_summary():
     
     total_spent = spent_as_payer + spent_as_debtor
     
-    # Saldo da carteira
-    user = User.query.get(user_id)
-    wallet_balance = user.wallet.balance if user.wallet else 0
-    
     # Número de grupos ativos
-    from app.models.user import GroupMember
-    active_groups = GroupMember.query.filter_by(user_id=user_id).count()
+    active_groups = len(snapshot.balances_by_group)
     
     return jsonify({
-        'wallet_balance': wallet_balance,
+        'wallet_balance': snapshot.wallet_balance,
         'total_to_pay': total_to_pay,
         'total_to_receive': total_to_receive,
         'total_spent': total_spent,
         'net_balance': total_to_receive - total_to_pay,
         'active_groups': active_groups,
-        'score': user.score
+        'score': snapshot.score
     })
 
 @insights_bp.route('/debts-categorized', methods=['GET'])
@@ -305,157 +234,9 @@ def get_debts_categorized():
     """Obter dívidas categorizadas usando saldos otimizados dos grupos (mesma lógica do OTIMIZAR)"""
     user_id = get_jwt_identity()
     
-    # Importar função de cálculo de saldos dos grupos
-    from app.routes.groups import calculate_user_net_balance
-    from app.models.user import GroupMember, User
-    from collections import defaultdict
-    
-    # Calcular saldo líquido total do usuário usando a mesma lógica dos grupos
-    total_net_balance = calculate_user_net_balance(user_id)
-    
-    # Ajustar o saldo considerando pagamentos individuais feitos
-    individual_payments = Debt.query.filter_by(
-        debtor_id=user_id,
-        status='paid'
-    ).all()
-    
-    total_paid_individually = sum(debt.amount for debt in individual_payments)
-    print(f"[DEBUG] Usuário {user_id} pagou individualmente: R$ {total_paid_individually}")
-    
-    # Ajustar o saldo líquido
-    total_net_balance += total_paid_individually  # Se pagou individualmente, melhora o saldo
-    
-    # Buscar todos os grupos do usuário para calcular saldos individuais
-    user_groups = GroupMember.query.filter_by(user_id=user_id).all()
-    
-    you_owe_list = []
-    others_owe_list = []
-    
-    for membership in user_groups:
-        group_id = membership.group_id
-        
-        # Usar a função _calculate_group_balances importada
-        from app.routes.groups import _calculate_group_balances
-        group_balances = _calculate_group_balances(group_id)
-        
-        user_balance = group_balances.get(user_id, 0.0)
-        print(f"[DEBUG] Insights - Grupo {group_id}: saldo do usuário = {user_balance}")
-        
-        if abs(user_balance) > 0.01:  # Apenas se tiver saldo significativo
-            if user_balance < 0:  # Usuário deve (saldo negativo)
-                # Encontrar quem deve receber no grupo
-                for other_user_id, other_balance in group_balances.items():
-                    if other_user_id != user_id and other_balance > 0.01:
-                        # Calcular quanto este usuário deve para este outro usuário
-                        # Proporcionalmente ao quanto cada um deve receber
-                        
-                        total_positive = sum(balance for balance in group_balances.values() if balance > 0)
-                        if total_positive > 0:
-                            proportion = other_balance / total_positive
-                            amount_owed = abs(user_balance) * proportion
-                            
-                            print(f"[DEBUG] Usuário deve para {other_user_id}: total_positive={total_positive}, proportion={proportion}, amount_owed={amount_owed}")
-                            
-                            if amount_owed > 0.01:  # Apenas valores significativos
-                                other_user = User.query.get(other_user_id)
-                                
-                                # Verificar se já existe entrada para este credor
-                                existing = None
-                                for item in you_owe_list:
-                                    if item['creditor_id'] == other_user_id:
-                                        existing = item
-                                        break
-                                
-                                if existing:
-                                    existing['amount'] += amount_owed
-                                    existing['amount'] = round(existing['amount'], 2)
-                                else:
-                                    # Buscar uma dívida individual real para este credor para ter um debt_id (excluindo vendidas)
-                                    sample_debt = Debt.get_pending_debts(
-                                        debtor_id=user_id,
-                                        creditor_id=other_user_id
-                                    ).first()
-                                    
-                                    # Verificar se há dívidas pagas individualmente que devem reduzir o saldo
-                                    paid_debts = Debt.query.filter_by(
-                                        debtor_id=user_id,
-                                        creditor_id=other_user_id,
-                                        status='paid'
-                                    ).all()
-                                    
-                                    paid_amount = sum(d.amount for d in paid_debts)
-                                    amount_owed = max(0, amount_owed - paid_amount)
-                                    
-                                    print(f"[DEBUG] Após descontar pagamentos: paid_amount={paid_amount}, amount_owed_final={amount_owed}")
-                                    
-                                    # Só incluir se ainda deve alguma coisa
-                                    if amount_owed > 0.01:
-                                        you_owe_list.append({
-                                            'id': sample_debt.id if sample_debt else f'virtual_{user_id}_{other_user_id}',
-                                            'creditor_id': other_user_id,
-                                            'creditor_name': other_user.name,
-                                            'amount': round(amount_owed, 2),
-                                            'source': 'group_debt'
-                                        })
-                            
-            elif user_balance > 0:  # Usuário deve receber (saldo positivo)
-                # Encontrar quem deve no grupo
-                for other_user_id, other_balance in group_balances.items():
-                    if other_user_id != user_id and other_balance < -0.01:
-                        # Calcular quanto este outro usuário deve para o usuário atual
-                        
-                        total_negative = sum(abs(balance) for balance in group_balances.values() if balance < 0)
-                        if total_negative > 0:
-                            proportion = abs(other_balance) / total_negative
-                            amount_to_receive = user_balance * proportion
-                            
-                            if amount_to_receive > 0.01:  # Apenas valores significativos
-                                other_user = User.query.get(other_user_id)
-                                
-                                # Verificar se já existe entrada para este devedor
-                                existing = None
-                                for item in others_owe_list:
-                                    if item['debtor_id'] == other_user_id:
-                                        existing = item
-                                        break
-                                
-                                if existing:
-                                    existing['amount'] += amount_to_receive
-                                    existing['amount'] = round(existing['amount'], 2)
-                                else:
-                                    others_owe_list.append({
-                                        'debtor_id': other_user_id,
-                                        'debtor_name': other_user.name,
-                                        'amount': round(amount_to_receive, 2),
-                                        'source': 'group_debt'
-                                    })
-    
-    # Adicionar dívidas de títulos comprados (purchased_title)
-    purchased_debts = Debt.query.filter_by(
-        creditor_id=user_id,
-        status='pending',
-        source='purchased_title'
-    ).all()
-    
-    for debt in purchased_debts:
-        # Verificar se já existe entrada para este devedor
-        existing = None
-        for item in others_owe_list:
-            if item['debtor_id'] == debt.debtor_id:
-                existing = item
-                break
-        
-        if existing:
-            existing['amount'] += debt.amount
-            existing['amount'] = round(existing['amount'], 2)
-            existing['source'] = 'mixed'  # Mistura de group_debt e purchased_title
-        else:
-            others_owe_list.append({
-                'debtor_id': debt.debtor_id,
-                'debtor_name': debt.debtor.name,
-                'amount': round(debt.amount, 2),
-                'source': 'purchased_title'
-            })
+    snapshot = DashboardSnapshot.for_user(user_id)
+    you_owe_list = snapshot.categorized['you_owe']
+    others_owe_list = snapshot.categorized['others_owe_you']
     
     # Calcular totais ajustados
     total_you_owe = sum(item['amount'] for item in you_owe_list)
@@ -5,48 +5,115 @@ from app.models.user import User
 from app.models.receivable import Receivable
 from app.models.debt import Debt
 from app.models.wallet import Wallet, Transaction
+from app.services.serializer_service import SerializerService
+from app.services.pagination_service import PaginationService
+from app.services.order_book import OrderBook, ORDER_BOOK_SORTS
+from app.services.marketplace_stats_service import MarketplaceStatsService
+from app.services.balance_service import BalanceService
 
 marketplace_bp = Blueprint('marketplace', __name__)
 
+# Filtros da listagem: parâmetro -> condição
+MARKETPLACE_FILTERS = {
+    'min_discount': lambda value: Receivable.profit_estimated >= value,
+    'min_score': lambda value: User.score >= value,
+    'max_score': lambda value: User.score <= value,
+    'min_nominal': lambda value: Receivable.nominal_amount >= value,
+    'max_nominal': lambda value: Receivable.nominal_amount <= value,
+}
+
 @marketplace_bp.route('/', methods=['GET'])
 @jwt_required()
 def get_marketplace_items():
-    """Obter todos os títulos à venda no marketplace"""
+    """Obter os títulos à venda no marketplace, do maior para o menor lucro estimado
+    
+    Filtros opcionais: min_discount (lucro mínimo em R$), min_score/max_score (score do
+    dono) e min_nominal/max_nominal; ?sort=discount ordena pelo desconto percentual.
+    Com ?limit= ou ?cursor= devolve uma página e o cursor da próxima vem no header
+    X-Next-Cursor. Servido do livro de ofertas em memória quando habilitado.
+    """
     try:
         user_id = get_jwt_identity()
-        print(f"[DEBUG] Getting marketplace items for user: {user_id}")
         
-        # Buscar todos os recebíveis à venda, exceto os do usuário atual
-        receivables = Receivable.query.filter(
+        try:
+            filters = {
+                name: float(request.args[name])
+                for name in MARKETPLACE_FILTERS
+                if request.args.get(name) not in (None, '')
+            }
+            limit, cursor = PaginationService.parse_limit(request.args.get('limit')), request.args.get('cursor')
+        except ValueError:
+            return jsonify({'error': 'Filtro ou limit inválido'}), 400
+        
+        sort = request.args.get('sort', 'profit')
+        if sort not in ORDER_BOOK_SORTS:
+            return jsonify({'error': f'sort deve ser um de: {", ".join(ORDER_BOOK_SORTS)}'}), 400
+        paginated = 'limit' in request.args or 'cursor' in request.args
+        
+        if OrderBook.enabled():
+            cursor_values = PaginationService.decode_cursor(cursor, [Receivable.profit_estimated, Receivable.id]) if cursor else None
+            entries, next_values, version = OrderBook.read(
+                exclude_owner_id=user_id,
+                filters=filters,
+                sort=sort,
+                cursor_values=cursor_values,
+                limit=limit if paginated else None
+            )
+            marketplace_items = [
+                {**entry['item'], 'seller_anonymous_id': f"Usuário {entry['owner_id']}"} for entry in entries
+            ]
+            response = jsonify(marketplace_items)
+            response.headers['X-Order-Book-Version'] = str(version)
+            if next_values:
+                response.headers['X-Next-Cursor'] = PaginationService.encode_cursor(next_values)
+            return response
+        
+        # Recebíveis à venda de outros usuários, com o dono na mesma consulta
+        query = Receivable.query.join(User, User.id == Receivable.owner_id).options(
+            db.contains_eager(Receivable.owner)
+        ).filter(
             Receivable.status == 'for_sale',
-            Receivable.owner_id != user_id
-        ).all()
+            Receivable.owner_id != user_id,
+            *[MARKETPLACE_FILTERS[name](value) for name, value in filters.items()]
+        )
         
-        # Debug: mostrar todos os recebíveis à venda
-        all_for_sale = Receivable.query.filter(Receivable.status == 'for_sale').all()
-        print(f"[DEBUG] Total receivables for sale: {len(all_for_sale)}")
-        for r in all_for_sale:
-            print(f"[DEBUG] Receivable {r.id[:8]}... owner: {r.owner_id}, current user: {user_id}, match: {r.owner_id == user_id}")
+        # Ordenado pelo índice (status, profit_estimated, id); paginação por cursor se pedida
+        if sort == 'discount':
+            columns = [Receivable.profit_estimated / Receivable.nominal_amount, Receivable.id]
+            sort_key = lambda receivable: [receivable.profit_estimated / receivable.nominal_amount, receivable.id]
+        else:
+            columns, sort_key = [Receivable.profit_estimated, Receivable.id], None
+        
+        next_cursor = None
+        if paginated:
+            receivables, next_cursor = PaginationService.paginate(query, columns, cursor, limit, sort_key=sort_key)
+        else:
+            receivables = query.order_by(*[column.desc() for column in columns]).all()
         
-        print(f"[DEBUG] Found {len(receivables)} receivables after filtering")
-    
         # Retornar dados anonimizados
         marketplace_items = []
-        for receivable in receivables:
-            item = receivable.to_dict(anonymous=True)
+        for receivable, item in zip(receivables, SerializerService.receivables_to_dict(receivables, anonymous=True)):
             item['seller_anonymous_id'] = f"Usuário {receivable.owner_id}"
             marketplace_items.append(item)
         
-        # Ordenar por lucro estimado (descendente)
-        marketplace_items.sort(key=lambda x: x['profit_estimated'], reverse=True)
-        
-        print(f"[DEBUG] Returning {len(marketplace_items)} marketplace items")
-        return jsonify(marketplace_items)
+        response = jsonify(marketplace_items)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
         
+    except ValueError as e:
+        # Cursor inválido
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"[ERROR] Error in get_marketplace_items: {str(e)}")
         return jsonify({'error': f'Erro ao carregar marketplace: {str(e)}'}), 500
 
+@marketplace_bp.route('/order-book', methods=['GET'])
+@jwt_required()
+def get_order_book_status():
+    """Estado do livro de ofertas em memória (versão, tamanho e idade) para monitoramento"""
+    return jsonify(OrderBook.status())
+
 @marketplace_bp.route('/sell', methods=['POST'])
 @jwt_required()
 def create_receivable():
@@ -73,34 +140,12 @@ def create_receivable():
         
     if debtor_id:
         # Validar se o devedor existe e calcular saldo consolidado real
-        from app.models.user import GroupMember
-        from collections import defaultdict
-        
         debtor = User.query.get(debtor_id)
         if not debtor:
             return jsonify({'error': 'Devedor não encontrado'}), 404
         
-        # Calcular saldo consolidado real usando a mesma lógica do endpoint /consolidated
-        user_groups = GroupMember.query.filter_by(user_id=user_id).all()
-        global_balance_for_debtor = 0.0
-        
-        for group_member in user_groups:
-            group_id = group_member.group_id
-            
-            # Verificar se o devedor também está neste grupo
-            debtor_in_group = GroupMember.query.filter_by(
-                user_id=debtor_id, 
-                group_id=group_id
-            ).first()
-            
-            if debtor_in_group:
-                # Calcular saldos do grupo
-                from app.routes.debts import _calculate_group_balances
-                group_balances = _calculate_group_balances(group_id)
-                
-                debtor_balance = group_balances.get(debtor_id, 0.0)
-                # Se balance é negativo para o devedor, ele me deve (inverter perspectiva)
-                global_balance_for_debtor += -debtor_balance
+        # Saldo consolidado real, o mesmo do endpoint /consolidated (saldos materializados)
+        global_balance_for_debtor = BalanceService.balances_owed_to(user_id).get(debtor_id, 0.0)
         
         if global_balance_for_debtor <= 0.01:
             return jsonify({'error': 'Este usuário não tem saldo devedor significativo'}), 400
@@ -181,7 +226,7 @@ def create_receivable():
         ).all()
         
         for debt in debts_to_mark:
-            debt.status = 'sold_as_title'
+            debt.set_status('sold_as_title')
             debt.sold_at = datetime.utcnow()
             
         print(f"[MARKETPLACE] Marcadas {len(debts_to_mark)} dívidas como sold_as_title para debtor {debtor_id}")
@@ -191,12 +236,15 @@ def create_receivable():
         from datetime import datetime
         debt = Debt.query.get(debt_id)
         if debt:
-            debt.status = 'sold_as_title'
+            debt.set_status('sold_as_title')
             debt.sold_at = datetime.utcnow()
             print(f"[MARKETPLACE] Dívida {debt_id[:8]}... marcada como sold_as_title")
     
+    MarketplaceStatsService.record_listed(receivable)
+    
     try:
         db.session.commit()
+        OrderBook.add(receivable)
         
         print(f"🎯 [MARKETPLACE] SUCESSO! Receivable {receivable.id[:8]}... criado")
         print(f"[MARKETPLACE] ===== FIM DA CHAMADA =====\n")
@@ -226,6 +274,8 @@ def buy_receivable(receivable_id):
     
     # Verificar se está à venda
     if receivable.status != 'for_sale':
+        # Oferta desatualizada (vendida por outro processo): tira do livro em memória
+        OrderBook.remove(receivable.id)
         return jsonify({'error': 'Título não está disponível para venda'}), 400
     
     # Verificar se não é o próprio dono
@@ -243,13 +293,21 @@ def buy_receivable(receivable_id):
         if not seller_wallet:
             return jsonify({'error': 'Carteira do vendedor não encontrada'}), 404
         
+        # Reservar o título com UPDATE condicional: entre compradores concorrentes só um vence
+        if not receivable.claim_for_buyer(user_id):
+            db.session.rollback()
+            OrderBook.remove(receivable.id)
+            return jsonify({'error': 'Título já foi vendido ou retirado de venda'}), 409
+        
         # Usar os métodos da wallet sem commit automático para gerenciar a transação completa
         if not buyer_wallet.withdraw_funds(
             receivable.selling_price, 
             f'Compra de título #{receivable.id[:8]}... (R$ {receivable.nominal_amount:.2f})',
             auto_commit=False
         ):
-            return jsonify({'error': 'Erro ao debitar comprador'}), 500
+            # Outra requisição consumiu o saldo entre a verificação e o débito
+            db.session.rollback()
+            return jsonify({'error': 'Saldo insuficiente'}), 400
             
         if not seller_wallet.add_funds(
             receivable.selling_price,
@@ -260,9 +318,11 @@ def buy_receivable(receivable_id):
             return jsonify({'error': 'Erro ao creditar vendedor'}), 500
         
         # Realizar a compra (transferir a dívida)
-        if receivable.sell_to_buyer(user_id):
+        if receivable.transfer_debts(user_id):
+            MarketplaceStatsService.record_sold(receivable)
             # Commit final de toda a transação
             db.session.commit()
+            OrderBook.remove(receivable.id)
             return jsonify({
                 'message': 'Título comprado com sucesso',
                 'receivable': receivable.to_dict(),
@@ -293,9 +353,9 @@ def get_my_receivables():
     sold = Receivable.query.filter_by(owner_id=user_id, status='sold').all()
     
     return jsonify({
-        'selling': [r.to_dict() for r in selling],
-        'bought': [r.to_dict() for r in bought],
-        'sold': [r.to_dict() for r in sold]
+        'selling': SerializerService.receivables_to_dict(selling),
+        'bought': SerializerService.receivables_to_dict(bought),
+        'sold': SerializerService.receivables_to_dict(sold)
     })
 
 @marketplace_bp.route('/cancel/<receivable_id>', methods=['DELETE'])
@@ -318,30 +378,18 @@ def cancel_receivable(receivable_id):
     
     # ====== CRÍTICO: Reverter dívidas para status 'pending' ======
     try:
-        if receivable.consolidated_group_id:
-            # Recebível consolidado - reverter todas as dívidas do devedor
-            debts_to_revert = Debt.query.filter_by(
-                creditor_id=user_id,
-                debtor_id=receivable.consolidated_group_id,
-                status='sold_as_title'
-            ).all()
-            
-            for debt in debts_to_revert:
-                debt.status = 'pending'
-                debt.sold_at = None
-                
-            print(f"[MARKETPLACE] Revertidas {len(debts_to_revert)} dívidas para pending")
-            
-        elif receivable.debt_id:
-            # Recebível individual
-            debt = Debt.query.get(receivable.debt_id)
-            if debt and debt.status == 'sold_as_title':
-                debt.status = 'pending'
-                debt.sold_at = None
-                print(f"[MARKETPLACE] Dívida {debt.id[:8]}... revertida para pending")
+        # Só cancela se ainda estiver à venda (uma compra concorrente pode ter vencido)
+        if not receivable.change_status('for_sale', 'cancelled'):
+            db.session.rollback()
+            return jsonify({'error': 'Título não está à venda'}), 409
         
-        receivable.status = 'cancelled'
+        # Um único UPDATE para todas as dívidas do título (consolidado ou individual)
+        reverted = receivable.revert_debts()
+        print(f"[MARKETPLACE] Revertidas {reverted} dívidas para pending")
+        
+        MarketplaceStatsService.record_cancelled(receivable)
         db.session.commit()
+        OrderBook.remove(receivable.id)
         
         return jsonify({'message': 'Venda cancelada com sucesso'})
         
@@ -352,22 +400,10 @@ def cancel_receivable(receivable_id):
 @marketplace_bp.route('/stats', methods=['GET'])
 @jwt_required()
 def get_marketplace_stats():
-    """Obter estatísticas do marketplace"""
-    # Total de títulos à venda
-    total_for_sale = Receivable.query.filter_by(status='for_sale').count()
-    
-    # Volume total em venda
-    total_volume = db.session.query(db.func.sum(Receivable.selling_price))\
-        .filter_by(status='for_sale').scalar() or 0
-    
-    # Maior desconto oferecido
-    max_discount = db.session.query(
-        db.func.max(Receivable.nominal_amount - Receivable.selling_price)
-    ).filter_by(status='for_sale').scalar() or 0
+    """Obter estatísticas do marketplace (agregados mantidos; ?days= dias de rollup, padrão 30)"""
+    try:
+        days = min(max(int(request.args.get('days', 30)), 1), 365)
+    except ValueError:
+        return jsonify({'error': 'days inválido'}), 400
     
-    return jsonify({
-        'total_titles_for_sale': total_for_sale,
-        'total_volume': total_volume,
-        'max_discount_available': max_discount,
-        'average_discount': (max_discount / 2) if max_discount > 0 else 0
-    })
\ No newline at end of file
+    return jsonify(MarketplaceStatsService.get_stats(days))
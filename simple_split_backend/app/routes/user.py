@@ -6,6 +6,9 @@ from app.models.wallet import Wallet, Transaction
 from app.models.debt import Debt
 from app.models.receivable import Receivable
 from app.models.expense import Expense
+from app.services.serializer_service import SerializerService
+from app.services.payment_service import PaymentService, PaymentError
+from app.services.dashboard_snapshot import DashboardSnapshot
 from datetime import datetime
 
 user_bp = Blueprint('user', __name__)
@@ -35,55 +38,18 @@ def get_user_profile():
     # Buscar títulos de recebíveis comprados
     bought_receivables = Receivable.query.filter_by(buyer_id=user_id, status='sold').all()
     
-    # Calcular totais otimizados para os cards do dashboard (mesma lógica do OTIMIZAR)
-    from app.routes.groups import calculate_user_net_balance
-    from app.models.user import GroupMember
-    
-    # Usar lógica otimizada baseada nos saldos dos grupos
-    user_groups = GroupMember.query.filter_by(user_id=user_id).all()
-    
-    optimized_total_to_pay = 0.0
-    optimized_total_to_receive = 0.0
-    
-    for membership in user_groups:
-        group_id = membership.group_id
-        
-        # Usar a função _calculate_group_balances
-        from app.routes.groups import _calculate_group_balances
-        group_balances = _calculate_group_balances(group_id)
-        
-        user_balance = group_balances.get(user_id, 0.0)
-        
-        if user_balance < 0:  # Usuário deve (saldo negativo)
-            # Calcular quanto deve proporcional aos outros saldos positivos
-            total_positive = sum(balance for balance in group_balances.values() if balance > 0)
-            if total_positive > 0:
-                user_debt_share = abs(user_balance)
-                optimized_total_to_pay += user_debt_share
-                
-        elif user_balance > 0:  # Usuário deve receber (saldo positivo)
-            optimized_total_to_receive += user_balance
-    
-    # Adicionar dívidas de títulos comprados (não são otimizadas)
-    purchased_debts = Debt.query.filter_by(
-        creditor_id=user_id,
-        status='pending',
-        source='purchased_title'
-    ).all()
-    
-    for debt in purchased_debts:
-        optimized_total_to_receive += debt.amount
-    
-    # Usar valores otimizados
-    total_to_pay = optimized_total_to_pay
-    total_to_receive = optimized_total_to_receive
+    # Totais otimizados para os cards do dashboard (mesma lógica do OTIMIZAR), calculados
+    # uma vez no snapshot compartilhado com /insights/summary e /insights/debts-categorized
+    snapshot = DashboardSnapshot.for_user(user_id)
+    total_to_pay = snapshot.group_to_pay
+    total_to_receive = snapshot.total_to_receive
     
     return jsonify({
         'user': user.to_dict(),
         'wallet': wallet.to_dict() if wallet else {'balance': 0},
-        'debts_to_pay': [debt.to_dict() for debt in debts_to_pay],
-        'debts_to_receive': [debt.to_dict() for debt in debts_to_receive],
-        'bought_receivables': [r.to_dict() for r in bought_receivables],
+        'debts_to_pay': SerializerService.debts_to_dict(debts_to_pay),
+        'debts_to_receive': SerializerService.debts_to_dict(debts_to_receive),
+        'bought_receivables': SerializerService.receivables_to_dict(bought_receivables),
         # Campos para os cards do dashboard
         'total_to_pay': total_to_pay,
         'total_to_receive': total_to_receive,
@@ -299,17 +265,14 @@ def _handle_virtual_debt_payment(debt_id, user_id):
         return jsonify({'error': 'Credor não encontrado'}), 404
     
     # Processar pagamento virtual
-    # 1. Reduzir saldo da wallet
-    wallet.balance -= amount
-    
-    # 2. Criar transação
-    transaction = Transaction(
-        wallet_id=wallet.id,
-        type='debit',
-        amount=amount,
-        description=f'Pagamento virtual - R${amount:.2f} para {creditor.name}'
-    )
-    db.session.add(transaction)
+    # 1. Reduzir saldo da wallet e 2. criar transação (UPDATE condicional ao saldo)
+    if not wallet.withdraw_funds(
+        amount,
+        f'Pagamento virtual - R${amount:.2f} para {creditor.name}',
+        auto_commit=False
+    ):
+        db.session.rollback()
+        return jsonify({'error': 'Saldo insuficiente na carteira'}), 400
     
     # 3. Criar uma dívida virtual paga para registrar no banco
     # Buscar qualquer despesa do grupo para referenciar (workaround)
@@ -333,9 +296,14 @@ def _handle_virtual_debt_payment(debt_id, user_id):
             status='paid',
             source='virtual_payment',
             paid_at=datetime.utcnow(),
-            expense_id=sample_expense.id  # Usar uma despesa existente como referência
+            expense_id=sample_expense.id,  # Usar uma despesa existente como referência
+            group_id=sample_expense.group_id
         )
         db.session.add(paid_debt)
+        
+        # Refletir o pagamento nos saldos materializados dos grupos em comum
+        from app.services.balance_service import BalanceService
+        BalanceService.debt_status_changed(paid_debt, None)
         print(f"[DEBUG] Dívida virtual adicionada à sessão")
     else:
         print(f"[DEBUG] Nenhuma despesa encontrada nos grupos, não criando dívida física")
@@ -420,26 +388,22 @@ def pay_debt(debt_id):
             return jsonify({'error': 'Saldo insuficiente na carteira'}), 400
 
         # Marcar como pago
-        debt.status = 'paid'
+        debt.set_status('paid')
         debt.paid_at = datetime.utcnow()
         
-        # Reduzir saldo da wallet
-        wallet.balance -= debt.amount
-
-        # Criar transação de débito
-        transaction = Transaction(
-            wallet_id=wallet.id,
-            type='debit',
-            amount=debt.amount,
-            description=f'Pagamento de dívida - R${debt.amount:.2f}'
-        )
-        
-        db.session.add(transaction)
+        # Reduzir saldo da wallet e criar transação de débito (UPDATE condicional ao saldo)
+        if not wallet.withdraw_funds(
+            debt.amount,
+            f'Pagamento de dívida - R${debt.amount:.2f}',
+            auto_commit=False
+        ):
+            db.session.rollback()
+            return jsonify({'error': 'Saldo insuficiente na carteira'}), 400
         
         # Notificar o grupo sobre o pagamento (para atualização em tempo real)
         group_id = None
-        if debt.expense and debt.expense.group_id:
-            group_id = debt.expense.group_id
+        if debt.group_id:
+            group_id = debt.group_id
             print(f"[DEBUG] Pagamento afeta o grupo: {group_id}")
             
             # Adicionar log/notificação para o grupo
@@ -474,6 +438,42 @@ def pay_debt(debt_id):
         db.session.rollback()
         return jsonify({'error': f'Erro: {str(e)}'}), 500
 
+@user_bp.route('/settle-up', methods=['POST'])
+@jwt_required()
+def settle_up():
+    """Pagar várias dívidas via wallet em uma única transação
+
+    Body: {"debt_ids": [...]} ou {"creditor_id": "..."} (todas as pendentes para o credor)
+    """
+    user_id = get_jwt_identity()
+    data = request.get_json() or {}
+
+    debt_ids = data.get('debt_ids')
+    creditor_id = data.get('creditor_id')
+    if debt_ids is None and not creditor_id:
+        return jsonify({'error': 'Informe debt_ids ou creditor_id'}), 400
+    if debt_ids is not None and (not isinstance(debt_ids, list) or not debt_ids
+                                 or not all(isinstance(debt_id, str) for debt_id in debt_ids)):
+        return jsonify({'error': 'debt_ids deve ser uma lista de ids'}), 400
+
+    try:
+        debts = PaymentService.find_debts_to_settle(user_id, debt_ids=debt_ids, creditor_id=creditor_id)
+        result = PaymentService.settle_debts(user_id, debts)
+        db.session.commit()
+    except PaymentError as e:
+        db.session.rollback()
+        return jsonify({'error': e.message}), e.status_code
+    except Exception as e:
+        print(f"[ERROR] Erro no pagamento em lote: {str(e)}")
+        db.session.rollback()
+        return jsonify({'error': f'Erro: {str(e)}'}), 500
+
+    return jsonify({
+        'success': True,
+        'message': f'{result["debts_paid"]} dívidas pagas, total de R${result["total_paid"]:.2f}',
+        **result
+    })
+
 @user_bp.route('/score-info', methods=['GET'])
 @jwt_required()
 def get_score_info():
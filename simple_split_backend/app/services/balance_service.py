@@ -0,0 +1,220 @@
+from app import db
+from app.models.debt import Debt
+from app.models.expense import Expense
+from app.models.group_balance import GroupBalance
+from app.models.user import GroupMember
+from collections import defaultdict
+
+# Status de dívida que entram no saldo do grupo (pagas via wallet e vendidas como título)
+SETTLED_STATUSES = ('paid', 'sold_as_title')
+
+
+class BalanceService:
+    """Mantém a tabela group_balances sincronizada com despesas e dívidas"""
+
+    @staticmethod
+    def compute_group_balances(group_id):
+        """Calcula do zero o saldo líquido de cada membro (pagou - deveria pagar + ajustes)"""
+        members = GroupMember.query.filter_by(group_id=group_id).all()
+        member_ids = [member.user_id for member in members]
+
+        if not member_ids:
+            return {}
+
+        # Quanto cada pessoa pagou e total de despesas do grupo
+        paid_by_user = defaultdict(float)
+        total_expenses = 0.0
+        for payer_id, amount in db.session.query(Expense.payer_id, Expense.amount).filter(
+            Expense.group_id == group_id
+        ):
+            paid_by_user[payer_id] += amount
+            total_expenses += amount
+
+        should_pay_per_person = total_expenses / len(member_ids)
+        balances = {user_id: paid_by_user.get(user_id, 0.0) - should_pay_per_person for user_id in member_ids}
+
+        def apply(debtor_id, creditor_id, amount):
+            # Quem pagou (ou teve a dívida vendida) melhora, quem recebeu (ou vendeu) piora
+            if debtor_id in balances:
+                balances[debtor_id] += amount
+            if creditor_id in balances:
+                balances[creditor_id] -= amount
+
+        # 1. Dívidas do grupo (despesas e liquidações) pagas via wallet ou vendidas como títulos
+        settled_debts = db.session.query(Debt.debtor_id, Debt.creditor_id, Debt.amount).filter(
+            Debt.group_id == group_id,
+            Debt.status.in_(SETTLED_STATUSES)
+        )
+        for debtor_id, creditor_id, amount in settled_debts:
+            apply(debtor_id, creditor_id, amount)
+
+        # 2. Pagamentos virtuais diretos entre membros do grupo
+        virtual_payments = db.session.query(Debt.debtor_id, Debt.creditor_id, Debt.amount).filter(
+            Debt.source == 'virtual_payment',
+            Debt.status == 'paid',
+            Debt.debtor_id.in_(member_ids),
+            Debt.creditor_id.in_(member_ids)
+        )
+        for debtor_id, creditor_id, amount in virtual_payments:
+            apply(debtor_id, creditor_id, amount)
+
+        return balances
+
+    @staticmethod
+    def rebuild_group(group_id):
+        """Regrava os saldos materializados de um grupo (não faz commit)"""
+        balances = BalanceService.compute_group_balances(group_id)
+
+        GroupBalance.query.filter_by(group_id=group_id).delete(synchronize_session=False)
+        for user_id, balance in balances.items():
+            db.session.add(GroupBalance(group_id=group_id, user_id=user_id, balance=balance))
+        db.session.flush()
+
+        return balances
+
+    @staticmethod
+    def get_group_balances(group_id):
+        """Retorna {user_id: saldo} lendo a tabela materializada"""
+        rows = db.session.query(GroupBalance.user_id, GroupBalance.balance).filter(
+            GroupBalance.group_id == group_id
+        ).all()
+
+        if not rows:
+            # Grupo sem saldos materializados (upgrade_schema ainda não rodou): calcula sem
+            # gravar, leitura não faz commit
+            return BalanceService.compute_group_balances(group_id)
+
+        return {user_id: balance for user_id, balance in rows}
+
+    @staticmethod
+    def get_user_group_balances(user_id):
+        """Retorna {group_id: {user_id: saldo}} de todos os grupos do usuário em uma única consulta"""
+        rows = db.session.query(GroupMember.group_id, GroupBalance.user_id, GroupBalance.balance).outerjoin(
+            GroupBalance, GroupBalance.group_id == GroupMember.group_id
+        ).filter(GroupMember.user_id == user_id).all()
+
+        balances_by_group = defaultdict(dict)
+        missing_groups = set()
+        for group_id, member_id, balance in rows:
+            if member_id is None:
+                missing_groups.add(group_id)
+            else:
+                balances_by_group[group_id][member_id] = balance
+
+        # Grupos ainda não materializados são calculados sem gravar (leitura não faz commit)
+        for group_id in missing_groups:
+            balances_by_group[group_id] = BalanceService.compute_group_balances(group_id)
+
+        return dict(balances_by_group)
+
+    @staticmethod
+    def balances_owed_to(user_id):
+        """Quanto cada membro dos grupos do usuário deve a ele ({user_id: valor}; negativo = usuário deve)
+
+        Soma, em cada grupo em comum, o saldo do outro membro com sinal invertido.
+        """
+        owed = defaultdict(float)
+        for group_balances in BalanceService.get_user_group_balances(user_id).values():
+            for other_user_id, balance in group_balances.items():
+                if other_user_id != user_id:
+                    owed[other_user_id] -= balance
+        return dict(owed)
+
+    @staticmethod
+    def apply_expense(expense, sign=1):
+        """Aplica (ou remove, com sign=-1) uma despesa nos saldos do grupo"""
+        member_count = GroupMember.query.filter_by(group_id=expense.group_id).count()
+        if member_count == 0:
+            return
+
+        # Todos os membros dividem a despesa igualmente...
+        BalanceService._adjust(
+            GroupBalance.group_id == expense.group_id,
+            delta=-sign * expense.amount / member_count
+        )
+        # ...e o pagador recupera o valor total
+        BalanceService._adjust(
+            GroupBalance.group_id == expense.group_id,
+            GroupBalance.user_id == expense.payer_id,
+            delta=sign * expense.amount
+        )
+
+    @staticmethod
+    def apply_deltas(group_id, deltas):
+        """Aplica vários ajustes {user_id: delta} de um grupo em um único executemany"""
+        rows = [{'member_id': user_id, 'delta': delta} for user_id, delta in deltas.items() if delta]
+        if not rows:
+            return
+        balances = GroupBalance.__table__
+        db.session.execute(
+            balances.update()
+            .where(balances.c.group_id == group_id, balances.c.user_id == db.bindparam('member_id'))
+            .values(balance=balances.c.balance + db.bindparam('delta')),
+            rows
+        )
+
+    @staticmethod
+    def debt_status_changed(debt, old_status):
+        """Ajusta os saldos após uma mudança de status da dívida (sem commit)"""
+        old_weight = BalanceService._weights(debt, old_status)
+        new_weight = BalanceService._weights(debt, debt.status)
+
+        group_delta = (new_weight[0] - old_weight[0]) * debt.amount
+        virtual_delta = (new_weight[1] - old_weight[1]) * debt.amount
+
+        if group_delta and debt.group_id:
+            BalanceService._transfer([debt.group_id], debt.debtor_id, debt.creditor_id, group_delta)
+
+        if virtual_delta:
+            # Pagamento virtual vale em todos os grupos que os dois compartilham
+            creditor_groups = db.session.query(GroupMember.group_id).filter(
+                GroupMember.user_id == debt.creditor_id
+            )
+            shared_groups = db.session.query(GroupMember.group_id).filter(
+                GroupMember.user_id == debt.debtor_id,
+                GroupMember.group_id.in_(creditor_groups)
+            ).all()
+            BalanceService._transfer([g for (g,) in shared_groups], debt.debtor_id, debt.creditor_id, virtual_delta)
+
+    @staticmethod
+    def debts_paid(debts):
+        """Versão em lote de debt_status_changed para dívidas de grupo pendentes que foram pagas"""
+        deltas_by_group = defaultdict(lambda: defaultdict(float))
+        for debt in debts:
+            if debt.group_id:
+                deltas_by_group[debt.group_id][debt.debtor_id] += debt.amount
+                deltas_by_group[debt.group_id][debt.creditor_id] -= debt.amount
+
+        for group_id, deltas in deltas_by_group.items():
+            BalanceService.apply_deltas(group_id, deltas)
+
+    @staticmethod
+    def _weights(debt, status):
+        """Peso da dívida no saldo do seu grupo e nos grupos compartilhados"""
+        in_group = 1 if status in SETTLED_STATUSES else 0
+        virtual = 1 if status == 'paid' and debt.source == 'virtual_payment' else 0
+        return in_group, virtual
+
+    @staticmethod
+    def _transfer(group_ids, debtor_id, creditor_id, amount):
+        if not group_ids:
+            return
+        BalanceService._adjust(
+            GroupBalance.group_id.in_(group_ids),
+            GroupBalance.user_id == debtor_id,
+            delta=amount
+        )
+        BalanceService._adjust(
+            GroupBalance.group_id.in_(group_ids),
+            GroupBalance.user_id == creditor_id,
+            delta=-amount
+        )
+
+    @staticmethod
+    def _adjust(*criteria, delta):
+        # UPDATE atômico (balance = balance + delta); grupos ainda não materializados
+        # não têm linhas e serão recalculados na primeira leitura
+        GroupBalance.query.filter(*criteria).update(
+            {GroupBalance.balance: GroupBalance.balance + delta},
+            synchronize_session=False
+        )
@@ -0,0 +1,283 @@
+from app import db
+from app.models.user import User
+from app.models.wallet import Wallet
+from app.models.debt import Debt
+from app.models.data_version import DataVersion
+from app.services.balance_service import BalanceService
+from app.services.serializer_service import ID_CHUNK_SIZE
+from flask import current_app, g
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import threading
+import time
+
+# Snapshots guardados entre requisições (os mais antigos saem primeiro)
+MAX_CACHED_SNAPSHOTS = 1024
+
+# Linha de data_versions incrementada a cada commit que altera dados do dashboard
+DASHBOARD_VERSION = 'dashboard'
+
+# Tabelas lidas pelo snapshot; escritas em outras não invalidam
+DASHBOARD_TABLES = {'debts', 'group_balances', 'group_members', 'wallets', 'users'}
+
+
+class DashboardSnapshot:
+    """Dados do dashboard de um usuário calculados uma vez e lidos por profile, summary e insights
+
+    Guarda saldos dos grupos, créditos de títulos comprados, pagamentos por credor, saldo da
+    carteira e score, além do rateio por contraparte já feito. Vale para a requisição inteira
+    (flask.g) e, entre requisições, enquanto a versão em data_versions não mudar e a idade for
+    menor que DASHBOARD_SNAPSHOT_MAX_AGE. A versão fica no banco para valer entre processos.
+    """
+
+    _cache = {}
+    _lock = threading.Lock()
+
+    def __init__(self, user_id, version=None):
+        self.user_id = user_id
+
+        # Versão lida antes dos dados: uma escrita no meio só causa uma reconstrução a mais
+        self.version = version
+        self.balances_by_group = BalanceService.get_user_group_balances(user_id)
+        self.database_uri = current_app.config['SQLALCHEMY_DATABASE_URI']
+        self.built_monotonic = time.monotonic()
+
+        user = db.session.query(User.score, Wallet.balance).outerjoin(
+            Wallet, Wallet.user_id == User.id
+        ).filter(User.id == user_id).first()
+        self.found = user is not None
+        self.score = user[0] if user else None
+        self.wallet_balance = user[1] if user and user[1] is not None else 0
+
+        # Pagamentos individuais já feitos, somados por credor
+        self.paid_by_creditor = dict(
+            db.session.query(Debt.creditor_id, db.func.sum(Debt.amount))
+            .filter(Debt.debtor_id == user_id, Debt.status == 'paid')
+            .group_by(Debt.creditor_id)
+            .all()
+        )
+
+        # Uma dívida pendente real por credor, para ter um debt_id (excluindo vendidas)
+        self.sample_debt_ids = {}
+        for creditor_id, debt_id in Debt.get_pending_debts(debtor_id=user_id).with_entities(Debt.creditor_id, Debt.id):
+            self.sample_debt_ids.setdefault(creditor_id, debt_id)
+
+        # Créditos de títulos comprados (não entram na otimização): (devedor, valor, nome)
+        self.purchased_credits = db.session.query(Debt.debtor_id, Debt.amount, User.name).join(
+            User, User.id == Debt.debtor_id
+        ).filter(
+            Debt.creditor_id == user_id,
+            Debt.status == 'pending',
+            Debt.source == 'purchased_title'
+        ).all()
+
+        # Nomes de todos os membros com saldo nos grupos do usuário
+        other_ids = list({
+            other_user_id
+            for group_balances in self.balances_by_group.values()
+            for other_user_id, balance in group_balances.items()
+            if other_user_id != user_id and abs(balance) > 0.01
+        })
+        self.names = {}
+        for start in range(0, len(other_ids), ID_CHUNK_SIZE):
+            self.names.update(
+                db.session.query(User.id, User.name).filter(User.id.in_(other_ids[start:start + ID_CHUNK_SIZE]))
+            )
+
+        self._allocate()
+
+    def _allocate(self):
+        """Uma passada pelos grupos: totais otimizados e rateio proporcional por contraparte
+
+        owed_shares: (credor, parte) do que o usuário deve; receivable_shares: (devedor, parte)
+        do que tem a receber, na ordem dos grupos.
+        """
+        self.group_to_pay = 0.0       # Saldos negativos dos grupos com alguém a receber
+        self.group_to_receive = 0.0   # Saldos positivos dos grupos
+        self.receive_balance = 0.0    # Saldos positivos significativos (> 0.01)
+        self.owed_shares = []
+        self.receivable_shares = []
+
+        for group_balances in self.balances_by_group.values():
+            user_balance = group_balances.get(self.user_id, 0.0)
+            total_positive = sum(balance for balance in group_balances.values() if balance > 0)
+            total_negative = sum(abs(balance) for balance in group_balances.values() if balance < 0)
+
+            if user_balance < 0 and total_positive > 0:
+                self.group_to_pay += abs(user_balance)
+            elif user_balance > 0:
+                self.group_to_receive += user_balance
+
+            if abs(user_balance) <= 0.01:  # Apenas se tiver saldo significativo
+                continue
+            if user_balance > 0:
+                self.receive_balance += user_balance
+
+            for other_user_id, other_balance in group_balances.items():
+                if other_user_id == self.user_id:
+                    continue
+                if user_balance < 0 and other_balance > 0.01 and total_positive > 0:
+                    # Usuário deve: parte proporcional ao quanto cada credor deve receber
+                    share = abs(user_balance) * (other_balance / total_positive)
+                    if share > 0.01:
+                        self.owed_shares.append((other_user_id, share))
+                elif user_balance > 0 and other_balance < -0.01 and total_negative > 0:
+                    # Usuário recebe: parte proporcional ao quanto cada devedor deve
+                    share = user_balance * (abs(other_balance) / total_negative)
+                    if share > 0.01:
+                        self.receivable_shares.append((other_user_id, share))
+
+        self.categorized = self._categorize()
+
+    def _categorize(self):
+        """Listas 'você deve' e 'devem a você' por contraparte (dívidas categorizadas)"""
+        you_owe = {}
+        others_owe = {}
+
+        for other_user_id, amount_owed in self.owed_shares:
+            existing = you_owe.get(other_user_id)
+            if existing:
+                existing['amount'] = round(existing['amount'] + amount_owed, 2)
+                continue
+
+            # Descontar dívidas pagas individualmente para este credor
+            amount_owed = max(0, amount_owed - self.paid_by_creditor.get(other_user_id, 0.0))
+            if amount_owed > 0.01:
+                you_owe[other_user_id] = {
+                    'id': self.sample_debt_ids.get(other_user_id, f'virtual_{self.user_id}_{other_user_id}'),
+                    'creditor_id': other_user_id,
+                    'creditor_name': self.names.get(other_user_id),
+                    'amount': round(amount_owed, 2),
+                    'source': 'group_debt'
+                }
+
+        for other_user_id, amount_to_receive in self.receivable_shares:
+            existing = others_owe.get(other_user_id)
+            if existing:
+                existing['amount'] = round(existing['amount'] + amount_to_receive, 2)
+            else:
+                others_owe[other_user_id] = {
+                    'debtor_id': other_user_id,
+                    'debtor_name': self.names.get(other_user_id),
+                    'amount': round(amount_to_receive, 2),
+                    'source': 'group_debt'
+                }
+
+        for debtor_id, amount, debtor_name in self.purchased_credits:
+            existing = others_owe.get(debtor_id)
+            if existing:
+                existing['amount'] = round(existing['amount'] + amount, 2)
+                existing['source'] = 'mixed'  # Mistura de group_debt e purchased_title
+            else:
+                others_owe[debtor_id] = {
+                    'debtor_id': debtor_id,
+                    'debtor_name': debtor_name,
+                    'amount': round(amount, 2),
+                    'source': 'purchased_title'
+                }
+
+        return {'you_owe': list(you_owe.values()), 'others_owe_you': list(others_owe.values())}
+
+    @property
+    def total_to_receive(self):
+        """Saldos positivos dos grupos mais os títulos comprados (cards do perfil)"""
+        return self._plus_purchased(self.group_to_receive)
+
+    @property
+    def significant_to_receive(self):
+        """Saldos positivos acima de 0.01 mais os títulos comprados (resumo)"""
+        return self._plus_purchased(self.receive_balance)
+
+    def _plus_purchased(self, total):
+        for _, amount, _ in self.purchased_credits:
+            total += amount
+        return total
+
+    @property
+    def owed_after_payments(self):
+        """Total a pagar descontando, em cada parte, o já pago individualmente ao credor (resumo)"""
+        return sum(
+            max(0, amount_owed - self.paid_by_creditor.get(other_user_id, 0.0))
+            for other_user_id, amount_owed in self.owed_shares
+        )
+
+    @classmethod
+    def for_user(cls, user_id):
+        """Snapshot da requisição atual, reaproveitado entre requisições enquanto válido"""
+        per_request = g.setdefault('dashboard_snapshots', {})
+        if user_id in per_request:
+            return per_request[user_id]
+
+        max_age = current_app.config.get('DASHBOARD_SNAPSHOT_MAX_AGE', 0)
+        version = cls.current_version() if max_age > 0 else None
+        snapshot = cls._cache.get(user_id) if version is not None else None
+        if snapshot is None or not snapshot._is_valid(version, max_age):
+            snapshot = cls(user_id, version)
+            if version is not None:
+                with cls._lock:
+                    cls._cache.pop(user_id, None)
+                    cls._cache[user_id] = snapshot
+                    while len(cls._cache) > MAX_CACHED_SNAPSHOTS:
+                        cls._cache.pop(next(iter(cls._cache)))
+
+        per_request[user_id] = snapshot
+        return snapshot
+
+    def _is_valid(self, version, max_age):
+        return (
+            self.version == version
+            and self.database_uri == current_app.config['SQLALCHEMY_DATABASE_URI']
+            and time.monotonic() - self.built_monotonic < max_age
+        )
+
+    @staticmethod
+    def current_version():
+        """Versão atual dos dados do dashboard (None se a linha ainda não existe: sem cache)"""
+        return db.session.query(DataVersion.version).filter(DataVersion.name == DASHBOARD_VERSION).scalar()
+
+    @staticmethod
+    def ensure_version():
+        """Cria a linha da versão se ainda não existir (sem commit)"""
+        if not db.session.get(DataVersion, DASHBOARD_VERSION):
+            db.session.add(DataVersion(name=DASHBOARD_VERSION, version=0))
+            db.session.flush()
+
+    @staticmethod
+    def invalidate():
+        """Nova versão dos dados: snapshots anteriores deixam de valer em todos os processos"""
+        versions = DataVersion.__table__
+        # Conexão própria e UPDATE atômico: a linha fica travada só pelo tempo do incremento
+        with db.engine.begin() as connection:
+            connection.execute(
+                versions.update()
+                .where(versions.c.name == DASHBOARD_VERSION)
+                .values(version=versions.c.version + 1)
+            )
+
+
+# Escritas nas tabelas do dashboard (flush do ORM ou UPDATE/INSERT/DELETE em lote) marcam a sessão
+@event.listens_for(Session, 'after_flush')
+def _flag_flush(session, flush_context):
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        if getattr(instance, '__tablename__', None) in DASHBOARD_TABLES:
+            session.info['dashboard_writes'] = True
+            return
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _flag_bulk_write(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if getattr(table, 'name', None) in DASHBOARD_TABLES:
+            orm_execute_state.session.info['dashboard_writes'] = True
+
+
+# Incremento depois do commit da transação externa (savepoints também disparam after_commit):
+# quem ler a versão nova já enxerga os dados novos.
+# Um rollback mantém a marca: no pior caso o próximo commit invalida sem necessidade
+@event.listens_for(Session, 'after_commit')
+def _bump_version(session):
+    if session.in_nested_transaction():
+        return
+    if session.info.pop('dashboard_writes', None):
+        DashboardSnapshot.invalidate()
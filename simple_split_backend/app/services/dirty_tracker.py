@@ -0,0 +1,61 @@
+from app import db
+from app.models.expense import Expense
+from app.models.optimization_dirty import OptimizationDirty
+
+
+class DirtyTracker:
+    """Registra o que mudou nas dívidas para a otimização processar só o necessário"""
+
+    @staticmethod
+    def mark_debt(debt):
+        """Marca o grupo e o par devedor/credor de uma dívida (sem commit)"""
+        DirtyTracker.mark_pairs([(debt.debtor_id, debt.creditor_id)], group_id=debt.group_id)
+
+    @staticmethod
+    def mark_pairs(pairs, group_id=None, expense_id=None):
+        """Marca vários pares de usuários de um mesmo grupo/despesa em um único INSERT"""
+        rows = []
+        for user_1, user_2 in pairs:
+            user_a, user_b = sorted((user_1, user_2))
+            rows.append({'group_id': group_id, 'expense_id': expense_id, 'user_a': user_a, 'user_b': user_b})
+        if rows:
+            db.session.execute(OptimizationDirty.__table__.insert(), rows)
+
+    @staticmethod
+    def mark_group(group_id):
+        db.session.execute(OptimizationDirty.__table__.insert(), [{'group_id': group_id}])
+
+    @staticmethod
+    def has_pending():
+        return db.session.query(OptimizationDirty.id).limit(1).first() is not None
+
+    @staticmethod
+    def snapshot():
+        """Lê a fila atual: retorna (último id lido, grupos sujos, pares sujos)"""
+        dirty = OptimizationDirty.__table__
+        expenses = Expense.__table__
+        rows = db.session.execute(
+            db.select(
+                dirty.c.id,
+                db.func.coalesce(dirty.c.group_id, expenses.c.group_id),
+                dirty.c.user_a,
+                dirty.c.user_b
+            ).outerjoin(expenses, expenses.c.id == dirty.c.expense_id)
+        ).all()
+
+        last_id = 0
+        group_ids = set()
+        pairs = set()
+        for row_id, group_id, user_a, user_b in rows:
+            last_id = max(last_id, row_id)
+            if group_id:
+                group_ids.add(group_id)
+            if user_a and user_b:
+                pairs.add((user_a, user_b))
+
+        return last_id, group_ids, pairs
+
+    @staticmethod
+    def clear(last_id):
+        """Remove da fila o que já foi processado (marcas novas têm id maior e ficam)"""
+        OptimizationDirty.query.filter(OptimizationDirty.id <= last_id).delete(synchronize_session=False)
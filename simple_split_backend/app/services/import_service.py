@@ -0,0 +1,207 @@
+from app import db
+from app.models.user import GroupMember
+from app.models.group import Group
+from app.models.expense import Expense
+from app.models.debt import Debt
+from collections import defaultdict
+from datetime import datetime
+import csv
+import io
+import json
+import math
+import uuid
+
+# Despesas gravadas por transação durante a importação
+IMPORT_CHUNK_SIZE = 500
+
+# Quantos erros por linha devolver na resposta
+MAX_REPORTED_ERRORS = 500
+
+
+class ImportService:
+    """Importação em lote de despesas (CSV ou NDJSON) lida como stream"""
+
+    @staticmethod
+    def parse_csv(stream):
+        """Gera (linha, dict) a partir de um CSV com cabeçalho; member_ids separados por ';'"""
+        reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+        for row in reader:
+            row = {key.strip(): (value or '').strip() for key, value in row.items() if key}
+            if row.get('member_ids'):
+                row['member_ids'] = [member.strip() for member in row['member_ids'].split(';') if member.strip()]
+            yield reader.line_num, row
+
+    @staticmethod
+    def parse_ndjson(stream):
+        """Gera (linha, dict) com um objeto JSON por linha; linhas inválidas viram erro da linha"""
+        for line_number, line in enumerate(io.TextIOWrapper(stream, encoding='utf-8-sig'), start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield line_number, ValueError('JSON inválido')
+                continue
+            yield line_number, row if isinstance(row, dict) else ValueError('Cada linha deve ser um objeto JSON')
+
+    @staticmethod
+    def import_expenses(group_id, user_id, rows):
+        """Valida e grava as despesas em blocos; erros de uma linha não interrompem as demais
+
+        rows: iterável de (número da linha, dict ou exceção). Retorna o relatório da importação.
+        """
+        # Ordenado como a lista de membros e com busca O(1)
+        members = dict.fromkeys(
+            member_id for (member_id,) in
+            db.session.query(GroupMember.user_id).filter(GroupMember.group_id == group_id)
+        )
+
+        report = {'imported': 0, 'failed': 0, 'debts_created': 0, 'errors': [], 'aborted': False}
+        chunk = []
+        rows = iter(rows)
+        line_number = 0
+
+        while True:
+            try:
+                line_number, row = next(rows)
+            except StopIteration:
+                break
+            except (UnicodeDecodeError, csv.Error) as e:
+                # Arquivo corrompido no meio do stream: blocos anteriores já foram gravados,
+                # então o erro entra no relatório e o que já foi validado é gravado
+                report['failed'] += 1
+                report['errors'].append({'line': None, 'error': f'Arquivo inválido, leitura interrompida após a linha {line_number}: {str(e)}'})
+                report['aborted'] = True
+                break
+
+            try:
+                if isinstance(row, Exception):
+                    raise row
+                chunk.append(ImportService._validate(row, user_id, members))
+            except ValueError as e:
+                report['failed'] += 1
+                if len(report['errors']) < MAX_REPORTED_ERRORS:
+                    report['errors'].append({'line': line_number, 'error': str(e)})
+                continue
+
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                ImportService._write_chunk(group_id, list(members), chunk, report)
+                chunk = []
+
+        if chunk:
+            ImportService._write_chunk(group_id, list(members), chunk, report)
+
+        report['errors_truncated'] = report['failed'] > len(report['errors'])
+        return report
+
+    @staticmethod
+    def _validate(row, user_id, members):
+        """Converte uma linha em despesa validada (ValueError com a mensagem do problema)"""
+        description = str(row.get('description') or '').strip()
+        if not description:
+            raise ValueError('description é obrigatório')
+        if len(description) > 200:
+            raise ValueError('description deve ter até 200 caracteres')
+
+        try:
+            amount = float(row.get('amount'))
+        except (TypeError, ValueError):
+            raise ValueError('amount inválido')
+        if not math.isfinite(amount) or amount <= 0:
+            raise ValueError('amount deve ser maior que zero')
+
+        try:
+            date = datetime.strptime(row['date'], '%Y-%m-%d').date() if row.get('date') else datetime.now().date()
+        except (TypeError, ValueError):
+            raise ValueError('date deve estar no formato AAAA-MM-DD')
+
+        # Como em add_expense, o pagador é sempre quem está importando
+        payer_id = user_id
+        if row.get('payer_id') and row['payer_id'] != user_id:
+            raise ValueError('O pagador deve ser quem está importando')
+
+        member_ids = row.get('member_ids') or list(members)
+        if not isinstance(member_ids, list) or not all(isinstance(member_id, str) for member_id in member_ids):
+            raise ValueError('member_ids deve ser uma lista de ids')
+        member_ids = list(dict.fromkeys(member_ids))  # Membro repetido geraria duas dívidas
+        unknown = [member_id for member_id in member_ids if member_id not in members]
+        if unknown:
+            raise ValueError(f'Não são membros do grupo: {", ".join(map(str, unknown))}')
+
+        return {
+            'id': str(uuid.uuid4()),
+            'payer_id': payer_id,
+            'description': description,
+            'amount': amount,
+            'date': date,
+            'debtor_ids': [member_id for member_id in member_ids if member_id != payer_id]
+        }
+
+    @staticmethod
+    def _write_chunk(group_id, member_ids, expenses, report):
+        """Grava um bloco de despesas com dívidas, saldos, contadores e fila de otimização"""
+        from app.services.balance_service import BalanceService
+        from app.services.dirty_tracker import DirtyTracker
+
+        debt_rows = []
+        pairs = set()
+        balance_deltas = defaultdict(float)
+        for expense in expenses:
+            # Mesma regra do split_expense
+            if expense['debtor_ids']:
+                amount_per_person = expense['amount'] / (len(expense['debtor_ids']) + 1)
+                for debtor_id in expense['debtor_ids']:
+                    debt_rows.append({
+                        'expense_id': expense['id'],
+                        'group_id': group_id,
+                        'debtor_id': debtor_id,
+                        'creditor_id': expense['payer_id'],
+                        'amount': amount_per_person,
+                        'status': 'pending',
+                        'source': 'group_debt'
+                    })
+                    pairs.add((debtor_id, expense['payer_id']))
+
+            # Mesma regra do BalanceService.apply_expense: o pagador recupera o valor total...
+            balance_deltas[expense['payer_id']] += expense['amount']
+
+        # ...e todos os membros dividem igualmente o total do bloco
+        chunk_total = sum(expense['amount'] for expense in expenses)
+        for member_id in member_ids:
+            balance_deltas[member_id] -= chunk_total / len(member_ids)
+
+        try:
+            db.session.execute(Expense.__table__.insert(), [
+                {
+                    'id': expense['id'],
+                    'group_id': group_id,
+                    'payer_id': expense['payer_id'],
+                    'description': expense['description'],
+                    'amount': expense['amount'],
+                    'date': expense['date']
+                }
+                for expense in expenses
+            ])
+            if debt_rows:
+                db.session.execute(Debt.__table__.insert(), debt_rows)
+
+            BalanceService.apply_deltas(group_id, balance_deltas)
+            Group.adjust_counters(
+                group_id,
+                expenses_count=len(expenses),
+                total_expenses=chunk_total
+            )
+            DirtyTracker.mark_pairs(pairs, group_id=group_id)
+
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"[ERROR] Erro ao gravar bloco da importação: {str(e)}")
+            report['failed'] += len(expenses)
+            if len(report['errors']) < MAX_REPORTED_ERRORS:
+                report['errors'].append({'line': None, 'error': f'Bloco de {len(expenses)} despesas não gravado: {str(e)}'})
+            return
+
+        report['imported'] += len(expenses)
+        report['debts_created'] += len(debt_rows)
@@ -1,8 +1,16 @@
 from app import db
 from app.models.log import Log
 from app.models.debt import Debt
+from app.models.expense import Expense
 from app.models.user import User, GroupMember
 from collections import defaultdict
+import time
+
+# Passadas seguidas por um mesmo detentor do lease antes de liberá-lo
+MAX_PASSES_PER_LEASE = 20
+
+# Orçamento (segundos) do cancelamento de ciclos entre grupos em cada passada
+CYCLE_TIME_BUDGET = 1.0
 
 class LogService:
     @staticmethod
@@ -12,7 +20,7 @@ class LogService:
             type='payment',
             description=f"{debt.debtor.name} pagou R${debt.amount:.2f} para {debt.creditor.name}",
             user_id=debt.debtor_id,
-            group_id=debt.expense.group_id if debt.expense else None,
+            group_id=debt.group_id,
             amount=debt.amount
         )
         db.session.add(log)
@@ -24,15 +32,15 @@ class LogService:
             type='cancellation',
             description=f"Dívida de R${debt.amount:.2f} entre {debt.debtor.name} e {debt.creditor.name} foi cancelada",
             user_id=debt.debtor_id,
-            group_id=debt.expense.group_id if debt.expense else None,
+            group_id=debt.group_id,
             amount=debt.amount
         )
         db.session.add(log)
     
     @staticmethod
-    def create_optimization_log(debts_optimized, group_id=None):
+    def create_optimization_log(debts_optimized, group_id=None, amount=None):
         """Cria log de otimização de dívidas"""
-        total_amount = sum([debt.amount for debt in debts_optimized])
+        total_amount = amount if amount is not None else sum([debt.amount for debt in debts_optimized])
         log = Log(
             type='optimization',
             description=f"Otimização automática cancelou R${total_amount:.2f} em dívidas cruzadas",
@@ -42,77 +50,107 @@ class LogService:
         db.session.add(log)
     
     @staticmethod
-    def optimize_debts():
+    def optimize_debts(result=None):
         """
-        Otimiza dívidas encontrando ciclos e cancelando dívidas cruzadas
-        Exemplo: A deve B, B deve C, C deve A -> todos quitados se valores iguais
+        Roda a otimização com lock entre processos: só um detentor do lease executa por vez
+        e continua enquanto houver marcas na fila; chamadas concorrentes retornam 0 e o
+        que marcaram é processado pelo detentor. Se result (dict) for informado, recebe
+        deferred=True quando a fila ficou para o processo que detém o lease
         """
-        # Buscar todas as dívidas pendentes (excluindo vendidas)
-        pending_debts = Debt.get_pending_debts().all()
-        
-        # Agrupar por grupo para otimização local
-        debts_by_group = defaultdict(list)
-        for debt in pending_debts:
-            if debt.expense and debt.expense.group:
-                debts_by_group[debt.expense.group_id].append(debt)
+        from app.services.dirty_tracker import DirtyTracker
+        from app.services.optimization_lock import OptimizationLock
         
         optimized_count = 0
-        
-        # Otimizar dentro de cada grupo
-        for group_id, group_debts in debts_by_group.items():
-            optimized_count += LogService._optimize_group_debts(group_debts, group_id)
-        
-        # Otimizar entre grupos (dívidas cruzadas entre usuários)
-        optimized_count += LogService._optimize_cross_group_debts(pending_debts)
-        
-        if optimized_count > 0:
-            db.session.commit()
+        if result is not None:
+            result['deferred'] = False
+        
+        while DirtyTracker.has_pending():
+            token = OptimizationLock.acquire()
+            if not token:
+                # Outro processo está otimizando e vai consumir a fila
+                if result is not None:
+                    result['deferred'] = True
+                break
+            
+            try:
+                for _ in range(MAX_PASSES_PER_LEASE):
+                    optimized_count += LogService._optimize_pass(token)
+                    if not DirtyTracker.has_pending() or not OptimizationLock.renew(token):
+                        break
+            except Exception:
+                # Sessão em erro: desfaz antes de liberar o lease (senão o release também falha)
+                db.session.rollback()
+                raise
+            finally:
+                OptimizationLock.release(token)
+            # Marcas que chegaram entre a última leitura e a liberação são verificadas no while
         
         return optimized_count
     
     @staticmethod
-    def _optimize_group_debts(debts, group_id):
-        """Otimiza dívidas dentro de um grupo específico"""
-        # Criar matriz de dívidas entre usuários
-        debt_matrix = defaultdict(lambda: defaultdict(float))
+    def _optimize_pass(token=None):
+        """
+        Otimiza apenas o que mudou desde a última passada (fila optimization_dirty):
+        liquidação mínima nos grupos alterados, cancelamento de dívidas cruzadas
+        nos pares de usuários cujo saldo mudou e de ciclos que passam por esses usuários. Com token, renova o lease entre os grupos
+        e interrompe a passada (sem limpar a fila) se ele tiver sido perdido
+        """
+        from app.services.dirty_tracker import DirtyTracker
+        from app.services.optimization_lock import OptimizationLock, LEASE_TTL_SECONDS
         
-        for debt in debts:
-            debt_matrix[debt.debtor_id][debt.creditor_id] += debt.amount
+        last_id, group_ids, pairs = DirtyTracker.snapshot()
+        if not last_id:
+            return 0
         
-        optimized = []
+        optimized_count = 0
+        renewed_at = time.monotonic()
+        
+        # Otimizar dentro de cada grupo alterado (os pares envolvidos entram no passo seguinte)
+        for group_id in group_ids:
+            optimized_count += LogService._optimize_group_debts(group_id, pairs)
+            
+            if token and time.monotonic() - renewed_at > LEASE_TTL_SECONDS / 4:
+                if not OptimizationLock.renew(token):
+                    # Lease vencido e tomado por outro processo: ele refaz a fila inteira
+                    return optimized_count
+                renewed_at = time.monotonic()
+        
+        # Otimizar entre grupos (dívidas cruzadas), só para os pares alterados
+        pending_debts = LogService._pending_debts_for_pairs(pairs)
+        optimized_count += LogService._optimize_cross_group_debts(pending_debts)
         
-        # Encontrar e cancelar dívidas bidirecionais
-        users = list(debt_matrix.keys())
-        for i, user1 in enumerate(users):
-            for user2 in users[i+1:]:
-                debt1to2 = debt_matrix[user1][user2]
-                debt2to1 = debt_matrix[user2][user1]
-                
-                if debt1to2 > 0 and debt2to1 > 0:
-                    # Cancelar o menor valor
-                    min_debt = min(debt1to2, debt2to1)
-                    
-                    # Encontrar e cancelar as dívidas reais
-                    debts_to_cancel = []
-                    remaining = min_debt
-                    
-                    for debt in debts:
-                        if remaining <= 0:
-                            break
-                        if ((debt.debtor_id == user1 and debt.creditor_id == user2) or 
-                            (debt.debtor_id == user2 and debt.creditor_id == user1)):
-                            if debt.amount <= remaining:
-                                debts_to_cancel.append(debt)
-                                remaining -= debt.amount
-                    
-                    for debt in debts_to_cancel:
-                        debt.cancel()
-                        optimized.append(debt)
+        DirtyTracker.clear(last_id)
+        db.session.commit()
         
-        if optimized:
-            LogService.create_optimization_log(optimized, group_id)
+        # Ciclos entre grupos (A -> B -> C -> A) que passam pelos usuários alterados; comita
+        # sozinho e marca os pares que reduziu para a próxima passada
+        from app.services.settlement_service import SettlementService
+        user_ids = list(dict.fromkeys(user_id for pair in sorted(pairs) for user_id in pair))
+        optimized_count += SettlementService.cancel_cycles_around(user_ids, CYCLE_TIME_BUDGET)
         
-        return len(optimized)
+        return optimized_count
+    
+    @staticmethod
+    def _optimize_group_debts(group_id, touched_pairs=None):
+        """Otimiza dívidas dentro de um grupo específico (fluxo de caixa mínimo)"""
+        from app.services.settlement_service import SettlementService
+        
+        return SettlementService.settle_group(group_id, touched_pairs)
+    
+    @staticmethod
+    def _pending_debts_for_pairs(pairs, chunk_size=200):
+        """Dívidas pendentes entre os pares informados, nos dois sentidos"""
+        pairs = list(pairs)
+        debts = []
+        for start in range(0, len(pairs), chunk_size):
+            chunk = pairs[start:start + chunk_size]
+            oriented = chunk + [(user_b, user_a) for user_a, user_b in chunk]
+            # O IN em debtor_id deixa o planner usar (debtor_id, status); só a tupla vira full scan
+            debts.extend(Debt.get_pending_debts().filter(
+                Debt.debtor_id.in_({debtor_id for debtor_id, _ in oriented}),
+                db.tuple_(Debt.debtor_id, Debt.creditor_id).in_(oriented)
+            ).all())
+        return debts
     
     @staticmethod
     def _optimize_cross_group_debts(all_debts):
@@ -135,7 +173,7 @@ class LogService:
             if abs(net_debt) < 0.01:  # Praticamente zero
                 # Cancelar todas as dívidas entre esses usuários
                 for debt in debt_objects[(user1, user2)]:
-                    debt.cancel()
+                    debt.set_status('cancelled', track_dirty=False)  # commit único em optimize_debts
                     optimized.append(debt)
         
         if optimized:
@@ -0,0 +1,293 @@
+from app import db
+from app.models.marketplace_stats import MarketplaceStats, MarketplaceDailyStats
+from app.models.receivable import Receivable
+from flask import current_app
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, date, timedelta
+import threading
+
+# Linha única da tabela marketplace_stats
+STATS_ROW = 'global'
+
+# Lease (tabela optimization_leases) que evita reconciliações simultâneas entre processos
+RECONCILE_LEASE = 'marketplace_stats'
+
+# Colunas de valores dos rollups diários
+DAILY_COLUMNS = ('listed_count', 'listed_volume', 'listed_nominal', 'sold_count', 'sold_volume', 'sold_nominal')
+
+
+class MarketplaceStatsService:
+    """Agregados incrementais do marketplace (global e por dia) com reconciliação periódica"""
+
+    _executor = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def record_listed(receivable):
+        """Título colocado à venda (sem commit, na transação do anúncio)"""
+        MarketplaceStatsService._bump_global(
+            listed_discount=receivable.nominal_amount - receivable.selling_price,
+            titles_for_sale=1,
+            volume_for_sale=receivable.selling_price,
+            nominal_for_sale=receivable.nominal_amount
+        )
+        MarketplaceStatsService._bump_day(
+            (receivable.created_at or datetime.utcnow()).date(),
+            listed_count=1,
+            listed_volume=receivable.selling_price,
+            listed_nominal=receivable.nominal_amount
+        )
+
+    @staticmethod
+    def record_sold(receivable):
+        """Título vendido (sem commit, na transação da compra, depois da troca de status)"""
+        MarketplaceStatsService._bump_global(
+            removed_discount=receivable.nominal_amount - receivable.selling_price,
+            titles_for_sale=-1,
+            volume_for_sale=-receivable.selling_price,
+            nominal_for_sale=-receivable.nominal_amount,
+            titles_sold=1,
+            volume_sold=receivable.selling_price
+        )
+        MarketplaceStatsService._bump_day(
+            (receivable.sold_at or datetime.utcnow()).date(),
+            sold_count=1,
+            sold_volume=receivable.selling_price,
+            sold_nominal=receivable.nominal_amount
+        )
+
+    @staticmethod
+    def record_cancelled(receivable):
+        """Título retirado de venda (sem commit, na transação do cancelamento, depois da troca de status)"""
+        MarketplaceStatsService._bump_global(
+            removed_discount=receivable.nominal_amount - receivable.selling_price,
+            titles_for_sale=-1,
+            volume_for_sale=-receivable.selling_price,
+            nominal_for_sale=-receivable.nominal_amount
+        )
+
+    @staticmethod
+    def get_stats(days=30):
+        """Agregados atuais e rollups dos últimos `days` dias (consultas por chave, sem ler receivables)"""
+        stats = db.session.get(MarketplaceStats, STATS_ROW)
+        if stats is None:
+            stats = MarketplaceStatsService.reconcile()
+        else:
+            MarketplaceStatsService.schedule_reconcile_if_due(stats.reconciled_at)
+
+        daily = MarketplaceDailyStats.query.filter(
+            MarketplaceDailyStats.day >= datetime.utcnow().date() - timedelta(days=days - 1)  # Dias em UTC, como os buckets
+        ).order_by(MarketplaceDailyStats.day.desc()).all()
+
+        titles = stats.titles_for_sale
+        return {
+            'total_titles_for_sale': titles,
+            'total_volume': stats.volume_for_sale if titles else 0,
+            'max_discount_available': stats.max_discount,
+            'average_discount': (stats.nominal_for_sale - stats.volume_for_sale) / titles if titles else 0,
+            'total_titles_sold': stats.titles_sold,
+            'total_volume_sold': stats.volume_sold,
+            'daily': [day.to_dict() for day in daily],
+            'updated_at': stats.updated_at.isoformat() if stats.updated_at else None,
+            'reconciled_at': stats.reconciled_at.isoformat() if stats.reconciled_at else None
+        }
+
+    @staticmethod
+    def reconcile():
+        """Recalcula os agregados e os rollups diários a partir de receivables (com commit)
+
+        Trava a linha global antes de contar: todo record_* incrementa essa linha primeiro,
+        então nenhum incremento fica entre a contagem e a gravação dos valores absolutos.
+        """
+        receivables = Receivable.__table__
+        stats = MarketplaceStatsService._lock_stats_row()
+
+        for_sale = db.session.query(
+            db.func.count(Receivable.id),
+            db.func.coalesce(db.func.sum(Receivable.selling_price), 0.0),
+            db.func.coalesce(db.func.sum(Receivable.nominal_amount), 0.0)
+        ).filter(Receivable.status == 'for_sale').one()
+        sold = db.session.query(
+            db.func.count(Receivable.id),
+            db.func.coalesce(db.func.sum(Receivable.selling_price), 0.0)
+        ).filter(Receivable.status == 'sold').one()
+
+        now = datetime.utcnow()
+        values = {
+            'titles_for_sale': for_sale[0],
+            'volume_for_sale': for_sale[1],
+            'nominal_for_sale': for_sale[2],
+            'max_discount': db.session.execute(MarketplaceStatsService._max_discount_query()).scalar(),
+            'titles_sold': sold[0],
+            'volume_sold': sold[1],
+            'updated_at': now,
+            'reconciled_at': now
+        }
+        for key, value in values.items():
+            setattr(stats, key, value)
+
+        # Rollups: anunciados pelo dia de created_at (todos os status) e vendidos pelo dia de sold_at
+        days = {}
+        listed_day = db.func.date(receivables.c.created_at)
+        for day, count, volume, nominal in db.session.execute(
+            db.select(listed_day, db.func.count(), db.func.sum(receivables.c.selling_price),
+                      db.func.sum(receivables.c.nominal_amount))
+            .where(receivables.c.created_at.isnot(None))
+            .group_by(listed_day)
+        ):
+            days[MarketplaceStatsService._as_date(day)] = {
+                'listed_count': count, 'listed_volume': volume, 'listed_nominal': nominal
+            }
+        sold_day = db.func.date(receivables.c.sold_at)
+        for day, count, volume, nominal in db.session.execute(
+            db.select(sold_day, db.func.count(), db.func.sum(receivables.c.selling_price),
+                      db.func.sum(receivables.c.nominal_amount))
+            .where(receivables.c.status == 'sold', receivables.c.sold_at.isnot(None))
+            .group_by(sold_day)
+        ):
+            days.setdefault(MarketplaceStatsService._as_date(day), {}).update(
+                sold_count=count, sold_volume=volume, sold_nominal=nominal
+            )
+
+        # Upsert dos rollups: dias existentes recebem os valores recalculados (zero se não há
+        # mais títulos no dia) e dias novos são inseridos, sem apagar a tabela
+        daily = MarketplaceDailyStats.__table__
+        existing_days = set(db.session.execute(db.select(daily.c.day)).scalars())
+        totals_by_day = {
+            day: {column: days.get(day, {}).get(column, 0) for column in DAILY_COLUMNS}
+            for day in existing_days | set(days)
+        }
+        updates = [
+            # bindparam com prefixo: nomes iguais aos das colunas conflitam no executemany
+            {'stats_day': day, **{f'new_{column}': value for column, value in totals.items()}}
+            for day, totals in totals_by_day.items() if day in existing_days
+        ]
+        inserts = [{'day': day, **totals} for day, totals in totals_by_day.items() if day not in existing_days]
+        if updates:
+            db.session.execute(
+                daily.update()
+                .where(daily.c.day == db.bindparam('stats_day'))
+                .values({column: db.bindparam(f'new_{column}') for column in DAILY_COLUMNS}),
+                updates
+            )
+        if inserts:
+            db.session.execute(daily.insert(), inserts)
+
+        db.session.commit()
+        return stats
+
+    @staticmethod
+    def _lock_stats_row():
+        """Carrega a linha global com lock de escrita, criando-a se ainda não existir (sem commit)"""
+        query = db.session.query(MarketplaceStats).filter_by(name=STATS_ROW).with_for_update().populate_existing()
+        stats = query.one_or_none()
+        if stats is None:
+            # Banco antes da migração; outro processo pode criar a linha ao mesmo tempo
+            try:
+                with db.session.begin_nested():
+                    db.session.add(MarketplaceStats(name=STATS_ROW))
+            except IntegrityError:
+                pass
+            stats = query.one()
+
+        if db.session.get_bind().dialect.name == 'sqlite':
+            # SQLite ignora FOR UPDATE; uma escrita na linha toma o lock de escrita do banco
+            table = MarketplaceStats.__table__
+            db.session.execute(table.update().where(table.c.name == STATS_ROW).values(updated_at=datetime.utcnow()))
+        return stats
+
+    @classmethod
+    def schedule_reconcile_if_due(cls, stats_reconciled_at):
+        """Agenda a reconciliação em background se a última passou de MARKETPLACE_STATS_RECONCILE_SECONDS"""
+        interval = current_app.config.get('MARKETPLACE_STATS_RECONCILE_SECONDS', 0)
+        if interval <= 0:
+            return False
+        if stats_reconciled_at and datetime.utcnow() - stats_reconciled_at < timedelta(seconds=interval):
+            return False
+
+        app = current_app._get_current_object()
+        with cls._lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='marketplace-stats')
+            cls._executor.submit(cls._run_reconcile, app)
+        return True
+
+    @staticmethod
+    def _run_reconcile(app):
+        from app.services.optimization_lock import OptimizationLock
+
+        with app.app_context():
+            try:
+                OptimizationLock.ensure_lease(RECONCILE_LEASE)
+                db.session.commit()
+                token = OptimizationLock.acquire(RECONCILE_LEASE)
+                if not token:
+                    return
+                try:
+                    MarketplaceStatsService.reconcile()
+                finally:
+                    OptimizationLock.release(token, RECONCILE_LEASE)
+            except Exception as e:
+                db.session.rollback()
+                print(f"[ERROR] Erro na reconciliação das estatísticas do marketplace: {str(e)}")
+            finally:
+                db.session.remove()
+
+    @staticmethod
+    def _bump_global(listed_discount=None, removed_discount=None, **deltas):
+        """UPDATE atômico coluna = coluna + delta na linha única (sem commit)
+
+        listed_discount eleva max_discount se o título novo tiver desconto maior. removed_discount
+        (título vendido ou retirado) só recalcula o máximo, por busca no índice, quando o título
+        era o de maior desconto; nos demais casos o CASE não executa a subconsulta.
+        """
+        # Sem a linha (banco antes da migração) nada é atualizado; a primeira leitura reconcilia
+        table = MarketplaceStats.__table__
+        values = {key: table.c[key] + value for key, value in deltas.items()}
+        if listed_discount is not None:
+            values['max_discount'] = db.case(
+                (table.c.max_discount < listed_discount, listed_discount), else_=table.c.max_discount
+            )
+        if removed_discount is not None:
+            values['max_discount'] = db.case(
+                (table.c.max_discount <= removed_discount,
+                 MarketplaceStatsService._max_discount_query().scalar_subquery()),
+                else_=table.c.max_discount
+            )
+        db.session.execute(
+            table.update()
+            .where(table.c.name == STATS_ROW)
+            .values(updated_at=datetime.utcnow(), **values)
+        )
+
+    @staticmethod
+    def _max_discount_query():
+        """Maior desconto à venda: busca no índice (status, profit_estimated), não um MAX sobre a tabela"""
+        receivables = Receivable.__table__
+        top = db.select(receivables.c.profit_estimated).where(
+            receivables.c.status == 'for_sale'
+        ).order_by(receivables.c.profit_estimated.desc()).limit(1).scalar_subquery()
+        return db.select(db.func.coalesce(top, 0.0))
+
+    @staticmethod
+    def _bump_day(day, **deltas):
+        """Soma os deltas no rollup do dia, criando a linha se preciso (sem commit)"""
+        table = MarketplaceDailyStats.__table__
+        statement = table.update().where(table.c.day == day).values(
+            **{key: table.c[key] + value for key, value in deltas.items()}
+        )
+        if db.session.execute(statement).rowcount:
+            return
+
+        # Primeiro evento do dia; outro processo pode criar a linha ao mesmo tempo
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert(), [{'day': day, **deltas}])
+        except IntegrityError:
+            db.session.execute(statement)
+
+    @staticmethod
+    def _as_date(value):
+        # func.date devolve texto no SQLite e date no PostgreSQL
+        return value if isinstance(value, date) else date.fromisoformat(value)
@@ -0,0 +1,179 @@
+from app import db
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateTable
+
+def upgrade_schema():
+    """Cria tabelas novas em bancos já existentes (idempotente)"""
+    # Garantir que todos os modelos estejam registrados no metadata
+    import app.models  # noqa: F401
+    
+    db.create_all()
+    
+    # Colunas novas em tabelas existentes (create_all não altera tabelas)
+    added = _add_missing_columns('groups', ['members_count', 'expenses_count', 'total_expenses'])
+    if added:
+        _backfill_group_counters()
+    
+    if _add_missing_columns('receivables', ['profit_estimated']):
+        _backfill_receivable_profit()
+    
+    # Dívidas da liquidação não têm despesa: grupo na própria dívida e expense_id opcional
+    added = _add_missing_columns('debts', ['group_id'])
+    _drop_not_null('debts', 'expense_id')
+    if added:
+        _backfill_debt_groups()
+    
+    # Índices declarados nos modelos que ainda não existem (create_all só cria em tabelas novas)
+    _create_missing_indexes()
+    
+    # Saldos materializados dos grupos criados antes da tabela group_balances
+    _backfill_group_balances()
+    
+    # Linhas dos leases (evita corrida no primeiro acquire)
+    from app.services.optimization_lock import OptimizationLock
+    from app.services.marketplace_stats_service import MarketplaceStatsService, RECONCILE_LEASE, STATS_ROW
+    from app.services.dashboard_snapshot import DashboardSnapshot
+    OptimizationLock.ensure_lease()
+    OptimizationLock.ensure_lease(RECONCILE_LEASE)
+    DashboardSnapshot.ensure_version()
+    db.session.commit()
+    
+    # Estatísticas do marketplace: primeira carga a partir de receivables (e ao ganhar colunas)
+    from app.models.marketplace_stats import MarketplaceStats
+    added = _add_missing_columns('marketplace_stats', ['max_discount'])
+    if added or not db.session.get(MarketplaceStats, STATS_ROW):
+        MarketplaceStatsService.reconcile()
+
+
+def _add_missing_columns(table_name, column_names):
+    """ALTER TABLE ... ADD COLUMN para as colunas do modelo que ainda não existem no banco"""
+    table = db.metadata.tables[table_name]
+    existing = {column['name'] for column in inspect(db.engine).get_columns(table_name)}
+    
+    added = []
+    for name in column_names:
+        if name in existing:
+            continue
+        column = table.c[name]
+        ddl = f'ALTER TABLE {table_name} ADD COLUMN {name} {column.type.compile(dialect=db.engine.dialect)}'
+        if column.server_default is not None:
+            ddl += f" NOT NULL DEFAULT {column.server_default.arg}"
+        db.session.execute(db.text(ddl))
+        added.append(name)
+    
+    if added:
+        print(f"[MIGRATION] {table_name}: colunas adicionadas {', '.join(added)}")
+    return added
+
+
+def _drop_not_null(table_name, column_name):
+    """Torna a coluna opcional; no SQLite (sem ALTER COLUMN) recria a tabela a partir do modelo"""
+    connection = db.session.connection()
+    inspector = inspect(connection)
+    columns = inspector.get_columns(table_name)
+    if next(column for column in columns if column['name'] == column_name)['nullable']:
+        return False
+    
+    if db.engine.dialect.name != 'sqlite':
+        db.session.execute(db.text(f'ALTER TABLE {table_name} ALTER COLUMN {column_name} DROP NOT NULL'))
+    else:
+        # Procedimento recomendado pelo SQLite: nova tabela, cópia, remoção da antiga e rename
+        # (as chaves estrangeiras de outras tabelas continuam apontando para o nome original)
+        table = db.metadata.tables[table_name]
+        staging_name = f'{table_name}__new'
+        create_ddl = str(CreateTable(table).compile(dialect=connection.dialect)).replace(
+            f'CREATE TABLE {table_name} ', f'CREATE TABLE {staging_name} ', 1
+        )
+        names = ', '.join(column['name'] for column in columns)
+        connection.exec_driver_sql(create_ddl)
+        connection.exec_driver_sql(f'INSERT INTO {staging_name} ({names}) SELECT {names} FROM {table_name}')
+        connection.exec_driver_sql(f'DROP TABLE {table_name}')
+        connection.exec_driver_sql(f'ALTER TABLE {staging_name} RENAME TO {table_name}')
+        for index in table.indexes:
+            index.create(bind=connection)
+    
+    # As inspeções seguintes usam outra conexão e precisam ver a tabela nova
+    db.session.commit()
+    print(f"[MIGRATION] {table_name}.{column_name}: NOT NULL removido")
+    return True
+
+
+def _create_missing_indexes():
+    """CREATE INDEX para os índices do metadata ausentes no banco (parciais onde suportado)"""
+    inspector = inspect(db.engine)
+    connection = db.session.connection()
+    
+    created = []
+    for table in db.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=connection)
+                created.append(index.name)
+    
+    if created:
+        print(f"[MIGRATION] Índices criados: {', '.join(created)}")
+    return created
+
+
+def _backfill_group_balances():
+    """Materializa os saldos dos grupos com membros e sem linhas em group_balances"""
+    from app.models.user import GroupMember
+    from app.models.group_balance import GroupBalance
+    from app.services.balance_service import BalanceService
+    
+    missing = db.session.query(GroupMember.group_id).distinct().filter(
+        ~db.session.query(GroupBalance.id).filter(GroupBalance.group_id == GroupMember.group_id).exists()
+    ).all()
+    for (group_id,) in missing:
+        BalanceService.rebuild_group(group_id)
+    
+    if missing:
+        print(f"[MIGRATION] Saldos materializados para {len(missing)} grupos")
+
+
+def _backfill_debt_groups():
+    """Preenche o grupo das dívidas já existentes a partir da despesa"""
+    from app.models.debt import Debt
+    from app.models.expense import Expense
+    
+    debts = Debt.__table__
+    expenses = Expense.__table__
+    db.session.execute(
+        debts.update()
+        .where(debts.c.group_id.is_(None))
+        .values(group_id=db.select(expenses.c.group_id).where(expenses.c.id == debts.c.expense_id).scalar_subquery())
+    )
+
+
+def _backfill_group_counters():
+    """Preenche os contadores de grupos a partir das tabelas de membros e despesas"""
+    from app.models.group import Group
+    from app.models.expense import Expense
+    from app.models.user import GroupMember
+    
+    groups = Group.__table__
+    members = GroupMember.__table__
+    expenses = Expense.__table__
+    
+    db.session.execute(
+        groups.update().values(
+            updated_at=groups.c.updated_at,
+            members_count=db.select(db.func.count(members.c.id))
+                .where(members.c.group_id == groups.c.id).scalar_subquery(),
+            expenses_count=db.select(db.func.count(expenses.c.id))
+                .where(expenses.c.group_id == groups.c.id).scalar_subquery(),
+            total_expenses=db.select(db.func.coalesce(db.func.sum(expenses.c.amount), 0.0))
+                .where(expenses.c.group_id == groups.c.id).scalar_subquery()
+        )
+    )
+
+
+def _backfill_receivable_profit():
+    """Preenche profit_estimated dos títulos já existentes"""
+    from app.models.receivable import Receivable
+    
+    receivables = Receivable.__table__
+    db.session.execute(
+        receivables.update().values(profit_estimated=receivables.c.nominal_amount - receivables.c.selling_price)
+    )
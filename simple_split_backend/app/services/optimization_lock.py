@@ -0,0 +1,87 @@
+from app import db
+from app.models.optimization_lease import OptimizationLease
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+import os
+import socket
+import uuid
+
+# Nome do lease da otimização de dívidas
+OPTIMIZER_LEASE = 'debt_optimizer'
+
+# Validade do lease; quem detém renova a cada passada (processo morto libera sozinho)
+LEASE_TTL_SECONDS = 60
+
+
+class OptimizationLock:
+    """Lock distribuído via tabela optimization_leases (funciona em SQLite e PostgreSQL)"""
+
+    @staticmethod
+    def ensure_lease(name=OPTIMIZER_LEASE):
+        """Cria a linha do lease se ainda não existir (sem commit)"""
+        if not db.session.get(OptimizationLease, name):
+            db.session.add(OptimizationLease(name=name))
+            db.session.flush()
+
+    @staticmethod
+    def acquire(name=OPTIMIZER_LEASE, ttl=LEASE_TTL_SECONDS):
+        """Tenta tomar o lease; retorna o token do detentor ou None se outro processo já o tem"""
+        token = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        now = datetime.utcnow()
+        leases = OptimizationLease.__table__
+
+        with OptimizationLock._connection() as connection:
+            # UPDATE condicional: só um processo consegue trocar o detentor de um lease livre/vencido
+            acquired = connection.execute(
+                leases.update()
+                .where(
+                    leases.c.name == name,
+                    db.or_(leases.c.holder.is_(None), leases.c.expires_at < now)
+                )
+                .values(holder=token, expires_at=now + timedelta(seconds=ttl))
+            ).rowcount == 1
+            exists = acquired or connection.execute(
+                db.select(leases.c.name).where(leases.c.name == name)
+            ).first() is not None
+
+        if not exists:
+            # Banco sem a linha do lease (ex.: antes da migração): o primeiro a inserir leva
+            try:
+                with OptimizationLock._connection() as connection:
+                    connection.execute(
+                        leases.insert().values(name=name, holder=token, expires_at=now + timedelta(seconds=ttl))
+                    )
+                return token
+            except IntegrityError:
+                return None
+
+        return token if acquired else None
+
+    @staticmethod
+    def renew(token, name=OPTIMIZER_LEASE, ttl=LEASE_TTL_SECONDS):
+        """Estende o lease; retorna False se ele foi perdido (expirou e outro processo tomou)"""
+        leases = OptimizationLease.__table__
+        with OptimizationLock._connection() as connection:
+            return connection.execute(
+                leases.update()
+                .where(leases.c.name == name, leases.c.holder == token)
+                .values(expires_at=datetime.utcnow() + timedelta(seconds=ttl))
+            ).rowcount == 1
+
+    @staticmethod
+    def release(token, name=OPTIMIZER_LEASE):
+        leases = OptimizationLease.__table__
+        with OptimizationLock._connection() as connection:
+            connection.execute(
+                leases.update()
+                .where(leases.c.name == name, leases.c.holder == token)
+                .values(holder=None, expires_at=None)
+            )
+
+    @staticmethod
+    def _connection():
+        # Transação própria com commit imediato: o lease não leva junto (nem perde num rollback)
+        # o que estiver pendente na sessão de quem chamou. No SQLite (um escritor por vez) a
+        # sessão não pode ter escrita sem commit nesse momento: a otimização só toca no lease
+        # depois de comitar ou desfazer cada etapa
+        return db.engine.begin()
@@ -0,0 +1,107 @@
+from app import db
+from app.models.optimization_job import OptimizationJob
+from flask import current_app
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+import threading
+import uuid
+
+# Por quanto tempo jobs finalizados ficam disponíveis para consulta de status
+JOB_RETENTION = timedelta(days=1)
+
+
+class OptimizationWorker:
+    """Executa a otimização de dívidas fora do ciclo da requisição (thread pool in-process)
+
+    O status dos jobs fica na tabela optimization_jobs, então qualquer worker do gunicorn
+    (ou o mesmo depois de reiniciar) responde a consulta. As escritas de status usam uma
+    conexão própria e não mexem na transação da sessão de quem chamou.
+    """
+
+    _executor = None
+    _futures = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def enqueue(cls, group_id=None):
+        """Agenda uma passada de otimização e retorna o job (dict) criado"""
+        app = current_app._get_current_object()
+        job_id = str(uuid.uuid4())
+        cls._write(
+            OptimizationJob.__table__.insert().values(
+                id=job_id, group_id=group_id, status='queued', created_at=datetime.utcnow()
+            )
+        )
+
+        if not app.config.get('OPTIMIZATION_ASYNC', True):
+            # Modo síncrono (testes/scripts): roda na própria requisição
+            cls._run(app, job_id)
+            return cls.get_job(job_id)
+
+        job = cls.get_job(job_id)
+        future = cls._get_executor(app).submit(cls._run, app, job_id)
+        with cls._lock:
+            cls._futures[job_id] = future
+        return job
+
+    @classmethod
+    def get_job(cls, job_id):
+        job = db.session.get(OptimizationJob, job_id, populate_existing=True)
+        return job.to_dict() if job else None
+
+    @classmethod
+    def get_latest_job(cls, group_id):
+        job = OptimizationJob.query.filter_by(group_id=group_id).order_by(
+            OptimizationJob.created_at.desc()
+        ).populate_existing().first()
+        return job.to_dict() if job else None
+
+    @classmethod
+    def wait(cls, job_id=None, timeout=None):
+        """Aguarda um job (ou todos os pendentes) deste processo terminar; usado em testes"""
+        with cls._lock:
+            if job_id:
+                futures = [cls._futures[job_id]] if job_id in cls._futures else []
+            else:
+                futures = list(cls._futures.values())
+        done, not_done = wait(futures, timeout=timeout)
+        return not not_done
+
+    @classmethod
+    def _get_executor(cls, app):
+        with cls._lock:
+            if cls._executor is None:
+                # Um único worker serializa as passadas dentro do processo
+                cls._executor = ThreadPoolExecutor(
+                    max_workers=app.config.get('OPTIMIZATION_WORKERS', 1),
+                    thread_name_prefix='debt-optimizer'
+                )
+            return cls._executor
+
+    @classmethod
+    def _run(cls, app, job_id):
+        from app.services.log_service import LogService
+
+        jobs = OptimizationJob.__table__
+        with app.app_context():
+            cls._write(jobs.update().where(jobs.c.id == job_id).values(status='running', started_at=datetime.utcnow()))
+            values = {}
+            try:
+                values = {'status': 'done', 'optimized_count': LogService.optimize_debts()}
+            except Exception as e:
+                db.session.rollback()
+                print(f"[ERROR] Erro na otimização em background: {str(e)}")
+                values = {'status': 'failed', 'error': str(e)}
+            finally:
+                now = datetime.utcnow()
+                cls._write(jobs.update().where(jobs.c.id == job_id).values(finished_at=now, **values))
+                # Descartar jobs antigos já finalizados
+                cls._write(jobs.delete().where(jobs.c.finished_at < now - JOB_RETENTION))
+                with cls._lock:
+                    cls._futures.pop(job_id, None)
+
+    @staticmethod
+    def _write(statement):
+        # Conexão própria com commit imediato: o status fica visível para os outros workers
+        with db.engine.begin() as connection:
+            connection.execute(statement)
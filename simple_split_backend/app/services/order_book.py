@@ -0,0 +1,251 @@
+from app import db
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from datetime import datetime
+import bisect
+import threading
+import time
+
+# Ordenações disponíveis: chave da entrada usada como primeiro critério (desempate por id)
+ORDER_BOOK_SORTS = ('profit', 'discount')
+
+
+class OrderBook:
+    """Livro de ofertas em memória com os títulos à venda, ordenados por lucro e por desconto
+
+    Atualizado incrementalmente pelas rotas do marketplace (após o commit) e
+    reconstruído do banco na inicialização e quando passa de ORDER_BOOK_MAX_AGE
+    segundos, o que traz mudanças feitas por outros processos e scores de donos.
+    A compra continua validada no banco (UPDATE condicional), então uma oferta
+    desatualizada só resulta em 409.
+    """
+
+    _entries = {}
+    _keys = {sort: [] for sort in ORDER_BOOK_SORTS}
+    _version = 0
+    _snapshot = None
+    _database_uri = None
+    _built_at = None
+    _built_monotonic = None
+    _last_change_at = None
+    _rebuilds = 0
+    _incremental_updates = 0
+    _lock = threading.RLock()
+
+    @classmethod
+    def enabled(cls):
+        return current_app.config.get('ORDER_BOOK_MAX_AGE', 0) > 0
+
+    @classmethod
+    def rebuild(cls):
+        """Recarrega todas as ofertas à venda do banco em uma única consulta"""
+        from app.models.receivable import Receivable
+        from app.models.user import User
+
+        rows = db.session.query(
+            Receivable.id, Receivable.owner_id, Receivable.nominal_amount, Receivable.selling_price,
+            Receivable.status, Receivable.created_at, User.score
+        ).join(User, User.id == Receivable.owner_id).filter(Receivable.status == 'for_sale').all()
+
+        with cls._lock:
+            cls._entries = {}
+            cls._keys = {sort: [] for sort in ORDER_BOOK_SORTS}
+            for row in rows:
+                entry = cls._entry(*row)
+                cls._entries[entry['id']] = entry
+            for sort in ORDER_BOOK_SORTS:
+                cls._keys[sort] = sorted((entry[sort], entry['id']) for entry in cls._entries.values())
+
+            cls._database_uri = current_app.config['SQLALCHEMY_DATABASE_URI']
+            cls._built_at = datetime.utcnow()
+            cls._built_monotonic = time.monotonic()
+            cls._rebuilds += 1
+            cls._touch()
+        return len(rows)
+
+    @classmethod
+    def add(cls, receivable):
+        """Inclui (ou atualiza) uma oferta recém-comitada; ignorado se o livro ainda não existe"""
+        with cls._lock:
+            if not cls._is_current():
+                return
+            cls._discard(receivable.id)
+            if receivable.status != 'for_sale':
+                cls._touch()
+                return
+            entry = cls._entry(
+                receivable.id, receivable.owner_id, receivable.nominal_amount, receivable.selling_price,
+                receivable.status, receivable.created_at, receivable.owner.score if receivable.owner else 0.0
+            )
+            cls._entries[entry['id']] = entry
+            for sort in ORDER_BOOK_SORTS:
+                bisect.insort(cls._keys[sort], (entry[sort], entry['id']))
+            cls._incremental_updates += 1
+            cls._touch()
+
+    @classmethod
+    def remove(cls, receivable_id):
+        """Retira uma oferta vendida ou cancelada"""
+        with cls._lock:
+            if not cls._is_current():
+                return
+            cls._discard(receivable_id)
+            cls._incremental_updates += 1
+            cls._touch()
+
+    @classmethod
+    def update_owner_scores(cls, scores):
+        """Atualiza o score do dono nas ofertas ({user_id: score}, já comitado)"""
+        with cls._lock:
+            if not cls._is_current():
+                return
+            changed = False
+            for receivable_id, entry in list(cls._entries.items()):
+                score = scores.get(entry['owner_id'])
+                if score is not None and score != entry['owner_score']:
+                    # Entradas são imutáveis (compartilhadas com snapshots): troca por uma cópia
+                    cls._entries[receivable_id] = {
+                        **entry, 'owner_score': score, 'item': {**entry['item'], 'owner_score': score}
+                    }
+                    changed = True
+            if changed:
+                cls._incremental_updates += 1
+                cls._touch()
+
+    @classmethod
+    def snapshot(cls):
+        """Versão imutável do livro: {'version', 'keys': {sort: [...]}, 'entries': {...}}
+
+        A cópia só é refeita depois de uma mudança; leituras na mesma versão a compartilham.
+        """
+        with cls._lock:
+            if not cls._is_current() or cls.age_seconds() > current_app.config['ORDER_BOOK_MAX_AGE']:
+                cls.rebuild()
+            if cls._snapshot is None or cls._snapshot['version'] != cls._version:
+                cls._snapshot = {
+                    'version': cls._version,
+                    'keys': {sort: tuple(keys) for sort, keys in cls._keys.items()},
+                    'entries': dict(cls._entries)
+                }
+            return cls._snapshot
+
+    @classmethod
+    def read(cls, exclude_owner_id=None, filters=None, sort='profit', cursor_values=None, limit=None):
+        """Ofertas em ordem decrescente de `sort` que passam nos filtros
+
+        cursor_values: (valor, id) da última oferta da página anterior. Retorna
+        (entradas, valores do cursor da próxima página ou None, versão do snapshot).
+        """
+        snapshot = cls.snapshot()
+        keys = snapshot['keys'][sort]
+        entries = snapshot['entries']
+        filters = filters or {}
+
+        position = bisect.bisect_left(keys, tuple(cursor_values)) if cursor_values else len(keys)
+        page = []
+        for index in range(position - 1, -1, -1):
+            entry = entries[keys[index][1]]
+            if entry['owner_id'] == exclude_owner_id or not cls._matches(entry, filters):
+                continue
+            if limit is not None and len(page) == limit:
+                last = page[-1]
+                return page, (last[sort], last['id']), snapshot['version']
+            page.append(entry)
+        return page, None, snapshot['version']
+
+    @classmethod
+    def age_seconds(cls):
+        if cls._built_monotonic is None:
+            return None
+        return time.monotonic() - cls._built_monotonic
+
+    @classmethod
+    def status(cls):
+        """Dados de monitoramento: versão, tamanho e idade do livro"""
+        with cls._lock:
+            age = cls.age_seconds()
+            return {
+                'enabled': cls.enabled(),
+                'built': cls._is_current(),
+                'version': cls._version,
+                'size': len(cls._entries),
+                'built_at': cls._built_at.isoformat() if cls._built_at else None,
+                'age_seconds': round(age, 3) if age is not None else None,
+                'max_age_seconds': current_app.config.get('ORDER_BOOK_MAX_AGE', 0),
+                'last_change_at': cls._last_change_at.isoformat() if cls._last_change_at else None,
+                'rebuilds': cls._rebuilds,
+                'incremental_updates': cls._incremental_updates
+            }
+
+    @staticmethod
+    def _entry(receivable_id, owner_id, nominal_amount, selling_price, status, created_at, owner_score):
+        profit = nominal_amount - selling_price
+        return {
+            'id': receivable_id,
+            'owner_id': owner_id,
+            'profit': profit,
+            'discount': profit / nominal_amount if nominal_amount else 0.0,
+            'nominal_amount': nominal_amount,
+            'owner_score': owner_score or 0.0,
+            # Mesmo formato de Receivable.to_dict(anonymous=True)
+            'item': {
+                'id': receivable_id,
+                'nominal_amount': nominal_amount,
+                'selling_price': selling_price,
+                'profit_estimated': profit,
+                'owner_score': owner_score or 0.0,
+                'status': status,
+                'created_at': created_at.isoformat() if created_at else None
+            }
+        }
+
+    @staticmethod
+    def _matches(entry, filters):
+        return (
+            entry['profit'] >= filters.get('min_discount', float('-inf'))
+            and filters.get('min_score', float('-inf')) <= entry['owner_score'] <= filters.get('max_score', float('inf'))
+            and filters.get('min_nominal', float('-inf')) <= entry['nominal_amount'] <= filters.get('max_nominal', float('inf'))
+        )
+
+    @classmethod
+    def _is_current(cls):
+        # Livro construído para o banco do app atual (scripts podem criar vários apps)
+        return cls._built_at is not None and cls._database_uri == current_app.config['SQLALCHEMY_DATABASE_URI']
+
+    @classmethod
+    def _discard(cls, receivable_id):
+        entry = cls._entries.pop(receivable_id, None)
+        if entry is None:
+            return
+        for sort in ORDER_BOOK_SORTS:
+            keys = cls._keys[sort]
+            index = bisect.bisect_left(keys, (entry[sort], receivable_id))
+            if index < len(keys) and keys[index] == (entry[sort], receivable_id):
+                del keys[index]
+
+    @classmethod
+    def _touch(cls):
+        cls._version += 1
+        cls._last_change_at = datetime.utcnow()
+
+
+# Scores de usuários mudam fora do marketplace (pagamentos); aplicados no livro após o commit
+@event.listens_for(Session, 'after_flush')
+def _collect_score_changes(session, flush_context):
+    from app.models.user import User
+    for instance in session.dirty:
+        if isinstance(instance, User) and db.inspect(instance).attrs.score.history.has_changes():
+            session.info.setdefault('order_book_scores', {})[instance.id] = instance.score
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_score_changes(session):
+    scores = session.info.pop('order_book_scores', None)
+    if scores and has_app_context():
+        OrderBook.update_owner_scores(scores)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_score_changes(session):
+    session.info.pop('order_book_scores', None)
@@ -0,0 +1,76 @@
+from app import db
+from datetime import date, datetime
+import base64
+import json
+
+# Tamanho de página padrão e máximo aceito em ?limit=
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class PaginationService:
+    """Paginação por cursor (keyset) em ordem decrescente das colunas de ordenação"""
+
+    @staticmethod
+    def parse_limit(value):
+        """Lê ?limit= limitando entre 1 e MAX_PAGE_SIZE (ValueError se não for número)"""
+        if value in (None, ''):
+            return DEFAULT_PAGE_SIZE
+        return min(max(int(value), 1), MAX_PAGE_SIZE)
+
+    @staticmethod
+    def encode_cursor(values):
+        raw = json.dumps([value.isoformat() if isinstance(value, (date, datetime)) else value for value in values])
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor, columns):
+        """Converte o cursor de volta para os tipos das colunas (ValueError se inválido)"""
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        except (ValueError, TypeError):
+            raise ValueError('Cursor inválido')
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError('Cursor inválido')
+
+        decoded = []
+        try:
+            for column, value in zip(columns, values):
+                python_type = column.type.python_type
+                if value is not None and python_type is datetime:
+                    value = datetime.fromisoformat(value)
+                elif value is not None and python_type is date:
+                    value = date.fromisoformat(value)
+                elif value is not None and not isinstance(value, (int, float) if python_type is float else python_type):
+                    raise TypeError(f'{column.key} deveria ser {python_type.__name__}')
+                decoded.append(value)
+        except (ValueError, TypeError):
+            # Cursor bem formado mas com valor do tipo errado (ex.: número no lugar de data)
+            raise ValueError('Cursor inválido')
+        return decoded
+
+    @staticmethod
+    def paginate(query, columns, cursor=None, limit=DEFAULT_PAGE_SIZE, sort_key=None):
+        """Aplica ORDER BY colunas DESC + condição do cursor; retorna (linhas, próximo cursor)
+
+        A última coluna deve ser única (ex.: id) para desempatar. As colunas são
+        comparadas como tupla: (a < ca) OR (a = ca AND b < cb) ... sort_key(linha) devolve
+        os valores de ordenação da linha (padrão: atributos com o nome das colunas).
+        """
+        if cursor:
+            values = PaginationService.decode_cursor(cursor, columns)
+            conditions = []
+            for position, (column, value) in enumerate(zip(columns, values)):
+                equal_prefix = [columns[i] == values[i] for i in range(position)]
+                conditions.append(db.and_(*equal_prefix, column < value))
+            query = query.filter(db.or_(*conditions))
+
+        rows = query.order_by(*[column.desc() for column in columns]).limit(limit + 1).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            values = sort_key(last) if sort_key else [getattr(last, column.key) for column in columns]
+            next_cursor = PaginationService.encode_cursor(values)
+        return rows, next_cursor
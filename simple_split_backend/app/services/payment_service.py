@@ -0,0 +1,134 @@
+from app import db
+from app.models.user import User
+from app.models.debt import Debt
+from app.models.wallet import Wallet
+from app.models.log import Log
+from collections import defaultdict
+from datetime import datetime
+
+# Limite de parâmetros por UPDATE ... IN (...) (SQLite antigo aceita até 999)
+ID_CHUNK_SIZE = 900
+
+
+class PaymentError(Exception):
+    """Falha de validação do pagamento em lote (mensagem e status HTTP)"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class PaymentService:
+    """Pagamento de várias dívidas via carteira em uma única transação"""
+
+    @staticmethod
+    def find_debts_to_settle(user_id, debt_ids=None, creditor_id=None):
+        """Dívidas pendentes do usuário por lista de ids ou por credor (PaymentError se inválidas)"""
+        query = Debt.query.filter(Debt.debtor_id == user_id, Debt.status == 'pending')
+
+        if debt_ids is not None:
+            debt_ids = list(dict.fromkeys(debt_ids))
+            debts = []
+            for start in range(0, len(debt_ids), ID_CHUNK_SIZE):
+                debts.extend(query.filter(Debt.id.in_(debt_ids[start:start + ID_CHUNK_SIZE])).all())
+            missing = set(debt_ids) - {debt.id for debt in debts}
+            if missing:
+                raise PaymentError(f'Dívidas não encontradas, já pagas ou de outro devedor: {", ".join(sorted(missing))}')
+            return debts
+
+        return query.filter(Debt.creditor_id == creditor_id).all()
+
+    @staticmethod
+    def settle_debts(user_id, debts):
+        """Paga as dívidas: um débito, um crédito por credor, status em lote, um score e um log
+
+        Não faz commit; quem chama decide (commit ou rollback).
+        """
+        from app.services.balance_service import BalanceService
+        from app.services.dirty_tracker import DirtyTracker
+
+        if not debts:
+            raise PaymentError('Nenhuma dívida pendente para pagar')
+
+        total = sum(debt.amount for debt in debts)
+        total_by_creditor = defaultdict(float)
+        for debt in debts:
+            total_by_creditor[debt.creditor_id] += debt.amount
+
+        wallets = {
+            wallet.user_id: wallet
+            for wallet in Wallet.query.filter(Wallet.user_id.in_([user_id, *total_by_creditor])).all()
+        }
+        payer_wallet = wallets.get(user_id)
+        if not payer_wallet or payer_wallet.balance < total:
+            raise PaymentError('Saldo insuficiente na carteira')
+        missing_wallets = [creditor_id for creditor_id in total_by_creditor if creditor_id not in wallets]
+        if missing_wallets:
+            raise PaymentError('Carteira do credor não encontrada', 404)
+
+        users = {user.id: user for user in User.query.filter(User.id.in_([user_id, *total_by_creditor])).all()}
+        payer = users[user_id]
+
+        # Status em lote; só conta o que ainda estava pendente (outra requisição pode ter pago)
+        now = datetime.utcnow()
+        debt_ids = [debt.id for debt in debts]
+        debts_table = Debt.__table__
+        updated = 0
+        for start in range(0, len(debt_ids), ID_CHUNK_SIZE):
+            updated += db.session.execute(
+                debts_table.update()
+                .where(debts_table.c.id.in_(debt_ids[start:start + ID_CHUNK_SIZE]), debts_table.c.status == 'pending')
+                .values(status='paid', paid_at=now)
+            ).rowcount
+        if updated != len(debts):
+            raise PaymentError('Algumas dívidas mudaram durante o pagamento, tente novamente', 409)
+
+        # Saldos materializados e fila de otimização
+        BalanceService.debts_paid(debts)
+        pairs_by_group = defaultdict(set)
+        for debt in debts:
+            pairs_by_group[debt.group_id].add((debt.debtor_id, debt.creditor_id))
+        for group_id, pairs in pairs_by_group.items():
+            DirtyTracker.mark_pairs(pairs, group_id=group_id)
+
+        # Carteiras: um débito para quem paga e um crédito por credor
+        if not payer_wallet.withdraw_funds(
+            total,
+            f'Pagamento de {len(debts)} dívidas - R${total:.2f}',
+            auto_commit=False
+        ):
+            raise PaymentError('Saldo insuficiente na carteira')
+        for creditor_id, amount in total_by_creditor.items():
+            wallets[creditor_id].add_funds(
+                amount,
+                f'Recebimento de {payer.name} - R${amount:.2f}',
+                auto_commit=False
+            )
+
+        payer.update_score(payment_on_time=True, auto_commit=False)
+
+        creditor_names = ', '.join(users[creditor_id].name for creditor_id in total_by_creditor if creditor_id in users)
+        db.session.add(Log(
+            type='payment',
+            description=f'{payer.name} pagou R${total:.2f} em {len(debts)} dívidas via carteira para {creditor_names}',
+            user_id=user_id,
+            group_id=next(iter(pairs_by_group)) if len(pairs_by_group) == 1 else None,
+            amount=total
+        ))
+
+        return {
+            'debts_paid': len(debts),
+            'total_paid': total,
+            'new_balance': payer_wallet.balance,
+            'creditors': [
+                {
+                    'creditor_id': creditor_id,
+                    'creditor_name': users[creditor_id].name if creditor_id in users else None,
+                    'amount': amount
+                }
+                for creditor_id, amount in total_by_creditor.items()
+            ],
+            'debt_ids': debt_ids,
+            'group_ids': [group_id for group_id in pairs_by_group if group_id]
+        }
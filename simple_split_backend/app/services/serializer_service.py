@@ -0,0 +1,144 @@
+from app.models.user import User
+from app.models.wallet import Wallet
+from app.models.expense import Expense
+from app.models.group import Group
+from app.models.debt import Debt
+from sqlalchemy.orm.attributes import set_committed_value
+from collections import defaultdict
+
+# Limite de parâmetros por SELECT ... IN (...) (SQLite antigo aceita até 999)
+ID_CHUNK_SIZE = 900
+
+
+class SerializerService:
+    """Serialização em lote: pré-carrega relacionamentos com poucos IN e reaproveita os to_dict
+
+    Os objetos carregados são ligados aos relacionamentos de cada instância (debtor, creditor,
+    payer, owner, expense...) como valores já carregados, então o to_dict não faz consultas
+    e a própria instância mantém os relacionados vivos durante a serialização.
+    """
+
+    @staticmethod
+    def users_to_dict(users):
+        SerializerService._load_wallets(users)
+        return [user.to_dict() for user in users]
+
+    @staticmethod
+    def debts_to_dict(debts):
+        SerializerService.prefetch_debts(debts)
+        return [debt.to_dict() for debt in debts]
+
+    @staticmethod
+    def expenses_to_dict(expenses):
+        SerializerService.prefetch_expenses(expenses)
+        return [expense.to_dict() for expense in expenses]
+
+    @staticmethod
+    def groups_to_dict(groups):
+        SerializerService.prefetch_groups(groups)
+        return [group.to_dict() for group in groups]
+
+    @staticmethod
+    def receivables_to_dict(receivables, anonymous=False):
+        SerializerService.prefetch_receivables(receivables, anonymous)
+        return [receivable.to_dict(anonymous=anonymous) for receivable in receivables]
+
+    @staticmethod
+    def prefetch_debts(debts):
+        """Usuários e despesas das dívidas"""
+        SerializerService._load_references(debts, User, debtor='debtor_id', creditor='creditor_id')
+        SerializerService._load_references(debts, Expense, expense='expense_id')
+
+    @staticmethod
+    def prefetch_expenses(expenses):
+        """Grupos, pagadores, dívidas de cada despesa e usuários dessas dívidas"""
+        debts = SerializerService._load_collection(expenses, 'debts', Debt, Debt.expense_id)
+        SerializerService._load_references(expenses, Group, group='group_id')
+        SerializerService._load_references(expenses, User, payer='payer_id')
+        SerializerService._load_references(debts, User, debtor='debtor_id', creditor='creditor_id')
+
+    @staticmethod
+    def prefetch_groups(groups):
+        """Criadores dos grupos (contagens e total vêm das colunas de Group)"""
+        SerializerService._load_references(groups, User, creator='created_by')
+
+    @staticmethod
+    def prefetch_receivables(receivables, anonymous):
+        """Dono, comprador, dívida e devedor (individual ou consolidado) de cada título
+
+        A visão anônima só usa o dono; donos já carregados na consulta não são buscados de novo.
+        """
+        if anonymous:
+            SerializerService._load_references(receivables, User, owner='owner_id')
+            return
+
+        debts = SerializerService._load_references(receivables, Debt, debt='debt_id')
+        SerializerService._load_references(
+            receivables, User, owner='owner_id', buyer='buyer_id', consolidated_debtor='consolidated_group_id'
+        )
+        SerializerService._load_references(debts, User, debtor='debtor_id')
+
+    @staticmethod
+    def _load_references(instances, model, **foreign_keys):
+        """Preenche relacionamentos muitos-para-um ({relacionamento: coluna}) com um único IN
+
+        Todos os relacionamentos informados apontam para `model`; os que já estavam carregados
+        são mantidos. Retorna os objetos relacionados de todas as instâncias.
+        """
+        pending = {
+            attribute: [instance for instance in instances if attribute not in instance.__dict__]
+            for attribute in foreign_keys
+        }
+        ids = {
+            getattr(instance, foreign_key)
+            for attribute, foreign_key in foreign_keys.items()
+            for instance in pending[attribute]
+        }
+        by_id = {row.id: row for row in SerializerService._load(model, model.id, ids)}
+
+        for attribute, foreign_key in foreign_keys.items():
+            for instance in pending[attribute]:
+                set_committed_value(instance, attribute, by_id.get(getattr(instance, foreign_key)))
+
+        related = {}
+        for instance in instances:
+            for attribute in foreign_keys:
+                target = instance.__dict__.get(attribute)
+                if target is not None:
+                    related[target.id] = target
+        return list(related.values())
+
+    @staticmethod
+    def _load_wallets(users):
+        """Preenche user.wallet (um-para-um) com um único IN"""
+        pending = [user for user in users if 'wallet' not in user.__dict__]
+        wallets = SerializerService._load(Wallet, Wallet.user_id, {user.id for user in pending})
+        by_user = {wallet.user_id: wallet for wallet in wallets}
+        for user in pending:
+            set_committed_value(user, 'wallet', by_user.get(user.id))
+        return wallets
+
+    @staticmethod
+    def _load_collection(parents, attribute, model, foreign_key):
+        """Preenche uma coleção um-para-muitos de vários pais com um único IN"""
+        pending = [parent for parent in parents if attribute not in parent.__dict__]
+        children = SerializerService._load(model, foreign_key, {parent.id for parent in pending})
+        by_parent = defaultdict(list)
+        for child in children:
+            by_parent[getattr(child, foreign_key.key)].append(child)
+        for parent in pending:
+            set_committed_value(parent, attribute, by_parent.get(parent.id, []))
+        # Coleções já carregadas antes continuam valendo
+        pending_ids = {parent.id for parent in pending}
+        for parent in parents:
+            if parent.id not in pending_ids:
+                children.extend(getattr(parent, attribute))
+        return children
+
+    @staticmethod
+    def _load(model, column, ids):
+        ids = [value for value in ids if value is not None]
+        rows = []
+        for start in range(0, len(ids), ID_CHUNK_SIZE):
+            rows.extend(model.query.filter(column.in_(ids[start:start + ID_CHUNK_SIZE])).all())
+        return rows
@@ -0,0 +1,506 @@
+from app import db
+from app.models.debt import Debt
+from collections import defaultdict
+from datetime import datetime
+import heapq
+import time
+
+# Valores abaixo disso são considerados zerados (centavos)
+SETTLEMENT_TOLERANCE = 0.01
+
+# Limite de parâmetros por UPDATE ... IN (...) (SQLite antigo aceita até 999)
+ID_CHUNK_SIZE = 900
+
+# Estratégias disponíveis na simulação
+STRATEGIES = ('min_cash_flow', 'pairwise')
+
+# Origens que entram na otimização (títulos comprados e pagamentos virtuais ficam fora)
+OPTIMIZABLE_SOURCES = ('group_debt', 'settlement')
+
+
+class SettlementService:
+    """Motor de liquidação: reduz as dívidas de um grupo ao menor conjunto de transferências"""
+
+    @staticmethod
+    def net_positions(debts):
+        """Saldo líquido por usuário a partir de (devedor, credor, valor): positivo = recebe"""
+        net = defaultdict(float)
+        for debtor_id, creditor_id, amount in debts:
+            net[creditor_id] += amount
+            net[debtor_id] -= amount
+        return net
+
+    @staticmethod
+    def plan_transfers(net_positions):
+        """Casamento guloso (heap) entre maiores devedores e maiores credores
+
+        Retorna uma lista de (devedor, credor, valor) com no máximo n-1 transferências.
+        """
+        creditors = []
+        debtors = []
+        for user_id, balance in net_positions.items():
+            if balance > SETTLEMENT_TOLERANCE:
+                creditors.append((-balance, user_id))
+            elif balance < -SETTLEMENT_TOLERANCE:
+                debtors.append((balance, user_id))
+        heapq.heapify(creditors)
+        heapq.heapify(debtors)
+
+        transfers = []
+        while creditors and debtors:
+            credit, creditor_id = heapq.heappop(creditors)
+            debit, debtor_id = heapq.heappop(debtors)
+            amount = min(-credit, -debit)
+            transfers.append((debtor_id, creditor_id, amount))
+
+            # Devolver ao heap o que sobrou de cada lado
+            if -credit - amount > SETTLEMENT_TOLERANCE:
+                heapq.heappush(creditors, (credit + amount, creditor_id))
+            if -debit - amount > SETTLEMENT_TOLERANCE:
+                heapq.heappush(debtors, (debit + amount, debtor_id))
+
+        return transfers
+
+    @staticmethod
+    def plan_pairwise(debts):
+        """Compensação par a par: uma transferência por par de usuários com saldo não zerado"""
+        pair_balance = defaultdict(float)
+        for debtor_id, creditor_id, amount in debts:
+            if debtor_id < creditor_id:
+                pair_balance[(debtor_id, creditor_id)] += amount
+            else:
+                pair_balance[(creditor_id, debtor_id)] -= amount
+
+        transfers = []
+        for (user_a, user_b), balance in pair_balance.items():
+            if balance > SETTLEMENT_TOLERANCE:
+                transfers.append((user_a, user_b, balance))
+            elif balance < -SETTLEMENT_TOLERANCE:
+                transfers.append((user_b, user_a, -balance))
+        return transfers
+
+    @staticmethod
+    def simulate_group(group_id, strategy='min_cash_flow'):
+        """Roda o otimizador em memória sobre as dívidas pendentes do grupo, sem gravar nada"""
+        if strategy not in STRATEGIES:
+            raise ValueError(f'Estratégia inválida: {strategy}')
+
+        pending = SettlementService.pending_group_debts(group_id)
+        started = time.perf_counter()
+
+        debts = [(debtor_id, creditor_id, amount) for _, debtor_id, creditor_id, amount in pending]
+        if strategy == 'pairwise':
+            transfers = SettlementService.plan_pairwise(debts)
+        else:
+            transfers = SettlementService.plan_transfers(SettlementService.net_positions(debts))
+
+        compute_ms = (time.perf_counter() - started) * 1000
+
+        # Mesma regra do settle_group: só vale reescrever se o plano for menor
+        would_apply = len(pending) >= 2 and len(transfers) < len(pending)
+
+        return {
+            'strategy': strategy,
+            'debts_before': len(pending),
+            'transfers': transfers,
+            'debts_removed': len(pending) - len(transfers) if would_apply else 0,
+            'would_apply': would_apply,
+            'amount_before': round(sum(amount for _, _, amount in debts), 2),
+            'amount_after': round(sum(amount for _, _, amount in transfers), 2),
+            'compute_ms': round(compute_ms, 3)
+        }
+
+    @staticmethod
+    def pending_group_debts(group_id):
+        """Dívidas pendentes do grupo (despesas e liquidações anteriores, sem títulos comprados)"""
+        debts = Debt.__table__
+        return db.session.execute(
+            db.select(debts.c.id, debts.c.debtor_id, debts.c.creditor_id, debts.c.amount)
+            .where(
+                debts.c.group_id == group_id,
+                debts.c.status == 'pending',
+                db.or_(debts.c.source.in_(OPTIMIZABLE_SOURCES), debts.c.source.is_(None))
+            )
+            .order_by(debts.c.created_at)
+        ).all()
+
+    @staticmethod
+    def settle_group(group_id, touched_pairs=None):
+        """Reescreve as dívidas pendentes do grupo com o plano mínimo em uma única transação
+
+        Retorna quantas dívidas deixaram de existir. Se touched_pairs (set) for informado,
+        recebe os pares de usuários envolvidos antes e depois da liquidação.
+        """
+        from app.services.log_service import LogService
+
+        pending = SettlementService.pending_group_debts(group_id)
+        if touched_pairs is not None:
+            touched_pairs.update(tuple(sorted((debtor_id, creditor_id))) for _, debtor_id, creditor_id, _ in pending)
+        if len(pending) < 2:
+            return 0
+
+        net = SettlementService.net_positions(
+            (debtor_id, creditor_id, amount) for _, debtor_id, creditor_id, amount in pending
+        )
+        transfers = SettlementService.plan_transfers(net)
+
+        if len(transfers) >= len(pending):
+            return 0  # Já está no mínimo, nada a reescrever
+
+        if touched_pairs is not None:
+            touched_pairs.update(tuple(sorted((debtor_id, creditor_id))) for debtor_id, creditor_id, _ in transfers)
+
+        # Cancelar as dívidas atuais
+        debts = Debt.__table__
+        debt_ids = [debt_id for debt_id, _, _, _ in pending]
+        cancelled = 0
+        for start in range(0, len(debt_ids), ID_CHUNK_SIZE):
+            cancelled += db.session.execute(
+                debts.update()
+                .where(debts.c.id.in_(debt_ids[start:start + ID_CHUNK_SIZE]), debts.c.status == 'pending')
+                .values(status='cancelled')
+            ).rowcount
+        
+        if cancelled != len(pending):
+            # Alguma dívida foi paga durante o cálculo: o plano a recriaria como pendente
+            # (pagamento em dobro). Descarta; quem pagou marcou o grupo para a próxima passada
+            db.session.rollback()
+            print(f"[DEBUG] Grupo {group_id}: dívidas mudaram durante a liquidação, plano descartado")
+            return 0
+
+        # Criar as transferências do plano: pertencem ao grupo, não a uma despesa
+        if transfers:
+            db.session.execute(Debt.__table__.insert(), [
+                {
+                    'expense_id': None,
+                    'group_id': group_id,
+                    'debtor_id': debtor_id,
+                    'creditor_id': creditor_id,
+                    'amount': amount,
+                    'status': 'pending',
+                    'source': 'settlement'
+                }
+                for debtor_id, creditor_id, amount in transfers
+            ])
+
+        cancelled_total = sum(amount for _, _, _, amount in pending)
+        transferred_total = sum(amount for _, _, amount in transfers)
+        LogService.create_optimization_log(pending, group_id, amount=cancelled_total - transferred_total)
+
+        db.session.commit()
+
+        return len(pending) - len(transfers)
+
+    @staticmethod
+    def cancel_cycles(user_id, time_budget=2.0):
+        """Cancela ciclos de dívidas pendentes de grupo que passam pelo usuário (entre grupos)
+
+        Só mexe na componente fortemente conexa do grafo devedor -> credor que contém
+        user_id (os ciclos que envolvem o usuário e quem está nesses ciclos). Dentro dela,
+        desconta o menor valor de cada ciclo encontrado até o orçamento de tempo (segundos)
+        acabar; o que foi encontrado é aplicado em uma única transação. Roda com o lease da
+        otimização; retorna None se outro processo estiver otimizando.
+        """
+        from app.services.optimization_lock import OptimizationLock
+
+        token = OptimizationLock.acquire()
+        if not token:
+            return None
+        try:
+            return SettlementService._cancel_cycles(user_id, time.perf_counter() + time_budget)
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            OptimizationLock.release(token)
+
+    @staticmethod
+    def cancel_cycles_around(user_ids, time_budget):
+        """Cancela ciclos que passam pelos usuários informados (passada da otimização, lease já tomado)
+
+        Um orçamento de tempo para todos; usuários de uma componente já processada são pulados.
+        Retorna quantas dívidas foram canceladas.
+        """
+        deadline = time.perf_counter() + time_budget
+        visited = set()
+        cancelled = 0
+        for user_id in user_ids:
+            if user_id in visited:
+                continue
+            if time.perf_counter() > deadline:
+                break
+            cancelled += SettlementService._cancel_cycles(user_id, deadline, visited)['debts_cancelled']
+        return cancelled
+
+    @staticmethod
+    def _cancel_cycles(user_id, deadline, visited=None):
+        from app.services.log_service import LogService
+        from app.services.dirty_tracker import DirtyTracker
+
+        started = time.perf_counter()
+        debts = Debt.__table__
+        report = {
+            'debts_before': 0, 'edges_before': 0, 'edges_after': 0, 'cycles_cancelled': 0,
+            'debts_cancelled': 0, 'debts_reduced': 0, 'amount_cancelled': 0.0, 'completed': False,
+            'elapsed_ms': None
+        }
+
+        # Só a componente do usuário, carregada por busca no banco dentro do orçamento
+        loaded = SettlementService._load_component(user_id, deadline)
+        if loaded is None:
+            report['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            return report
+        members, pending = loaded
+        if visited is not None:
+            visited |= members
+
+        # Grafo agregado: peso de cada aresta devedor -> credor
+        graph = defaultdict(dict)
+        for _, debtor_id, creditor_id, amount in pending:
+            graph[debtor_id][creditor_id] = graph[debtor_id].get(creditor_id, 0.0) + amount
+        original = {(u, v): w for u, edges in graph.items() for v, w in edges.items()}
+
+        cycles_cancelled = 0
+        completed = True
+        while True:
+            components = [c for c in SettlementService._strongly_connected(graph) if len(c) > 1]
+            if not components:
+                break
+            found = 0
+            for component in components:
+                found += SettlementService._cancel_component_cycles(graph, component, deadline)
+                if time.perf_counter() > deadline:
+                    break
+            cycles_cancelled += found
+            if time.perf_counter() > deadline:
+                completed = False
+                break
+            if not found:
+                break
+
+        # Quanto cada aresta foi reduzida
+        reductions = {}
+        for edge, weight in original.items():
+            remaining = graph.get(edge[0], {}).get(edge[1], 0.0)
+            if weight - remaining > SETTLEMENT_TOLERANCE / 100:
+                reductions[edge] = weight - remaining
+
+        # Aplicar as reduções nas dívidas reais: cancela inteiras e reduz no máximo uma por aresta
+        to_cancel = []
+        to_reduce = []
+        for debt_id, debtor_id, creditor_id, amount in pending:
+            edge = (debtor_id, creditor_id)
+            reduction = reductions.get(edge)
+            if not reduction:
+                continue
+            if creditor_id not in graph.get(debtor_id, {}) or amount <= reduction + SETTLEMENT_TOLERANCE / 100:
+                to_cancel.append(debt_id)
+                reductions[edge] = max(0.0, reduction - amount)
+            else:
+                to_reduce.append({'debt_id': debt_id, 'new_amount': amount - reduction})
+                reductions[edge] = 0.0
+
+        updated = 0
+        for start in range(0, len(to_cancel), ID_CHUNK_SIZE):
+            updated += db.session.execute(
+                debts.update()
+                .where(debts.c.id.in_(to_cancel[start:start + ID_CHUNK_SIZE]), debts.c.status == 'pending')
+                .values(status='cancelled')
+            ).rowcount
+        if to_reduce:
+            result = db.session.execute(
+                debts.update()
+                .where(debts.c.id == db.bindparam('debt_id'), debts.c.status == 'pending')
+                .values(amount=db.bindparam('new_amount')),
+                to_reduce
+            )
+            updated += result.rowcount
+
+        amount_cancelled = sum(original.values()) - sum(w for edges in graph.values() for w in edges.values())
+        report.update({
+            'debts_before': len(pending),
+            'edges_before': len(original),
+            'edges_after': sum(len(edges) for edges in graph.values()),
+            'cycles_cancelled': cycles_cancelled,
+            'debts_cancelled': len(to_cancel),
+            'debts_reduced': len(to_reduce),
+            'amount_cancelled': round(amount_cancelled, 2),
+            'completed': completed
+        })
+
+        if updated != len(to_cancel) + len(to_reduce):
+            # Alguma dívida mudou durante o cálculo: descartar para não quebrar os saldos
+            db.session.rollback()
+            report.update({'edges_after': report['edges_before'], 'cycles_cancelled': 0, 'debts_cancelled': 0,
+                           'debts_reduced': 0, 'amount_cancelled': 0.0, 'completed': False})
+        elif cycles_cancelled:
+            # Pares alterados entram na fila da otimização incremental
+            DirtyTracker.mark_pairs(list(reductions))
+            LogService.create_optimization_log([], amount=amount_cancelled)
+            db.session.commit()
+
+        report['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return report
+
+    @staticmethod
+    def _load_component(user_id, deadline):
+        """Componente fortemente conexa do usuário no grafo de dívidas pendentes de grupo
+
+        Busca em largura no banco: quem o usuário alcança (devedor -> credor) e, entre esses,
+        quem alcança o usuário; a interseção é a componente. Retorna (membros, dívidas entre
+        eles) ou None se o orçamento acabar durante a carga.
+        """
+        debts = Debt.__table__
+        # Títulos comprados ficam fora, como no resto da otimização
+        optimizable = [
+            debts.c.status == 'pending',
+            db.or_(debts.c.source.in_(OPTIMIZABLE_SOURCES), debts.c.source.is_(None))
+        ]
+
+        def reachable(from_column, to_column, allowed=None):
+            seen = {user_id}
+            frontier = [user_id]
+            while frontier:
+                next_frontier = []
+                for start in range(0, len(frontier), ID_CHUNK_SIZE):
+                    if time.perf_counter() > deadline:
+                        return None
+                    for (node,) in db.session.execute(
+                        db.select(to_column).distinct()
+                        .where(*optimizable, from_column.in_(frontier[start:start + ID_CHUNK_SIZE]))
+                    ):
+                        if node not in seen and (allowed is None or node in allowed):
+                            seen.add(node)
+                            next_frontier.append(node)
+                frontier = next_frontier
+            return seen
+
+        forward = reachable(debts.c.debtor_id, debts.c.creditor_id)
+        if forward is None:
+            return None
+        members = reachable(debts.c.creditor_id, debts.c.debtor_id, allowed=forward)
+        if members is None:
+            return None
+        if len(members) < 2:
+            return members, []
+
+        member_ids = list(members)
+        pending = []
+        for start in range(0, len(member_ids), ID_CHUNK_SIZE):
+            if time.perf_counter() > deadline:
+                return None
+            pending.extend(
+                row for row in db.session.execute(
+                    db.select(debts.c.id, debts.c.debtor_id, debts.c.creditor_id, debts.c.amount, debts.c.created_at)
+                    .where(*optimizable, debts.c.debtor_id.in_(member_ids[start:start + ID_CHUNK_SIZE]))
+                )
+                if row.creditor_id in members
+            )
+        pending.sort(key=lambda row: row.created_at or datetime.min)
+        return members, [(row.id, row.debtor_id, row.creditor_id, row.amount) for row in pending]
+
+    @staticmethod
+    def _strongly_connected(graph):
+        """Componentes fortemente conexas (Tarjan iterativo)"""
+        index = {}
+        low = {}
+        on_stack = set()
+        stack = []
+        components = []
+        counter = 0
+
+        for root in list(graph):
+            if root in index:
+                continue
+            work = [(root, iter(list(graph.get(root, {}))))]
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                node, neighbors = work[-1]
+                advanced = False
+                for neighbor in neighbors:
+                    if neighbor not in index:
+                        index[neighbor] = low[neighbor] = counter
+                        counter += 1
+                        stack.append(neighbor)
+                        on_stack.add(neighbor)
+                        work.append((neighbor, iter(list(graph.get(neighbor, {})))))
+                        advanced = True
+                        break
+                    elif neighbor in on_stack:
+                        low[node] = min(low[node], index[neighbor])
+                if advanced:
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+
+        return components
+
+    @staticmethod
+    def _cancel_component_cycles(graph, component, deadline):
+        """Busca em profundidade dentro da componente descontando cada ciclo encontrado"""
+        members = set(component)
+        cycles = 0
+        state = {}  # 1 = no caminho atual, 2 = finalizado
+
+        for root in component:
+            if state.get(root):
+                continue
+            path = [root]
+            iterators = [iter(list(graph[root]))]
+            state[root] = 1
+            while path:
+                if time.perf_counter() > deadline:
+                    return cycles
+                node = path[-1]
+                next_node = None
+                for neighbor in iterators[-1]:
+                    if neighbor in members and neighbor in graph[node] and state.get(neighbor) != 2:
+                        next_node = neighbor
+                        break
+                if next_node is None:
+                    state[node] = 2
+                    path.pop()
+                    iterators.pop()
+                    continue
+                if state.get(next_node) != 1:
+                    state[next_node] = 1
+                    path.append(next_node)
+                    iterators.append(iter(list(graph[next_node])))
+                    continue
+
+                # Ciclo encontrado: path[start:] + aresta de volta para next_node
+                start = path.index(next_node)
+                cycle = path[start:] + [next_node]
+                edges = list(zip(cycle, cycle[1:]))
+                amount = min(graph[u][v] for u, v in edges)
+                first_removed = None
+                for position, (u, v) in enumerate(edges):
+                    graph[u][v] -= amount
+                    if graph[u][v] <= SETTLEMENT_TOLERANCE / 100:
+                        del graph[u][v]
+                        if first_removed is None:
+                            first_removed = position
+                cycles += 1
+
+                # Voltar até o nó cuja aresta do ciclo sumiu e continuar a busca dali
+                keep = start + first_removed + 1
+                for abandoned in path[keep:]:
+                    state.pop(abandoned, None)
+                del path[keep:]
+                del iterators[keep:]
+
+        return cycles
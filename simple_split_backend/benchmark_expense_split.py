@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Benchmark da criação de despesas: latência por despesa conforme o tamanho do grupo
+
+Cria grupos de 5 a 5.000 membros em um banco temporário e mede criar + dividir
+despesas (Expense + split_expense, um commit por despesa).
+
+Uso:
+    python benchmark_expense_split.py [--sizes 5,50,500,5000] [--expenses 20]
+"""
+
+import sys
+import os
+import time
+import uuid
+import argparse
+import statistics
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+if 'DATABASE_URL' not in os.environ:
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'benchmark_split.db')
+
+from app import create_app, db
+from app.models.user import User, GroupMember
+from app.models.group import Group
+from app.models.expense import Expense
+from app.models.debt import Debt
+from app.services.balance_service import BalanceService
+from app.services.migrations import upgrade_schema
+
+app = create_app()
+
+
+def create_group(size):
+    """Grupo com `size` membros (usuários inseridos em lote)"""
+    user_ids = [str(uuid.uuid4()) for _ in range(size)]
+    db.session.execute(User.__table__.insert(), [
+        {'id': user_id, 'name': f'Membro {i}', 'email': f'{user_id}@bench.local', 'password_hash': 'x'}
+        for i, user_id in enumerate(user_ids)
+    ])
+
+    group = Group(name=f'Benchmark {size}', created_by=user_ids[0])
+    db.session.add(group)
+    db.session.flush()
+
+    db.session.add_all([GroupMember(group_id=group.id, user_id=user_id) for user_id in user_ids])
+    db.session.flush()
+    BalanceService.rebuild_group(group.id)
+    db.session.commit()
+
+    return group.id, user_ids
+
+
+def run(sizes, expenses_per_size):
+    print(f"{'membros':>8} {'despesas':>9} {'mediana ms':>11} {'p95 ms':>8} {'ms/membro':>10}")
+    for size in sizes:
+        group_id, user_ids = create_group(size)
+
+        timings = []
+        for i in range(expenses_per_size):
+            started = time.perf_counter()
+            expense = Expense(
+                group_id=group_id,
+                payer_id=user_ids[i % size],
+                description=f'Despesa {i}',
+                amount=100.0 + i
+            )
+            db.session.add(expense)
+            expense.split_expense()
+            timings.append((time.perf_counter() - started) * 1000)
+
+        # Conferir que todas as dívidas foram criadas
+        debts = Debt.query.filter(Debt.group_id == group_id).count()
+        assert debts == expenses_per_size * (size - 1), debts
+
+        timings.sort()
+        median = statistics.median(timings)
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        print(f"{size:>8} {expenses_per_size:>9} {median:>11.2f} {p95:>8.2f} {median / size:>10.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='5,50,500,5000', help='tamanhos de grupo separados por vírgula')
+    parser.add_argument('--expenses', type=int, default=20, help='despesas por tamanho de grupo')
+    args = parser.parse_args()
+
+    with app.app_context():
+        upgrade_schema()
+        run([int(size) for size in args.sizes.split(',')], args.expenses)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Benchmark de compras concorrentes no marketplace
+
+Várias threads (um comprador cada) disputam os mesmos títulos pela rota
+POST /api/marketplace/buy/<id>. Mede compras por segundo e taxa de conflito
+(409: passou pela verificação de status mas perdeu o UPDATE condicional) e confere
+que cada título teve exatamente um vencedor, que cada venda gerou a dívida do
+comprador e que nenhum dinheiro sumiu ou apareceu nas carteiras.
+
+Uso:
+    python benchmark_marketplace.py [--threads 16] [--titles 200] [--hot 20]
+    DATABASE_URL=postgresql://... python benchmark_marketplace.py
+"""
+
+import sys
+import os
+import io
+import time
+import uuid
+import random
+import argparse
+import tempfile
+import threading
+import contextlib
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+if 'DATABASE_URL' not in os.environ:
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'benchmark_marketplace.db')
+
+from flask_jwt_extended import create_access_token
+from app import create_app, db
+from app.models.user import User, GroupMember
+from app.models.group import Group
+from app.models.expense import Expense
+from app.models.debt import Debt
+from app.models.receivable import Receivable
+from app.models.wallet import Wallet
+from app.services.migrations import upgrade_schema
+
+app = create_app()
+
+BUYER_FUNDS = 100000.0
+
+
+def create_scenario(buyers, titles):
+    """Um vendedor, um devedor e `titles` títulos individuais à venda"""
+    seller_id, debtor_id = str(uuid.uuid4()), str(uuid.uuid4())
+    buyer_ids = [str(uuid.uuid4()) for _ in range(buyers)]
+    user_ids = [seller_id, debtor_id, *buyer_ids]
+
+    db.session.execute(User.__table__.insert(), [
+        {'id': user_id, 'name': f'Usuário {i}', 'email': f'{user_id}@bench.local', 'password_hash': 'x'}
+        for i, user_id in enumerate(user_ids)
+    ])
+    db.session.execute(Wallet.__table__.insert(), [
+        {'id': str(uuid.uuid4()), 'user_id': user_id, 'balance': BUYER_FUNDS if user_id in buyer_ids else 0.0}
+        for user_id in user_ids
+    ])
+
+    group = Group(name='Benchmark marketplace', created_by=seller_id)
+    db.session.add(group)
+    db.session.flush()
+    db.session.execute(GroupMember.__table__.insert(), [
+        {'id': str(uuid.uuid4()), 'group_id': group.id, 'user_id': user_id} for user_id in (seller_id, debtor_id)
+    ])
+    expense = Expense(group_id=group.id, payer_id=seller_id, description='Base', amount=titles * 20.0)
+    db.session.add(expense)
+    db.session.flush()
+
+    debt_rows, receivable_rows = [], []
+    for i in range(titles):
+        debt_id = str(uuid.uuid4())
+        debt_rows.append({
+            'id': debt_id, 'expense_id': expense.id, 'group_id': group.id, 'debtor_id': debtor_id, 'creditor_id': seller_id,
+            'amount': 10.0 + i % 7, 'status': 'sold_as_title', 'source': 'group_debt'
+        })
+        receivable_rows.append({
+            'id': str(uuid.uuid4()), 'owner_id': seller_id, 'debt_id': debt_id,
+            'nominal_amount': 10.0 + i % 7, 'selling_price': 8.0 + i % 7, 'status': 'for_sale'
+        })
+    db.session.execute(Debt.__table__.insert(), debt_rows)
+    db.session.execute(Receivable.__table__.insert(), receivable_rows)
+    db.session.commit()
+
+    tokens = [create_access_token(identity=buyer_id) for buyer_id in buyer_ids]
+    return [row['id'] for row in receivable_rows], tokens
+
+
+def buyer(token, titles, hot, seed, stats, lock):
+    """Compra títulos aleatórios, sempre disputando os `hot` primeiros ainda à venda"""
+    rnd = random.Random(seed)
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}'}
+    counts = {'attempts': 0, 'purchases': 0, 'conflicts': 0, 'already_sold': 0, 'locked': 0, 'errors': 0}
+    remaining = list(titles)
+
+    while remaining:
+        receivable_id = rnd.choice(remaining[:hot])
+        response = client.post(f'/api/marketplace/buy/{receivable_id}', headers=headers)
+        counts['attempts'] += 1
+        if response.status_code == 200:
+            counts['purchases'] += 1
+        elif response.status_code == 409:
+            # Passou pela verificação de status mas perdeu o UPDATE condicional
+            counts['conflicts'] += 1
+        elif response.status_code == 400:
+            counts['already_sold'] += 1
+        elif 'database is locked' in (response.get_json() or {}).get('error', ''):
+            # SQLite: disputa pelo lock de escrita do arquivo; a compra foi revertida, tenta de novo
+            counts['locked'] += 1
+            continue
+        else:
+            counts['errors'] += 1
+            print(response.status_code, response.get_json(), file=sys.stderr)
+        # Vendido (por mim ou por outro) ou com erro: sai da lista de disputa
+        remaining.remove(receivable_id)
+
+    with lock:
+        for key, value in counts.items():
+            stats[key] += value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--titles', type=int, default=200)
+    parser.add_argument('--hot', type=int, default=20, help='títulos disputados ao mesmo tempo')
+    args = parser.parse_args()
+
+    with app.app_context():
+        upgrade_schema()
+        titles, tokens = create_scenario(args.threads, args.titles)
+        money_before = db.session.query(db.func.sum(Wallet.balance)).scalar()
+
+    stats = {'attempts': 0, 'purchases': 0, 'conflicts': 0, 'already_sold': 0, 'locked': 0, 'errors': 0}
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(target=buyer, args=(token, titles, args.hot, seed, stats, lock))
+        for seed, token in enumerate(tokens)
+    ]
+
+    # Silencia os prints de debug das rotas durante a disputa
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        sold = Receivable.query.filter(Receivable.id.in_(titles), Receivable.status == 'sold').count()
+        without_buyer = Receivable.query.filter(
+            Receivable.id.in_(titles), Receivable.status == 'sold', Receivable.buyer_id.is_(None)
+        ).count()
+        transferred = Debt.query.filter_by(source='purchased_title').count()
+        money_after = db.session.query(db.func.sum(Wallet.balance)).scalar()
+
+    conflict_rate = stats['conflicts'] / stats['attempts'] if stats['attempts'] else 0.0
+    print(f"{args.threads} compradores, {args.titles} títulos ({args.hot} em disputa): {elapsed:.2f}s")
+    print(f"tentativas {stats['attempts']}, compras {stats['purchases']} "
+          f"({stats['purchases'] / elapsed:.0f}/s), já vendidos {stats['already_sold']}, "
+          f"conflitos {stats['conflicts']} ({conflict_rate:.1%}), "
+          f"bloqueios do banco {stats['locked']}, erros {stats['errors']}")
+
+    ok = (
+        stats['purchases'] == sold == transferred == args.titles
+        and without_buyer == 0
+        and stats['errors'] == 0
+        and abs(money_before - money_after) < 0.005
+    )
+    print(f"vendidos {sold}, dívidas transferidas {transferred}, "
+          f"dinheiro antes R${money_before:.2f} / depois R${money_after:.2f}")
+    print('✅ exatamente um comprador por título' if ok else '❌ vendas inconsistentes')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Verifica se as consultas mais frequentes usam os índices declarados nos modelos (EXPLAIN)
+
+Uso:
+    python check_indexes.py                  # SQLite temporário
+    DATABASE_URL=postgresql://... python check_indexes.py
+"""
+
+import sys
+import os
+import re
+import uuid
+import random
+import tempfile
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+if 'DATABASE_URL' not in os.environ:
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'check_indexes.db')
+
+from app import create_app, db
+from app.models.debt import Debt
+from app.models.expense import Expense
+from app.models.receivable import Receivable
+from app.models.log import Log
+from app.models.wallet import Transaction
+from app.models.user import User, GroupMember
+from app.models.group import Group
+from app.services.migrations import upgrade_schema
+
+app = create_app()
+
+USER_A = '00000000-0000-0000-0000-00000000000a'
+USER_B = '00000000-0000-0000-0000-00000000000b'
+GROUP = '00000000-0000-0000-0000-0000000000aa'
+
+
+def hot_queries():
+    """(descrição, consulta, índices aceitos)
+
+    Aceitos são os índices compostos que começam por uma coluna filtrada com igualdade;
+    entre eles o planner escolhe pelo custo estimado e qualquer um evita o full scan.
+    """
+    return [
+        ('Dívidas pendentes do devedor',
+         Debt.query.filter_by(status='pending', debtor_id=USER_A),
+         {'ix_debts_debtor_status'}),
+        ('Dívidas pendentes do credor',
+         Debt.query.filter_by(status='pending', creditor_id=USER_A),
+         {'ix_debts_creditor_status'}),
+        ('Dívidas pagas do devedor para um credor',
+         Debt.query.filter_by(status='paid', debtor_id=USER_A, creditor_id=USER_B),
+         {'ix_debts_debtor_status', 'ix_debts_creditor_status'}),
+        ('Dívidas pendentes entre um par',
+         Debt.query.filter(Debt.status == 'pending', Debt.debtor_id == USER_A, Debt.creditor_id == USER_B),
+         {'ix_debts_debtor_status', 'ix_debts_creditor_status'}),
+        ('Dívidas pendentes de vários pares (otimização incremental)',
+         Debt.query.filter(
+             Debt.status == 'pending',
+             Debt.debtor_id.in_([USER_A, USER_B]),
+             db.tuple_(Debt.debtor_id, Debt.creditor_id).in_([(USER_A, USER_B), (USER_B, USER_A)])
+         ),
+         {'ix_debts_debtor_status', 'ix_debts_creditor_status'}),
+        ('Pagamentos virtuais entre membros',
+         Debt.query.filter(
+             Debt.source == 'virtual_payment',
+             Debt.status == 'paid',
+             Debt.debtor_id.in_([USER_A, USER_B]),
+             Debt.creditor_id.in_([USER_A, USER_B])
+         ),
+         {'ix_debts_debtor_status', 'ix_debts_creditor_status'}),
+        ('Dívidas pendentes de um grupo',
+         Debt.query.filter(Debt.group_id == GROUP, Debt.status == 'pending'),
+         {'ix_debts_group_status'}),
+        ('Despesas do grupo por data',
+         Expense.query.filter(Expense.group_id == GROUP).order_by(Expense.date.desc()),
+         {'ix_expenses_group_date'}),
+        ('Despesas pagas pelo usuário no mês',
+         Expense.query.filter(Expense.payer_id == USER_A, Expense.date >= '2025-01-01'),
+         {'ix_expenses_payer_date'}),
+        ('Títulos à venda do dono',
+         Receivable.query.filter_by(owner_id=USER_A, status='for_sale'),
+         {'ix_receivables_status_owner'}),
+        ('Títulos comprados',
+         Receivable.query.filter_by(buyer_id=USER_A, status='sold'),
+         {'ix_receivables_buyer_status'}),
+        ('Títulos consolidados de um devedor',
+         Receivable.query.filter_by(consolidated_group_id=USER_A, status='for_sale'),
+         {'ix_receivables_consolidated_status'}),
+        ('Marketplace por lucro estimado',
+         Receivable.query.filter(Receivable.status == 'for_sale', Receivable.owner_id != USER_A)
+         .order_by(Receivable.profit_estimated.desc(), Receivable.id.desc()),
+         {'ix_receivables_status_profit'}),
+        ('Maior desconto à venda (estatísticas do marketplace)',
+         db.session.query(Receivable.profit_estimated).filter(Receivable.status == 'for_sale')
+         .order_by(Receivable.profit_estimated.desc()).limit(1),
+         {'ix_receivables_status_profit'}),
+        ('Logs por tipo e data',
+         Log.query.filter(Log.type == 'optimization').order_by(Log.created_at.desc()),
+         {'ix_logs_type_created'}),
+        ('Transações da carteira',
+         Transaction.query.filter(Transaction.wallet_id == USER_A).order_by(Transaction.created_at.desc()),
+         {'ix_transactions_wallet_created'}),
+        ('Membros do grupo',
+         GroupMember.query.filter(GroupMember.group_id == GROUP),
+         {'ix_group_members_group'}),
+    ]
+
+
+def seed_debts(users=200, debts_per_user=20):
+    """Dívidas espalhadas entre muitos usuários, como em produção (desfeitas no rollback final)"""
+    user_ids = [USER_A, USER_B] + [str(uuid.uuid4()) for _ in range(users - 2)]
+    db.session.execute(User.__table__.insert(), [
+        {'id': user_id, 'name': f'Usuário {i}', 'email': f'{user_id}@check.local', 'password_hash': 'x'}
+        for i, user_id in enumerate(user_ids)
+    ])
+    db.session.execute(Group.__table__.insert(), [{'id': GROUP, 'name': 'Verificação', 'created_by': USER_A}])
+    expense_ids = [str(uuid.uuid4()) for _ in range(users)]
+    db.session.execute(Expense.__table__.insert(), [
+        {'id': expense_id, 'group_id': GROUP, 'payer_id': user_ids[i], 'description': 'Despesa', 'amount': 10.0}
+        for i, expense_id in enumerate(expense_ids)
+    ])
+
+    rng = random.Random(0)
+    statuses = ['pending', 'paid', 'cancelled', 'sold_as_title']
+    db.session.execute(Debt.__table__.insert(), [
+        {
+            'id': str(uuid.uuid4()), 'expense_id': rng.choice(expense_ids), 'group_id': GROUP, 'debtor_id': debtor_id,
+            'creditor_id': rng.choice(user_ids), 'amount': 10.0, 'status': rng.choice(statuses),
+            'source': rng.choice(['group_debt', 'virtual_payment'])
+        }
+        for debtor_id in user_ids for _ in range(debts_per_user)
+    ])
+    db.session.flush()
+
+
+def explain(query):
+    """Plano da consulta como texto, com os parâmetros reais"""
+    connection = db.session.connection()
+    dialect = connection.dialect
+    compiled = query.statement.compile(dialect=dialect, compile_kwargs={'render_postcompile': True})
+    params = {
+        key: value.isoformat() if isinstance(value, datetime) else value
+        for key, value in compiled.construct_params().items()
+    }
+
+    if dialect.name == 'sqlite':
+        args = tuple(params[key] for key in compiled.positiontup)
+        rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), args).all()
+        return '\n'.join(str(row[-1]) for row in rows)
+
+    rows = connection.exec_driver_sql('EXPLAIN ' + str(compiled), params).all()
+    return '\n'.join(str(row[0]) for row in rows)
+
+
+def main():
+    with app.app_context():
+        upgrade_schema()
+
+        if db.engine.dialect.name == 'postgresql':
+            # Tabelas pequenas fazem o planner preferir seq scan; aqui só importa se o índice serve
+            db.session.execute(db.text('SET enable_seqscan = off'))
+
+        # Com tabelas vazias e sem estatísticas a escolha do planner é arbitrária
+        seed_debts()
+        db.session.execute(db.text('ANALYZE'))
+
+        failures = 0
+        for description, query, expected in hot_queries():
+            plan = explain(query)
+            used = sorted(name for name in expected if re.search(rf'\b{name}\b', plan))
+            if used:
+                print(f"✅ {description}: {', '.join(used)}")
+            else:
+                failures += 1
+                print(f"❌ {description}: esperado um de {sorted(expected)}")
+                print('   ' + plan.replace('\n', '\n   '))
+
+        db.session.rollback()
+
+        print(f"\n{len(hot_queries()) - failures} de {len(hot_queries())} consultas usando índice")
+        return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Verifica que as rotas mais pesadas fazem um número fixo de consultas, independente do volume
+
+Monta o mesmo cenário em dois tamanhos (usuários diferentes no mesmo banco) e conta os
+comandos SQL de cada rota; o número precisa ser igual nos dois tamanhos.
+
+Uso:
+    python check_query_counts.py [--small 5] [--large 120]
+    DATABASE_URL=postgresql://... python check_query_counts.py
+"""
+
+import sys
+import os
+import io
+import uuid
+import argparse
+import tempfile
+import contextlib
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+if 'DATABASE_URL' not in os.environ:
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'check_query_counts.db')
+
+from sqlalchemy import event
+from flask_jwt_extended import create_access_token
+from app import create_app, db
+from app.models.user import User, GroupMember
+from app.models.group import Group
+from app.models.expense import Expense
+from app.models.debt import Debt
+from app.models.receivable import Receivable
+from app.models.wallet import Wallet
+from app.services.migrations import upgrade_schema
+from app.services.balance_service import BalanceService
+
+app = create_app()
+
+# (descrição, rota GET)
+ROUTES = [
+    ('Dívidas do usuário', '/api/debts/'),
+    ('Dívidas consolidadas para o marketplace', '/api/debts/consolidated'),
+    ('Dívidas categorizadas (insights)', '/api/insights/debts-categorized'),
+    ('Resumo financeiro (insights)', '/api/insights/summary'),
+    ('Perfil do usuário', '/api/user/profile'),
+]
+
+
+def create_scenario(size):
+    """Usuário principal com `size` contrapartes: dívidas nos dois sentidos e títulos vendidos"""
+    user_id = str(uuid.uuid4())
+    other_ids = [str(uuid.uuid4()) for _ in range(size)]
+    user_ids = [user_id, *other_ids]
+
+    db.session.execute(User.__table__.insert(), [
+        {'id': uid, 'name': f'Usuário {i}', 'email': f'{uid}@check.local', 'password_hash': 'x'}
+        for i, uid in enumerate(user_ids)
+    ])
+    db.session.execute(Wallet.__table__.insert(), [
+        {'id': str(uuid.uuid4()), 'user_id': uid, 'balance': 0.0} for uid in user_ids
+    ])
+
+    group = Group(name=f'Verificação {size}', created_by=user_id)
+    db.session.add(group)
+    db.session.flush()
+    db.session.execute(GroupMember.__table__.insert(), [
+        {'id': str(uuid.uuid4()), 'group_id': group.id, 'user_id': uid} for uid in user_ids
+    ])
+
+    debt_rows, receivable_rows = [], []
+    for i, other_id in enumerate(other_ids):
+        # Despesa paga pelo usuário (a contraparte deve) e outra paga pela contraparte
+        for payer_id, debtor_id, creditor_id in ((user_id, other_id, user_id), (other_id, user_id, other_id)):
+            expense = Expense(group_id=group.id, payer_id=payer_id, description=f'Despesa {i}', amount=30.0)
+            db.session.add(expense)
+            db.session.flush()
+            debt_rows.append({
+                'id': str(uuid.uuid4()), 'expense_id': expense.id, 'group_id': group.id, 'debtor_id': debtor_id,
+                'creditor_id': creditor_id, 'amount': 10.0 + i % 5 if payer_id == user_id else 4.0,
+                'status': 'pending', 'source': 'group_debt'
+            })
+        if i % 3 == 0:
+            # Título consolidado da contraparte comprado pelo usuário
+            receivable_rows.append({
+                'id': str(uuid.uuid4()), 'owner_id': user_id, 'buyer_id': user_id,
+                'consolidated_group_id': other_id, 'nominal_amount': 10.0, 'selling_price': 8.0,
+                'status': 'sold'
+            })
+    db.session.execute(Debt.__table__.insert(), debt_rows)
+    if receivable_rows:
+        db.session.execute(Receivable.__table__.insert(), receivable_rows)
+    # Saldos materializados, como depois das rotas de despesa (a contagem mede o estado normal)
+    BalanceService.rebuild_group(group.id)
+    db.session.commit()
+    return user_id
+
+
+def count_queries(client, engine, token, path):
+    statements = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', on_execute)
+    try:
+        # Silencia os prints de debug das rotas
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = client.get(path, headers={'Authorization': f'Bearer {token}'})
+    finally:
+        event.remove(engine, 'before_cursor_execute', on_execute)
+    return response.status_code, len(statements)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--small', type=int, default=5)
+    parser.add_argument('--large', type=int, default=120)
+    args = parser.parse_args()
+
+    # Cada rota monta o próprio snapshot do dashboard, sem reaproveitar o da rota anterior
+    app.config['DASHBOARD_SNAPSHOT_MAX_AGE'] = 0
+
+    with app.app_context():
+        upgrade_schema()
+        tokens = {size: create_access_token(identity=create_scenario(size)) for size in (args.small, args.large)}
+        engine = db.engine
+
+    # Requisições fora do app context do script, cada uma com o seu (como no servidor)
+    client = app.test_client()
+    failures = 0
+    for description, path in ROUTES:
+        results = {size: count_queries(client, engine, token, path) for size, token in tokens.items()}
+        (small_status, small), (large_status, large) = results[args.small], results[args.large]
+        if small_status == large_status == 200 and small == large:
+            print(f"✅ {description}: {small} consultas ({args.small} e {args.large} contrapartes)")
+        else:
+            failures += 1
+            print(f"❌ {description}: {small} consultas com {args.small} contrapartes, "
+                  f"{large} com {args.large} (status {small_status}/{large_status})")
+
+    print(f"\n{len(ROUTES) - failures} de {len(ROUTES)} rotas com número fixo de consultas")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
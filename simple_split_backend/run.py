@@ -6,14 +6,29 @@ from app.models.debt import Debt
 from app.models.log import Log
 from app.models.receivable import Receivable
 from app.models.wallet import Wallet
+from app.models.group_balance import GroupBalance
+from app.models.optimization_dirty import OptimizationDirty
+from app.models.optimization_lease import OptimizationLease
+from app.models.optimization_job import OptimizationJob
+from app.models.data_version import DataVersion
+from app.models.marketplace_stats import MarketplaceStats, MarketplaceDailyStats
 from app.services.init_data import initialize_data
+from app.services.migrations import upgrade_schema
+from app.services.order_book import OrderBook
 
 app = create_app()
 
+# O schema é atualizado uma única vez por deploy (`flask --app app:create_app upgrade-schema`,
+# no build/release), não aqui: cada worker do gunicorn importa este módulo
+with app.app_context():
+    # Carregar o livro de ofertas do marketplace em memória (banco novo: carrega na primeira leitura)
+    if OrderBook.enabled() and db.inspect(db.engine).has_table('receivables'):
+        OrderBook.rebuild()
+
 if __name__ == '__main__':
     with app.app_context():
-        # Criar tabelas
-        db.create_all()
+        # Criar tabelas e aplicar migrações (processo único em desenvolvimento)
+        upgrade_schema()
         
         # Inicializar dados (usuários Pablo, Cecília e Mariana)
         initialize_data()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Teste de concorrência da carteira: várias threads creditando e debitando a mesma wallet
+
+Cada operação usa Wallet.add_funds / withdraw_funds com commit próprio, como as rotas.
+No final o saldo gravado precisa bater com o extrato (créditos - débitos) e nunca
+pode ficar negativo; qualquer atualização perdida aparece como diferença.
+
+Uso:
+    python stress_wallet.py [--threads 16] [--operations 200]
+    DATABASE_URL=postgresql://... python stress_wallet.py
+"""
+
+import sys
+import os
+import time
+import uuid
+import random
+import argparse
+import tempfile
+import threading
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+if 'DATABASE_URL' not in os.environ:
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'stress_wallet.db')
+
+from sqlalchemy.exc import OperationalError
+from app import create_app, db
+from app.models.user import User
+from app.models.wallet import Wallet, Transaction
+from app.services.migrations import upgrade_schema
+
+app = create_app()
+
+INITIAL_BALANCE = 100.0
+
+
+def create_wallet():
+    user = User(name='Stress', email=f'{uuid.uuid4()}@stress.local', password_hash='x')
+    db.session.add(user)
+    db.session.flush()
+    wallet = Wallet(user_id=user.id, balance=0.0)
+    db.session.add(wallet)
+    db.session.flush()
+    wallet.add_funds(INITIAL_BALANCE, 'Saldo inicial')
+    return wallet.id
+
+
+def worker(wallet_id, operations, seed, stats, lock):
+    rnd = random.Random(seed)
+    counts = {'credits': 0, 'debits': 0, 'refused': 0, 'retries': 0}
+
+    with app.app_context():
+        for _ in range(operations):
+            amount = round(rnd.uniform(1, 30), 2)
+            credit = rnd.random() < 0.45
+            while True:
+                try:
+                    wallet = db.session.get(Wallet, wallet_id)
+                    if credit:
+                        wallet.add_funds(amount, 'Crédito stress')
+                        counts['credits'] += 1
+                    elif wallet.withdraw_funds(amount, 'Débito stress'):
+                        counts['debits'] += 1
+                    else:
+                        db.session.rollback()
+                        counts['refused'] += 1
+                    break
+                except OperationalError:
+                    # SQLite: banco bloqueado por outro escritor; tenta de novo
+                    db.session.rollback()
+                    counts['retries'] += 1
+                    time.sleep(rnd.uniform(0, 0.005))
+        db.session.remove()
+
+    with lock:
+        for key, value in counts.items():
+            stats[key] += value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--operations', type=int, default=200, help='operações por thread')
+    args = parser.parse_args()
+
+    with app.app_context():
+        upgrade_schema()
+        wallet_id = create_wallet()
+
+    stats = {'credits': 0, 'debits': 0, 'refused': 0, 'retries': 0}
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(target=worker, args=(wallet_id, args.operations, seed, stats, lock))
+        for seed in range(args.threads)
+    ]
+
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        balance = db.session.query(Wallet.balance).filter(Wallet.id == wallet_id).scalar()
+        totals = dict(
+            db.session.query(Transaction.type, db.func.sum(Transaction.amount))
+            .filter(Transaction.wallet_id == wallet_id)
+            .group_by(Transaction.type)
+            .all()
+        )
+        logged = Transaction.query.filter_by(wallet_id=wallet_id).count()
+
+    expected = totals.get('credit', 0.0) - totals.get('debit', 0.0)
+    operations = args.threads * args.operations
+
+    print(f"{operations} operações em {args.threads} threads: {elapsed:.2f}s ({operations / elapsed:.0f} ops/s)")
+    print(f"créditos {stats['credits']}, débitos {stats['debits']}, recusados por saldo {stats['refused']}, "
+          f"retentativas {stats['retries']}")
+    print(f"saldo gravado R${balance:.2f}, extrato R${expected:.2f}")
+
+    ok = (
+        abs(balance - expected) < 0.005
+        and balance >= 0
+        and logged == stats['credits'] + stats['debits'] + 1
+    )
+    print('✅ saldo consistente com o extrato' if ok else '❌ saldo diverge do extrato')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())